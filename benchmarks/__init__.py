@@ -0,0 +1,9 @@
+"""
+Benchmarks of the ranking_system engines, run from the repository root with
+
+    python -m benchmarks                     # all of them
+    python -m benchmarks layout snapshot     # by name
+    python -m benchmarks compare old.json new.json
+
+Correctness checks live in the tests; benchmarks report time, memory and ranking quality.
+"""
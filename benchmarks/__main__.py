@@ -0,0 +1,51 @@
+import sys
+
+from .engines import bench_incremental, bench_sharded, bench_basic_backend, bench_scheduler, \
+    bench_temporal, bench_teams, bench_stochastic, bench_streaming, bench_compression, \
+    bench_hyperparameters
+from .kernels import bench_skill_aggregation, bench_moment_kernel, bench_layout, \
+    bench_dtype_policy, bench_profiling
+from .serving import bench_snapshot, bench_prediction, bench_ranking, bench_ingestion, \
+    bench_rank_uncertainty, bench_cold_start
+from .suite import bench_suite, compare_suite
+
+
+def main(argv) -> int:
+    """
+    Runs the benchmarks named in `argv` (all of them by default), or compares two suite results
+    with `compare BASELINE RESULTS`, returning the exit status.
+    """
+    benchmarks = dict(aggregation=bench_skill_aggregation,
+                      incremental=bench_incremental,
+                      moments=bench_moment_kernel,
+                      layout=bench_layout,
+                      sharded=bench_sharded,
+                      snapshot=bench_snapshot,
+                      prediction=bench_prediction,
+                      ranking=bench_ranking,
+                      basic=bench_basic_backend,
+                      ingestion=bench_ingestion,
+                      scheduler=bench_scheduler,
+                      temporal=bench_temporal,
+                      teams=bench_teams,
+                      dtype=bench_dtype_policy,
+                      profiling=bench_profiling,
+                      stochastic=bench_stochastic,
+                      streaming=bench_streaming,
+                      compression=bench_compression,
+                      rank_uncertainty=bench_rank_uncertainty,
+                      hyperparameters=bench_hyperparameters,
+                      cold_start=bench_cold_start,
+                      suite=bench_suite)
+    if argv[:1] == ['compare']:
+        return int(compare_suite(*argv[1:3]) > 0)
+    unknown = [name for name in argv if name not in benchmarks]
+    if unknown:
+        raise ValueError(f'Unknown benchmarks {unknown}, expected some of {list(benchmarks)}')
+    for name in argv or benchmarks:
+        benchmarks[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,129 @@
+"""
+Synthetic leagues and measurement helpers shared by the benchmarks.
+"""
+import resource
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from ranking_system.matrix_stats import PlayerStats, GameStats, WinLossHistory, \
+    PlayerStatsFactory, GameStatsFactory
+from ranking_system.simulation import simulate_games
+
+
+def synthetic_games(N: int,
+                    K: int,
+                    seed: int = 0,
+                    communities: int = 1,
+                    mixing: float = 0.01) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    0-based winner and loser ids of K random games between N players, with outcomes sampled
+    from the probit model on ground-truth skills drawn from the prior. Players are split into
+    `communities` contiguous blocks of ids; a game pairs two players of the same community
+    except for a `mixing` fraction of uniformly drawn pairings.
+    """
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N)
+    p1 = rng.integers(0, N, size=K)
+    p2 = (p1 + rng.integers(1, N, size=K)) % N
+    if communities > 1:
+        size = N // communities
+        start = (p1 // size).clip(max=communities - 1) * size
+        stop = np.where(start + 2 * size > N, N, start + size)
+        p2_local = start + (p1 - start + rng.integers(1, size, size=K)) % (stop - start)
+        p2 = np.where(rng.random(K) < mixing, p2, p2_local)
+    p1_wins = rng.standard_normal(K) < skills[p1] - skills[p2]
+    return np.where(p1_wins, p1, p2), np.where(p1_wins, p2, p1)
+
+
+def power_law_games(N: int,
+                    K: int,
+                    exponent: float = 2.5,
+                    communities: int = 1,
+                    mixing: float = 0.05,
+                    seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    0-based winner and loser ids of K games between N players, and the players' ground-truth
+    skills drawn from the prior. Players are picked with probability proportional to an
+    activity drawn from a Pareto law of density exponent `exponent`, so that the number of
+    games per player follows a power law. Players are split into `communities` contiguous
+    blocks of ids; the opponent, picked with the same weights, is from the player's community
+    except for a `mixing` fraction drawn from the whole league. Outcomes are sampled with
+    `simulate_games` from the exact skills, i.e. the probit model with unit performance noise.
+    """
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N)
+    cumulative = np.cumsum(rng.pareto(exponent - 1., size=N) + 1.)
+    p1 = np.searchsorted(cumulative, rng.random(K) * cumulative[-1], side='right').clip(max=N - 1)
+    size = N // communities
+    start = (p1 // size).clip(max=communities - 1) * size
+    stop = np.where(start + 2 * size > N, N, start + size)
+    mixed = rng.random(K) < mixing
+    low = np.where(mixed | (start == 0), 0., cumulative[start - 1])
+    high = np.where(mixed, cumulative[-1], cumulative[stop - 1])
+    p2 = np.searchsorted(cumulative, low + rng.random(K) * (high - low),
+                         side='right').clip(max=N - 1)
+    # a player drawn against itself plays the next player of its community instead
+    p2 = np.where(p2 == p1, start + (p1 - start + 1) % (stop - start), p2)
+    winner_ids, losser_ids = simulate_games(skills, np.full((N,), np.inf),
+                                            np.stack([p1, p2], axis=1), rng)
+    return winner_ids, losser_ids, skills
+
+
+def synthetic_game_df(N: int, K: int, seed: int = 0) -> pd.DataFrame:
+    """
+    `synthetic_games` as a games table with 1-based `winner`/`losser` columns, as in
+    data/games.csv.
+    """
+    winner_ids, losser_ids = synthetic_games(N, K, seed)
+    return pd.DataFrame({'winner': winner_ids + 1, 'losser': losser_ids + 1})
+
+
+def synthetic_league(N: int,
+                     K: int,
+                     seed: int = 0) -> Tuple[PlayerStats, GameStats, WinLossHistory]:
+    game_df = synthetic_game_df(N, K, seed)
+    player_df = pd.DataFrame({'name': np.arange(N)})
+    player_stats, _, N = PlayerStatsFactory.create_from_dataframe(player_df)
+    game_stats, history = GameStatsFactory.create_from_dataframe(game_df, N)
+    return player_stats, game_stats, history
+
+
+def repeated_pair_games(N: int, K: int, num_pairs: int, exponent: float = 1.2,
+                        seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Heavy-repeat workload, like a vote log: `num_pairs` random pairings of N players, each game
+    picking one with Zipf(`exponent`) popularity, and its outcome sampled from true N(0, 1)
+    skills.
+    """
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, N - 1, size=(num_pairs, 2))
+    pairs[:, 1] += pairs[:, 1] >= pairs[:, 0]
+    popularity = np.arange(1, num_pairs + 1, dtype=np.float64) ** -exponent
+    picks = np.searchsorted(np.cumsum(popularity / popularity.sum()), rng.random(K))
+    picks = np.minimum(picks, num_pairs - 1)
+    skills = rng.standard_normal(N)
+    return simulate_games(skills, np.full(N, np.inf), pairs[picks], rng)
+
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of the process in kB. Reads VmHWM where available, which unlike
+    `ru_maxrss` is not inherited across the exec of a spawned process.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
@@ -0,0 +1,432 @@
+"""
+Benchmarks of the EP engines against each other and against the implementations they replaced:
+incremental refits, sharding, the array-backed BasicEPLoop, scheduling, temporal and team games,
+stochastic and streaming EP, compressed games and the hyperparameter search.
+"""
+import os
+import time
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+from ranking_system.basic_ep import BasicEPLoop
+from ranking_system.games_players import Player, PlayerList, Game, GameList
+from ranking_system.hyperparameters import hyperparameter_search
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory
+from ranking_system.messages import GameToSkill, MarginalSkills, SkillToGame, \
+    GameToPerformance, PerformanceToGame, MarginalPerformance, Skill
+from ranking_system.parallel_ep import ShardedMatrixEPLoop
+from ranking_system.scheduler import schedule_matches
+from ranking_system.stochastic_ep import StochasticEPLoop
+from ranking_system.streaming import StreamingRanker
+from ranking_system.team_ep import TeamEPLoop
+from ranking_system.temporal_ep import TemporalEPLoop
+
+from .common import synthetic_games, synthetic_game_df, power_law_games, repeated_pair_games
+
+
+def bench_incremental(N: int = 10 ** 4,
+                      K: int = 10 ** 5,
+                      new_games: int = 10 ** 3,
+                      num_iterations: int = 50,
+                      num_sweeps: int = 10):
+    """
+    Compare `add_games` + `refine` after a converged fit against a full re-run on all the games.
+    """
+    game_df = synthetic_game_df(N, K + new_games)
+    old_df, new_df = game_df.iloc[:K].reset_index(drop=True), game_df.iloc[K:]
+    player_stats, _, N = PlayerStatsFactory.create_from_dataframe(
+        pd.DataFrame({'name': np.arange(N)}))
+    game_stats, history = GameStatsFactory.create_from_dataframe(old_df, N)
+    ep = MatrixEPLoop(player_stats.copy(), game_stats, history, list(range(N)))
+    ep.run(num_iterations, logging=False)
+
+    t0 = time.perf_counter()
+    ep.add_games(new_df)
+    ep.refine(num_sweeps, scope='neighbourhood')
+    incremental = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    game_stats, history = GameStatsFactory.create_from_dataframe(game_df, N)
+    full_ep = MatrixEPLoop(player_stats.copy(), game_stats, history, list(range(N)))
+    full_ep.run(num_iterations, logging=False)
+    full = time.perf_counter() - t0
+
+    mean_diff = np.abs(ep.player_stats[:, 0, 0] - full_ep.player_stats[:, 0, 0])
+    std_diff = np.abs(1. / np.sqrt(ep.player_stats[:, 0, 1]) -
+                      1. / np.sqrt(full_ep.player_stats[:, 0, 1]))
+    print(f'N={N} K={K} +{new_games} games')
+    print(f'full re-run ({num_iterations} sweeps): {full:.3f}s, '
+          f'refine ({num_sweeps} sweeps): {incremental:.3f}s, speedup {full / incremental:.1f}x')
+    print(f'skill mean abs diff: max {mean_diff.max():.4f}, avg {mean_diff.mean():.5f}; '
+          f'skill std abs diff: max {std_diff.max():.4f}, avg {std_diff.mean():.5f}')
+
+
+def bench_sharded(N: int = 10 ** 5,
+                  K: int = 10 ** 6,
+                  communities: int = 64,
+                  num_iterations: int = 10,
+                  workers=None):
+    """
+    Time `ShardedMatrixEPLoop` against `MatrixEPLoop` on a league of loosely connected
+    communities, for an increasing number of worker processes.
+    """
+    workers = workers or sorted({1, 2, 4, 8, os.cpu_count()} - {w for w in (2, 4, 8)
+                                                                if w > os.cpu_count()})
+    winner_ids, losser_ids = synthetic_games(N, K, communities=communities)
+    player_stats = np.zeros((N, 3, 2), dtype=np.float32)
+    player_stats[:, 1, 1] = 1.
+
+    def new_league():
+        return player_stats.copy(), GameStatsFactory.allocate(K), \
+            WinLossHistory(winner_ids, losser_ids, N), None
+
+    ep = MatrixEPLoop(*new_league())
+    t0 = time.perf_counter()
+    ep.run(num_iterations, logging=False)
+    serial = time.perf_counter() - t0
+    print(f'N={N} K={K} communities={communities} ({os.cpu_count()} cores available)')
+    print(f'MatrixEPLoop: {serial:.2f}s')
+    for num_workers in workers:
+        sharded = ShardedMatrixEPLoop(*new_league(), num_workers=num_workers)
+        t0 = time.perf_counter()
+        sharded.run(num_iterations, logging=False)
+        elapsed = time.perf_counter() - t0
+        error = np.abs(sharded.player_stats[:, 0, 0] - ep.player_stats[:, 0, 0]).max()
+        print(f'ShardedMatrixEPLoop, {num_workers} workers: {elapsed:.2f}s, speedup '
+              f'{serial / elapsed:.2f}x, max skill mean diff {error:.1e}')
+
+
+def object_ep_reference(winner_ids: np.ndarray, losser_ids: np.ndarray, N: int,
+                         num_iterations: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The previous object-per-message BasicEPLoop: one message dataclass per game edge, updated
+    game by game. Returns the marginal skills (means, precisions).
+    """
+    priors = [Skill(mean=0., precision=1.) for _ in range(N)]
+    marginals = [MarginalSkills() for _ in range(N)]
+    games = [dict(upwards_winner=SkillToGame(), upwards_losser=SkillToGame(),
+                  downwards_winner=GameToSkill(mean=0., precision=0.),
+                  downwards_losser=GameToSkill(mean=0., precision=0.),
+                  upwards_game=GameToPerformance(), downwards_game=PerformanceToGame(),
+                  marginal_performance=MarginalPerformance()) for _ in range(len(winner_ids))]
+    games_played = [[] for _ in range(N)]
+    for game, winner, losser in zip(games, winner_ids, losser_ids):
+        games_played[winner].append(game['downwards_winner'])
+        games_played[losser].append(game['downwards_losser'])
+
+    def update_marginals():
+        for player in range(N):
+            marginals[player].update(priors[player], games_played[player])
+
+    update_marginals()
+    for _ in range(num_iterations):
+        for game, winner, losser in zip(games, winner_ids, losser_ids):
+            game['upwards_winner'].update(marginal_skill=marginals[winner],
+                                          message=game['downwards_winner'])
+            game['upwards_losser'].update(marginal_skill=marginals[losser],
+                                          message=game['downwards_losser'])
+            game['upwards_game'].update(winner_message=game['upwards_winner'],
+                                        losser_message=game['upwards_losser'])
+            game['marginal_performance'].update(players_message=game['upwards_game'])
+            game['downwards_game'].update(marginal_performance=game['marginal_performance'],
+                                          message=game['upwards_game'])
+            game['downwards_winner'].update(top_message=game['downwards_game'],
+                                            bottom_message=game['upwards_losser'],
+                                            is_winner=True)
+            game['downwards_losser'].update(top_message=game['downwards_game'],
+                                            bottom_message=game['upwards_winner'],
+                                            is_winner=False)
+        update_marginals()
+    return np.array([m.mean for m in marginals]), np.array([m.precision for m in marginals])
+
+
+def bench_basic_backend(N: int = 10 ** 3, K: int = 10 ** 4, num_iterations: int = 10):
+    """
+    Speed of the array-backed BasicEPLoop against the previous object-per-message loop, on the
+    same synthetic league. Their parity is checked by tests/test_basic_ep.py.
+    """
+    winner_ids, losser_ids = synthetic_games(N, K)
+    t0 = time.perf_counter()
+    object_ep_reference(winner_ids, losser_ids, N, num_iterations)
+    reference = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    players = PlayerList([Player(idx, f'player-{idx}') for idx in range(N)])
+    games = GameList([Game(int(w), int(l)) for w, l in zip(winner_ids, losser_ids)])
+    ep = BasicEPLoop(players, games)
+    setup = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ep.run(num_iterations, logging=False)
+    vectorised = time.perf_counter() - t0
+    print(f'N={N}, K={K}, {num_iterations} iterations')
+    print(f'object loop (previous): {reference:.3f}s, array backend: {vectorised:.3f}s '
+          f'(+{setup:.3f}s building the views), speed-up x{reference / vectorised:.0f}')
+
+
+def bench_scheduler(N: int = 500, games_per_round: int = None, max_games: int = 20000,
+                    thresholds=(0.7, 0.8, 0.85, 0.9), num_sweeps: int = 5, seed: int = 0):
+    """
+    Games needed for the EP ranking to reach each Kendall tau (against the ground-truth skills)
+    of `thresholds`, pairing players uniformly at random against `scheduler.schedule_matches`.
+    Outcomes are sampled from the probit model; after each round of games the loop is refitted
+    warm-started with `num_sweeps` sweeps.
+    """
+    games_per_round = games_per_round or N // 4
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N)
+
+    def random_pairs(ep):
+        p1 = rng.integers(0, N, size=games_per_round)
+        return np.stack([p1, (p1 + rng.integers(1, N, size=games_per_round)) % N], axis=1)
+
+    def active_pairs(ep):
+        return schedule_matches(ep.player_stats, games_per_round, num_random=N, rng=rng,
+                                noise=ep.noise)
+
+    print(f'N={N}, {games_per_round} games per round')
+    for name, pairing in (('random', random_pairs), ('active', active_pairs)):
+        player_stats = np.zeros((N, 3, 2), dtype=np.float32)
+        player_stats[:, 1, 1] = 1.
+        ep = MatrixEPLoop(player_stats, GameStatsFactory.allocate(0), WinLossHistory(
+            np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64), N), None)
+        reached, num_games, t0 = {}, 0, time.perf_counter()
+        while num_games < max_games and len(reached) < len(thresholds):
+            pairs = (random_pairs if num_games == 0 else pairing)(ep)
+            p1_wins = rng.standard_normal(len(pairs)) < skills[pairs[:, 0]] - skills[pairs[:, 1]]
+            ep.add_games(pd.DataFrame(dict(
+                winner=np.where(p1_wins, pairs[:, 0], pairs[:, 1]) + 1,
+                losser=np.where(p1_wins, pairs[:, 1], pairs[:, 0]) + 1)))
+            ep.run(num_sweeps, logging=False)
+            num_games += len(pairs)
+            tau = scipy.stats.kendalltau(ep.player_stats[:, 0, 0], skills)[0]
+            for threshold in thresholds:
+                if tau >= threshold and threshold not in reached:
+                    reached[threshold] = num_games
+        summary = ', '.join(f'tau>={threshold}: {reached.get(threshold, f">{max_games}")}'
+                            for threshold in thresholds)
+        print(f'{name:>6}: games to {summary} ({time.perf_counter() - t0:.1f}s)')
+
+
+def bench_temporal(N: int = 10 ** 4, T: int = 100, K: int = 10 ** 6, step: float = 0.1,
+                   num_iterations: int = 30, seed: int = 0):
+    """
+    `TemporalEPLoop` against the static `MatrixEPLoop` on a league whose skills follow a random
+    walk of `step` standard deviation per period: Kendall tau of the inferred skills against
+    the true ones at the first, middle and last periods, time and number of skill variables.
+    """
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N) + np.cumsum(rng.normal(0., step, (T, N)), axis=0)
+    periods = rng.integers(0, T, size=K)
+    p1 = rng.integers(0, N, size=K)
+    p2 = (p1 + rng.integers(1, N, size=K)) % N
+    p1_wins = rng.standard_normal(K) < skills[periods, p1] - skills[periods, p2]
+    history = WinLossHistory(np.where(p1_wins, p1, p2), np.where(p1_wins, p2, p1), N)
+
+    static = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                          None)
+    t0 = time.perf_counter()
+    static.run(num_iterations, logging=False, tol=1e-3)
+    static_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    temporal = TemporalEPLoop(history, periods, drift=step ** 2)
+    report = temporal.run(num_iterations, logging=False, tol=1e-3)
+    temporal_time = time.perf_counter() - t0
+
+    print(f'N={N} T={T} K={K}: {len(temporal.node_stats)} player-periods of {N * T}')
+    print(f'MatrixEPLoop {static_time:.2f}s, TemporalEPLoop {temporal_time:.2f}s '
+          f'({report.iterations} forward-backward sweeps, {report.num_sanitised} messages '
+          f'sanitised)')
+    for t in (0, T // 2, T - 1):
+        static_tau = scipy.stats.kendalltau(static.player_stats[:, 0, 0], skills[t])[0]
+        temporal_tau = scipy.stats.kendalltau(temporal.skills_at(t)[0], skills[t])[0]
+        print(f'period {t}: Kendall tau static {static_tau:.3f}, temporal {temporal_tau:.3f}')
+
+
+def bench_teams(N: int = 10 ** 4, G: int = 10 ** 5, team_size: int = 2, num_teams: int = 4,
+                draw_margin: float = 0.5, num_iterations: int = 50, seed: int = 0):
+    """
+    `TeamEPLoop` on free-for-all games of `num_teams` teams of `team_size` players, ranked by
+    team performance (the sum of the skills plus unit noise per player) and tied when within
+    `draw_margin`: time, sweeps and Kendall tau of the inferred skills against the true ones.
+    Compared with `MatrixEPLoop` on the same outcomes expanded to one game per pair of players
+    of adjacent teams (draws dropped), which ignores that teammates share a performance.
+    """
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N)
+    size = team_size * num_teams
+    # distinct players per game: a random offset chain modulo N
+    players = (rng.integers(0, N, (G, 1)) +
+               np.cumsum(rng.integers(1, N // size, (G, size)), axis=1)) % N
+    performance = (skills[players] + rng.standard_normal((G, size))).reshape(
+        G, num_teams, team_size).sum(axis=2)
+    order = np.argsort(-performance, axis=1)
+    sorted_performance = np.take_along_axis(performance, order, axis=1)
+    tied = np.diff(-sorted_performance, axis=1) < draw_margin
+    ranks = np.empty((G, num_teams), dtype=np.int64)
+    np.put_along_axis(ranks, order, np.concatenate(
+        [np.zeros((G, 1), dtype=np.int64), np.cumsum(~tied, axis=1)], axis=1), axis=1)
+    df = pd.DataFrame(dict(game=np.repeat(np.arange(G), size),
+                           team=np.repeat(np.arange(G * num_teams), team_size),
+                           player=players.ravel() + 1,
+                           rank=np.repeat(ranks.ravel(), team_size)))
+
+    player_stats = np.zeros((N, 3, 2), dtype=np.float32)
+    player_stats[:, 1, 1] = 1.
+    t0 = time.perf_counter()
+    teams = TeamEPLoop.create_from_dataframe(df, player_stats.copy(), None, draw_margin)
+    report = teams.run(num_iterations, logging=False, tol=1e-3)
+    team_time = time.perf_counter() - t0
+
+    teams_by_rank = players.reshape(G, num_teams, team_size)[
+        np.arange(G)[:, None], order][:, :, :, None]
+    winners = np.broadcast_to(teams_by_rank[:, :-1], (G, num_teams - 1, team_size, team_size))
+    lossers = np.broadcast_to(teams_by_rank[:, 1:].swapaxes(2, 3),
+                              (G, num_teams - 1, team_size, team_size))
+    decided = np.broadcast_to(~tied[:, :, None, None], winners.shape)
+    history = WinLossHistory(winners[decided], lossers[decided], N)
+    t0 = time.perf_counter()
+    pairwise = MatrixEPLoop(player_stats.copy(), GameStatsFactory.allocate(history.K), history,
+                            None)
+    pairwise_report = pairwise.run(num_iterations, logging=False, tol=1e-3)
+    pairwise_time = time.perf_counter() - t0
+
+    team_tau = scipy.stats.kendalltau(teams.player_stats[:, 0, 0], skills)[0]
+    pairwise_tau = scipy.stats.kendalltau(pairwise.player_stats[:, 0, 0], skills)[0]
+    print(f'N={N} G={G} games of {num_teams}x{team_size}, {tied.mean():.1%} adjacent ties')
+    print(f'TeamEPLoop {team_time:.2f}s ({report.iterations} sweeps, '
+          f'{teams.comparisons.K} comparisons) Kendall tau {team_tau:.3f}')
+    print(f'MatrixEPLoop pairwise {pairwise_time:.2f}s ({pairwise_report.iterations} sweeps, '
+          f'{history.K} games) Kendall tau {pairwise_tau:.3f}')
+
+
+def bench_stochastic(N: int = 10 ** 5, K: int = 10 ** 6, num_iterations: int = 10,
+                     batch_sizes=(2 ** 12, 2 ** 14, 2 ** 16, 2 ** 18), step_size: float = 0.5,
+                     seed: int = 0):
+    """
+    `StochasticEPLoop` against full EP (`MatrixEPLoop` run to convergence) on a power-law
+    league: memory of the EP state, seconds per pass over the games, Kendall tau of the skills
+    against the true ones and against full EP, and mean/max absolute difference of the skill
+    means to full EP, for each minibatch size.
+    """
+    winner_ids, losser_ids, skills = power_law_games(N, K, communities=16, seed=seed)
+    history = WinLossHistory(winner_ids, losser_ids, N)
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                      None)
+    report = ep.run(100, logging=False, tol=1e-4)
+    reference = ep.player_stats[:, 0, 0].astype(np.float64)
+    print(f'N={N} K={K}')
+    state_bytes = ep.player_stats.nbytes + ep.game_stats.base.nbytes
+    print(f'{"full EP":>16} {state_bytes / 2 ** 20:7.1f}MB '
+          f'{np.mean(report.sweep_times[1:]):.3f}s/sweep ({report.iterations} sweeps) '
+          f'Kendall tau {scipy.stats.kendalltau(reference, skills)[0]:.4f}')
+    for batch_size in batch_sizes:
+        sep = StochasticEPLoop(PlayerStatsFactory.allocate(N), history, batch_size=batch_size,
+                               step_size=step_size, seed=seed)
+        report = sep.run(num_iterations, logging=False)
+        means = sep.player_stats[:, 0, 0]
+        difference = np.abs(means - reference)
+        print(f'SEP batch {batch_size:>6} {sep.nbytes / 2 ** 20:7.1f}MB '
+              f'{np.mean(report.sweep_times[1:]):.3f}s/pass ({report.iterations} passes) '
+              f'Kendall tau {scipy.stats.kendalltau(means, skills)[0]:.4f}, '
+              f'to full EP {scipy.stats.kendalltau(means, reference)[0]:.4f}, '
+              f'mean diff {difference.mean():.4f} (max {difference.max():.3f})')
+
+
+def bench_streaming(N: int = 10 ** 5, K: int = 10 ** 6, num_single: int = 10 ** 5,
+                    batch_sizes=(2 ** 10, 2 ** 14, 2 ** 16), tol: float = 1e-3, seed: int = 0):
+    """
+    Throughput (games/second) of the ADF `StreamingRanker` on a power-law league: game by game
+    with `update` over the first `num_single` games, and from a generator of (winner, losser)
+    tuples with `consume` for each micro-batch size. Then Kendall tau of the filtered skills
+    against the true ones, and EP sweeps to `tol` from the ADF warm start (`to_matrix_ep`)
+    against a cold start.
+    """
+    winner_ids, losser_ids, skills = power_law_games(N, K, communities=16, seed=seed)
+    print(f'N={N} K={K}')
+    ranker = StreamingRanker(PlayerStatsFactory.allocate(N))
+    t0 = time.perf_counter()
+    for winner, losser in zip(winner_ids[:num_single].tolist(), losser_ids[:num_single].tolist()):
+        ranker.update(winner, losser)
+    print(f'update   {num_single / (time.perf_counter() - t0):10.0f} games/s')
+    for batch_size in batch_sizes:
+        ranker = StreamingRanker(PlayerStatsFactory.allocate(N), batch_size=batch_size,
+                                 record_messages=True)
+        t0 = time.perf_counter()
+        ranker.consume(zip(winner_ids.tolist(), losser_ids.tolist()))
+        print(f'consume batch {batch_size:>6} {K / (time.perf_counter() - t0):10.0f} games/s, '
+              f'Kendall tau '
+              f'{scipy.stats.kendalltau(ranker.player_stats[:, 0, 0], skills)[0]:.4f}')
+    warm = ranker.to_matrix_ep().run(100, logging=False, tol=tol)
+    cold = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K),
+                        WinLossHistory(winner_ids, losser_ids, N), None)
+    cold_report = cold.run(100, logging=False, tol=tol)
+    print(f'EP to tol {tol}: {warm.iterations} sweeps from ADF, {cold_report.iterations} from '
+          f'the prior, Kendall tau '
+          f'{scipy.stats.kendalltau(cold.player_stats[:, 0, 0], skills)[0]:.4f}')
+
+
+def bench_compression(N: int = 10 ** 4, K: int = 10 ** 7, num_pairs: int = 10 ** 5,
+                      num_iterations: int = 10):
+    """
+    `MatrixEPLoop` on compressed (`WinLossHistory.compress`) against uncompressed games, on the
+    bundled data and on a `repeated_pair_games` workload: compression ratio, seconds per sweep
+    and the speedup, and max skill mean difference between the two (EP on the compressed
+    games being EP on the original ones, only rounding differs).
+    """
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+    bundled = WinLossHistory.create_from_csv(os.path.join(data, 'games.csv'),
+                                             len(pd.read_csv(os.path.join(data, 'players.csv'))))
+    workloads = dict(bundled=(bundled, 100),
+                     repeated=(WinLossHistory(*repeated_pair_games(N, K, num_pairs), N),
+                               num_iterations))
+    for name, (history, sweeps) in workloads.items():
+        compressed = history.compress()
+        runs = []
+        for games in (history, compressed):
+            ep = MatrixEPLoop(PlayerStatsFactory.allocate(games.N),
+                              GameStatsFactory.allocate(games.K), games, None)
+            report = ep.run(sweeps, logging=False)
+            runs.append((np.median(report.sweep_times[1:]), ep.player_stats[:, 0, 0]))
+        (full_time, full_means), (compressed_time, compressed_means) = runs
+        print(f'{name:8} K={history.K} -> {compressed.K} games '
+              f'(x{history.K / compressed.K:.1f}), {full_time:.4f}s -> {compressed_time:.4f}s '
+              f'per sweep (x{full_time / compressed_time:.1f}), max mean diff '
+              f'{np.abs(full_means - compressed_means).max():.1e}')
+
+
+def bench_hyperparameters(N: int = 10 ** 4, K: int = 2 * 10 ** 5, true_noise: float = 0.25,
+                          noises=(0.0625, 0.125, 0.25, 0.5, 1., 2.), num_workers: int = None,
+                          seed: int = 0):
+    """
+    `hyperparameter_search` on `power_law_games` whose outcomes are sampled with performance
+    noise `true_noise` (skills from the N(0, 1) prior): the evidence of each candidate noise,
+    whether the best one is the true one, and the EP sweeps and time of the search with and
+    without warm starts.
+    """
+    winner_ids, losser_ids, skills = power_law_games(N, K, seed=seed)
+    # resample the outcomes of the same pairings with the true noise
+    rng = np.random.default_rng(seed)
+    p1_wins = skills[winner_ids] - skills[losser_ids] + \
+        np.sqrt(true_noise) * rng.standard_normal(K) > 0.
+    history = WinLossHistory(np.where(p1_wins, winner_ids, losser_ids),
+                             np.where(p1_wins, losser_ids, winner_ids), N)
+    runs = {}
+    for warm_start in (False, True):
+        t0 = time.perf_counter()
+        runs[warm_start] = hyperparameter_search(history, noises, num_iterations=200, tol=1e-4,
+                                                 num_workers=num_workers, warm_start=warm_start)
+        elapsed = time.perf_counter() - t0
+        print(f'{"warm" if warm_start else "cold"} start: '
+              f'{sum(result.iterations for result in runs[warm_start])} sweeps, {elapsed:.2f}s')
+    cold = {result.noise: result for result in runs[False]}
+    for result in sorted(runs[True], key=lambda result: result.noise):
+        print(f'noise {result.noise:<7} log evidence {result.log_evidence:.1f} '
+              f'({result.iterations} sweeps warm, {cold[result.noise].iterations} cold)')
+    difference = max(abs(result.log_evidence - cold[result.noise].log_evidence)
+                     for result in runs[True])
+    print(f'best noise {runs[True][0].noise} (true {true_noise}), max evidence difference '
+          f'warm/cold {difference:.1e}')
@@ -0,0 +1,203 @@
+"""
+Benchmarks of the sweep kernels: skill aggregation, moment matching, the message store layout,
+dtype policies and the cost of profiling.
+"""
+import multiprocessing
+import resource
+import time
+import tracemalloc
+from typing import Dict, Tuple
+
+import numpy as np
+import scipy.stats
+
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import PlayerStats, GameStats, WinLossHistory, \
+    PlayerStatsFactory, GameStatsFactory, DTYPE_POLICIES
+from ranking_system.matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, \
+    MatrixWorkspace, _natural_mean
+from ranking_system.profiling import SweepProfiler, NULL_PROFILER
+from ranking_system.utils import psi_lambda
+
+from .common import synthetic_games, synthetic_league, best_of
+
+
+def loop_update_skill_marginals(game_stats: GameStats,
+                                 player_stats: PlayerStats,
+                                 history: WinLossHistory,
+                                 wins: Dict,
+                                 losses: Dict) -> Tuple[GameStats, PlayerStats]:
+    """
+    Reference per-player loop the incidence-based aggregation replaced.
+    """
+    downwards_l_precision = game_stats[:, 5, 1]
+    downwards_l_natural_mean = _natural_mean(downwards_l_precision, game_stats[:, 5, 0])
+    downwards_w_precision = game_stats[:, 6, 1]
+    downwards_w_natural_mean = _natural_mean(downwards_w_precision, game_stats[:, 6, 0])
+    for player_id in history.player_ids:
+        loss_idx, win_idx = losses[player_id], wins[player_id]
+        player_stats[player_id, 2, 1] = np.sum(downwards_l_precision[loss_idx])
+        player_stats[player_id, 2, 1] += np.sum(downwards_w_precision[win_idx])
+        player_stats[player_id, 2, 0] = np.sum(downwards_l_natural_mean[loss_idx])
+        player_stats[player_id, 2, 0] += np.sum(downwards_w_natural_mean[win_idx])
+    player_stats = MatrixSkillUpdates.update_marginal(player_stats)
+    for player_id in history.player_ids:
+        loss_idx, win_idx = losses[player_id], wins[player_id]
+        game_stats[win_idx, 7, :] = player_stats[player_id, 0, :]
+        game_stats[loss_idx, 8, :] = player_stats[player_id, 0, :]
+    return game_stats, player_stats
+
+
+def bench_skill_aggregation(sizes=(10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6),
+                            games_per_player: int = 10,
+                            max_loop_players: int = 10 ** 5,
+                            repeats: int = 3):
+    """
+    Time one skill-marginal sweep (gather + scatter between players and games) of the incidence
+    based `MatrixSkillUpdates` against the per-player reference loop.
+    """
+    print(f"{'N':>10} {'K':>10} {'loop (s)':>12} {'incidence (s)':>14} {'speedup':>9}")
+    for N in sizes:
+        K = games_per_player * N
+        player_stats, game_stats, history = synthetic_league(N, K)
+        rng = np.random.default_rng(0)
+        game_stats[:, :7, 1] = rng.uniform(0.5, 1.5, size=(K, 7))
+        game_stats[:, :7, 0] = rng.standard_normal((K, 7))
+        incidence = best_of(lambda: MatrixSkillUpdates().update_skill_marginals(
+            game_stats, player_stats, history), repeats)
+        if N <= max_loop_players:
+            loop_games, loop_players = game_stats.copy(), player_stats.copy()
+            wins, losses = history.wins, history.losses
+            loop = best_of(lambda: loop_update_skill_marginals(
+                loop_games, loop_players, history, wins, losses), 1)
+            print(f'{N:>10} {K:>10} {loop:>12.4f} {incidence:>14.4f} {loop / incidence:>8.1f}x')
+        else:
+            print(f"{N:>10} {K:>10} {'-':>12} {incidence:>14.4f} {'-':>9}")
+
+
+def bench_moment_kernel(size: int = 10 ** 6, repeats: int = 5):
+    """
+    Speed of the fused `psi_lambda` kernel against the previous moment matching step (three psi
+    evaluations, each a separate scipy.stats pdf and cdf call). Its accuracy in the tails is
+    checked by tests/test_utils.py.
+    """
+    def scipy_psi(x):
+        return scipy.stats.norm.pdf(x) / scipy.stats.norm.cdf(x)
+
+    def scipy_psi_lambda(x):
+        return scipy_psi(x), scipy_psi(x) * (scipy_psi(x) + x)
+
+    x = np.random.default_rng(0).normal(0., 3., size=size)
+    out = (np.empty_like(x), np.empty_like(x))
+    old = best_of(lambda: scipy_psi_lambda(x), repeats)
+    fused = best_of(lambda: psi_lambda(x), repeats)
+    fused_out = best_of(lambda: psi_lambda(x, out=out), repeats)
+    print(f'{size} points: scipy.stats {old:.4f}s, fused {fused:.4f}s, '
+          f'fused with out= {fused_out:.4f}s')
+
+
+def _layout_sweeps(N: int, K: int, columnar: bool, num_sweeps: int):
+    winner_ids, losser_ids = synthetic_games(N, K)
+    history = WinLossHistory(winner_ids, losser_ids, N)
+    player_stats = np.zeros((N, 3, 2), dtype=np.float32)
+    player_stats[:, 1, 1] = 1.
+    workspace = None
+    if columnar:
+        game_stats = GameStatsFactory.allocate(K)
+        workspace = MatrixWorkspace(K, game_stats.dtype)
+        workspace.buffers.fill(0.)
+        workspace.wide.fill(0.)
+    else:
+        game_stats = np.zeros((K, 9, 2), dtype=np.float32)
+    game_stats.fill(0.)
+    game_stats, player_stats = MatrixSkillUpdates().update_skill_marginals(
+        game_stats, player_stats, history, workspace)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for _ in range(num_sweeps):
+        game_stats = MatrixMessageUpdates().update_game_messages(game_stats, workspace)
+        game_stats, player_stats = MatrixSkillUpdates().update_skill_marginals(
+            game_stats, player_stats, history, workspace)
+    sweep_time = (time.perf_counter() - t0) / num_sweeps
+    _, peak_allocated = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return sweep_time, peak_allocated, rss_before, rss_after, game_stats.nbytes
+
+
+def bench_layout(sizes=(10 ** 5, 10 ** 6, 10 ** 7), games_per_player: int = 10,
+                 num_sweeps: int = 5):
+    """
+    Per-sweep time, message-store throughput and memory of the previous (K, 9, 2) C-ordered
+    layout updated through temporaries against the columnar layout updated in place through a
+    `MatrixWorkspace`. Each configuration runs in a fresh process so that the growth of its peak
+    RSS over the sweeps is comparable.
+    """
+    print(f"{'K':>10} {'layout':>9} {'sweep (s)':>10} {'GB/s':>7} {'peak alloc/sweep (MB)':>22} "
+          f"{'RSS growth (MB)':>16}")
+    context = multiprocessing.get_context('fork')
+    for K in sizes:
+        for columnar in (False, True):
+            with context.Pool(1) as pool:
+                sweep_time, peak_allocated, rss_before, rss_after, nbytes = pool.apply(
+                    _layout_sweeps, (K // games_per_player, K, columnar, num_sweeps))
+            print(f"{K:>10} {'columnar' if columnar else 'strided':>9} {sweep_time:>10.4f} "
+                  f"{nbytes / sweep_time / 1e9:>7.2f} {peak_allocated / 1e6:>22.1f} "
+                  f"{(rss_after - rss_before) / 1e3:>16.1f}")
+
+
+def bench_dtype_policy(N: int = 10 ** 5, K: int = 10 ** 7, num_iterations: int = 10,
+                       seed: int = 0):
+    """
+    `MatrixEPLoop` sweeps under each `DtypePolicy`, and under the default 'mixed' one with the
+    sanitiser off: seconds per sweep, messages sanitised, max skill mean difference to the
+    float64 run and Kendall tau of the skills against the true ones.
+    """
+    winner_ids, losser_ids = synthetic_games(N, K, seed)
+    skills = np.random.default_rng(seed).standard_normal(N)
+    history = WinLossHistory(winner_ids, losser_ids, N)
+    runs = {}
+    for policy, sanitise in (('float64', 'skip'), ('mixed', 'skip'), ('mixed', None),
+                             ('float32', 'skip')):
+        storage = DTYPE_POLICIES[policy].storage
+        ep = MatrixEPLoop(PlayerStatsFactory.allocate(N, storage),
+                          GameStatsFactory.allocate(K, storage), history, None,
+                          dtype_policy=policy, sanitise=sanitise)
+        report = ep.run(num_iterations, logging=False)
+        runs[policy, sanitise] = ep.player_stats[:, 0, 0].astype(np.float64), report
+
+    reference = runs['float64', 'skip'][0]
+    print(f'N={N} K={K}, {num_iterations} sweeps')
+    for (policy, sanitise), (means, report) in runs.items():
+        tau = scipy.stats.kendalltau(means, skills)[0]
+        print(f'{policy:8} sanitise={str(sanitise):5} '
+              f'{np.mean(report.sweep_times[1:]):.3f}s/sweep, '
+              f'{report.num_sanitised} sanitised, max mean diff to float64 '
+              f'{np.abs(means - reference).max():.1e}, Kendall tau {tau:.4f}')
+
+
+def bench_profiling(N: int = 10 ** 5, K: int = 10 ** 7, num_iterations: int = 10):
+    """
+    Cost of the instrumentation of `MatrixEPLoop.run`: seconds per sweep without a profiler,
+    with a `SweepProfiler` and with memory tracing, then the per-stage breakdown of the
+    profiled run and the allocations of the traced one.
+    """
+    winner_ids, losser_ids = synthetic_games(N, K)
+    history = WinLossHistory(winner_ids, losser_ids, N)
+    profilers = dict(disabled=None, timers=SweepProfiler(),
+                     tracemalloc=SweepProfiler(trace_memory=True))
+    print(f'N={N} K={K}, {num_iterations} sweeps')
+    for name, profiler in profilers.items():
+        ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                          None)
+        report = ep.run(num_iterations, logging=False, profiler=profiler or NULL_PROFILER)
+        if profiler is not None:
+            profiler.close()
+        print(f'{name:12} {np.mean(report.sweep_times[1:]):.3f}s/sweep')
+    timers, traced = profilers['timers'], profilers['tracemalloc']
+    sweep_seconds = sum(metrics.seconds for metrics in timers.sweeps)
+    for stage, seconds in timers.totals().items():
+        peak = max(metrics.stage_peak_bytes.get(stage, 0) for metrics in traced.sweeps)
+        print(f'  {stage:34} {seconds / len(timers.sweeps):.3f}s/sweep '
+              f'({seconds / sweep_seconds:5.1%}), peak allocation {peak / 2 ** 20:7.1f}MB')
@@ -0,0 +1,219 @@
+"""
+Benchmarks of serving a fitted model: snapshots, predictions, ranking queries, rank uncertainty,
+game ingestion and the cold start of the command line.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory
+from ranking_system.rank_uncertainty import RankUncertainty
+
+from .common import synthetic_games, synthetic_league, power_law_games, best_of, peak_rss
+
+
+def bench_snapshot(N: int = 10 ** 6, K: int = 10 ** 7, path: str = None):
+    """
+    Save a `MatrixEPLoop` snapshot and time reopening it memory-mapped (then reading the top-10
+    players from it) against reading it fully into memory.
+    """
+    path = path or os.path.join(tempfile.gettempdir(), 'bench_snapshot.ep')
+    player_stats, game_stats, history = synthetic_league(N, K)
+    ep = MatrixEPLoop(player_stats, game_stats, history, [f'player-{i}' for i in range(N)])
+    ep.run(1, logging=False)
+    t0 = time.perf_counter()
+    ep.save(path)
+    save = time.perf_counter() - t0
+    del ep, player_stats, game_stats, history
+
+    t0 = time.perf_counter()
+    ep = MatrixEPLoop.load(path, mmap=True)
+    load_mmap = time.perf_counter() - t0
+    top = np.argpartition(-ep.player_stats[:, 0, 0], 10)[:10]
+    names = [ep.player_names[i] for i in top]
+    top_10 = time.perf_counter() - t0
+    del ep
+    t0 = time.perf_counter()
+    MatrixEPLoop.load(path, mmap=False)
+    load_read = time.perf_counter() - t0
+    print(f'N={N} K={K}: snapshot {os.path.getsize(path) / 1e6:.0f}MB written in {save:.2f}s')
+    print(f'open memory-mapped: {load_mmap * 1e3:.1f}ms ({top_10 * 1e3:.1f}ms with top-10 '
+          f'{names[0]}...), read into memory: {load_read * 1e3:.0f}ms')
+    os.remove(path)
+
+
+def bench_prediction(N: int = 10 ** 5, num_pairs: int = 10 ** 6, bracket_size: int = 1024,
+                     n_samples: int = 10 ** 4, num_single: int = 10 ** 3):
+    """
+    Batch win probabilities, match and tournament simulation against per-pair `simulate_game`.
+    """
+    player_stats, game_stats, history = synthetic_league(N, 10 * N)
+    ep = MatrixEPLoop(player_stats, game_stats, history, list(range(N)))
+    ep.run(5, logging=False)
+    rng = np.random.default_rng(0)
+    pairs = rng.integers(0, N, size=(num_pairs, 2))
+
+    t0 = time.perf_counter()
+    for p1, p2 in pairs[:num_single]:
+        ep.simulate_game(p1, p2, logging=False)
+    single = (time.perf_counter() - t0) / num_single
+    probability = best_of(lambda: ep.predict_win_probability(pairs[:, 0], pairs[:, 1]), 3)
+    simulation = best_of(lambda: ep.simulate_games(pairs, rng=rng), 3)
+    bracket = rng.permutation(N)[:bracket_size]
+    tournament = best_of(lambda: ep.simulate_tournament(bracket, n_samples, rng=rng), 3)
+    print(f'simulate_game: {single * 1e6:.1f}us per pair')
+    print(f'predict_win_probability: {probability / num_pairs * 1e9:.1f}ns per pair '
+          f'({num_pairs} pairs in {probability:.3f}s)')
+    print(f'simulate_games: {simulation / num_pairs * 1e9:.1f}ns per pair')
+    print(f'simulate_tournament: {n_samples} samples of a {bracket_size}-player bracket in '
+          f'{tournament:.3f}s')
+
+
+def bench_ranking(N: int = 10 ** 6, k: int = 10, repeats: int = 5):
+    """
+    Cost of the previous full-sort `produce_ranking` against `Ranking` queries, cold (right
+    after the skills changed) and cached.
+    """
+    player_stats, game_stats, history = synthetic_league(N, 5 * N)
+    ep = MatrixEPLoop(player_stats, game_stats, history, [f'player-{i}' for i in range(N)])
+    ep.run(2, logging=False)
+
+    def full_sort():
+        skills = ep.player_stats[:, 0, 0]
+        return np.flip(np.take_along_axis(np.array(ep.player_names), skills.argsort(), axis=0))
+
+    def cold(query):
+        def run_query():
+            ep.player_stats = ep.player_stats
+            return query(ep.ranking())
+        return run_query
+
+    results = [('full argsort + names (previous)', best_of(full_sort, repeats), None)]
+    for name, query in (('top_k', lambda ranking: ranking.top_k(k)),
+                        ('page', lambda ranking: ranking.page(10 * k, k)),
+                        ('conservative top_k', lambda ranking: ep.ranking(3.).top_k(k)),
+                        ('rank_of', lambda ranking: ranking.rank_of(N // 2))):
+        ep.player_stats = ep.player_stats
+        query(ep.ranking())
+        results.append((name, best_of(cold(query), repeats),
+                        best_of(lambda: query(ep.ranking()), repeats)))
+    print(f'N={N}, k={k}')
+    for name, cold_time, cached_time in results:
+        cached = f', cached {cached_time * 1e6:.1f}us' if cached_time is not None else ''
+        print(f'{name}: {cold_time * 1e3:.1f}ms{cached}')
+
+
+def _ingest(loader: str, path: str, N: int, K: int):
+    rss_before = peak_rss()
+    t0 = time.perf_counter()
+    if loader == 'csv (previous)':
+        game_stats, history = GameStatsFactory.create_from_dataframe(pd.read_csv(path), N)
+    elif loader == 'csv chunked':
+        game_stats, history = GameStatsFactory.create_from_csv(path, N)
+    else:
+        rng = np.random.default_rng(0)
+        records = ({'winner': int(w), 'losser': int(l)}
+                   for w, l in zip(rng.integers(1, N + 1, K), rng.integers(1, N + 1, K)))
+        if loader == 'records (previous)':
+            game_stats, history = GameStatsFactory.create_from_dataframe(
+                pd.DataFrame(records), N)
+        else:
+            game_stats, history = GameStatsFactory.create_from_records(records, N)
+    elapsed = time.perf_counter() - t0
+    return elapsed, rss_before, peak_rss(), history.K
+
+
+def bench_ingestion(N: int = 10 ** 5, K: int = 5 * 10 ** 6, path: str = None):
+    """
+    Throughput and peak RSS growth of the games loaders: whole-table `pd.read_csv` against
+    chunked CSV reading, and a DataFrame built from all the records of a (simulated) Mongo
+    cursor against batched consumption. Each loader runs in a fresh process.
+    """
+    path = path or os.path.join(tempfile.gettempdir(), 'bench_ingestion.csv')
+    winner_ids, losser_ids = synthetic_games(N, K)
+    pd.DataFrame(dict(winner=winner_ids + 1, losser=losser_ids + 1,
+                      winner_name=[f"['player-{i}']" for i in winner_ids],
+                      losser_name=[f"['player-{i}']" for i in losser_ids])).to_csv(path)
+    del winner_ids, losser_ids
+    print(f'N={N} K={K}, games csv {os.path.getsize(path) / 1e6:.0f}MB')
+    context = multiprocessing.get_context('spawn')
+    for loader in ('csv (previous)', 'csv chunked', 'records (previous)', 'records batched'):
+        with context.Pool(1) as pool:
+            elapsed, rss_before, rss_after, num_games = pool.apply(_ingest, (loader, path, N, K))
+        assert num_games == K
+        print(f'{loader:>18}: {K / elapsed / 1e6:.2f}M games/s, peak RSS growth '
+              f'{(rss_after - rss_before) / 1e3:.0f}MB')
+    os.remove(path)
+
+
+def bench_rank_uncertainty(N: int = 10 ** 6, num_samples: int = 1000, num_tracked: int = 1000,
+                           top_ks=(1, 10, 100), memory_budget: int = 2 ** 28, seed: int = 0):
+    """
+    `RankUncertainty` over N players with spread out marginals: seconds per 1000 samples with
+    top-k counts only and with the ranks of the `num_tracked` best players, and the peak
+    memory traced while sampling against the S x N float32 array it avoids.
+    """
+    rng = np.random.default_rng(seed)
+    means = rng.standard_normal(N)
+    precisions = rng.uniform(1., 100., N)
+    tracked = np.argpartition(-means, num_tracked - 1)[:num_tracked]
+    print(f'N={N}, {num_samples} samples, budget {memory_budget / 2 ** 20:.0f}MB '
+          f'(all samples: {4 * N * num_samples / 2 ** 20:.0f}MB)')
+    for name, players in (('top-k', None), (f'{num_tracked} tracked', tracked)):
+        uncertainty = RankUncertainty(means, precisions, top_ks, players,
+                                      memory_budget=memory_budget, rng=rng)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        uncertainty.sample(num_samples)
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name:14} {1000 * elapsed / num_samples:.3f}s per 1000 samples, peak '
+              f'{peak / 2 ** 20:.0f}MB, P(#1) of the best mean '
+              f'{uncertainty.top_k_probability(1)[np.argmax(means)]:.3f}')
+    lower, upper = uncertainty.rank_interval(0.9)
+    print(f'90% rank interval width of the tracked players: median '
+          f'{np.median(upper - lower):.0f}, max {np.max(upper - lower)}')
+
+
+def bench_cold_start(N: int = 10 ** 5, K: int = 10 ** 6, top: int = 10, repeats: int = 5,
+                     path: str = None):
+    """
+    Wall time of `ranking-ep rank` (run as `python -m ranking_system`) on a saved model of N
+    players and K games in a fresh interpreter, best of `repeats`, against a bare interpreter
+    importing numpy, and whether the command imported pandas or scipy.
+    """
+    winner_ids, losser_ids, _ = power_law_games(N, K)
+    history = WinLossHistory(winner_ids, losser_ids, N)
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                      [f'player-{idx}' for idx in range(N)])
+    ep.run(10, logging=False)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = path or os.path.join(directory, 'model.ep')
+        ep.save(path)
+        commands = dict(numpy=[sys.executable, '-c', 'import numpy'],
+                        rank=[sys.executable, '-m', 'ranking_system', 'rank', path,
+                              '--top', str(top)])
+        for name, command in commands.items():
+            times = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                subprocess.run(command, cwd=root, check=True, capture_output=True)
+                times.append(time.perf_counter() - t0)
+            print(f'{name:6} {min(times):.3f}s (median {np.median(times):.3f}s)')
+        imports = subprocess.run([sys.executable, '-X', 'importtime'] + commands['rank'][1:],
+                                 cwd=root, check=True, capture_output=True, text=True).stderr
+        imported = {line.rsplit('|', 1)[-1].strip().split('.')[0]
+                    for line in imports.splitlines()}
+        heavy = [module for module in ('pandas', 'scipy') if module in imported]
+        print(f'snapshot {os.path.getsize(path) / 2 ** 20:.0f}MB, heavy imports: '
+              f'{heavy or "none"}')
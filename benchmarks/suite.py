@@ -0,0 +1,167 @@
+"""
+Reproducible suite of every engine on power-law leagues of increasing size, and the comparison
+of two suite results for regressions.
+"""
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+import numpy as np
+import scipy.stats
+
+from ranking_system.basic_ep import BasicEPLoop
+from ranking_system.games_players import Player, PlayerList, Game, GameList
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory
+from ranking_system.parallel_ep import ShardedMatrixEPLoop
+from ranking_system.stochastic_ep import StochasticEPLoop
+from ranking_system.utils import ConvergenceReport
+
+from .common import power_law_games, peak_rss
+
+
+def _suite_basic(winner_ids: np.ndarray, losser_ids: np.ndarray, N: int,
+                 num_iterations: int) -> Tuple[ConvergenceReport, np.ndarray]:
+    players = PlayerList([Player(idx, f'player-{idx}') for idx in range(N)])
+    games = GameList([Game(int(w), int(l)) for w, l in zip(winner_ids, losser_ids)])
+    report = BasicEPLoop(players, games).run(num_iterations, logging=False)
+    return report, players.skills
+
+
+def _suite_matrix(winner_ids: np.ndarray, losser_ids: np.ndarray, N: int,
+                  num_iterations: int) -> Tuple[ConvergenceReport, np.ndarray]:
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(len(winner_ids)),
+                      WinLossHistory(winner_ids, losser_ids, N), None)
+    return ep.run(num_iterations, logging=False), ep.player_stats[:, 0, 0]
+
+
+def _suite_sharded(winner_ids: np.ndarray, losser_ids: np.ndarray, N: int,
+                   num_iterations: int) -> Tuple[ConvergenceReport, np.ndarray]:
+    ep = ShardedMatrixEPLoop(PlayerStatsFactory.allocate(N),
+                             GameStatsFactory.allocate(len(winner_ids)),
+                             WinLossHistory(winner_ids, losser_ids, N), None)
+    return ep.run(num_iterations, logging=False), ep.player_stats[:, 0, 0]
+
+
+def _suite_stochastic(winner_ids: np.ndarray, losser_ids: np.ndarray, N: int,
+                      num_iterations: int) -> Tuple[ConvergenceReport, np.ndarray]:
+    ep = StochasticEPLoop(PlayerStatsFactory.allocate(N),
+                          WinLossHistory(winner_ids, losser_ids, N))
+    return ep.run(num_iterations, logging=False), ep.player_stats[:, 0, 0]
+
+
+# Engines of the benchmark suite: name -> (runner, largest number of games to run it on). A
+# runner fits the engine to the games from the prior for `num_iterations` sweeps and returns
+# its ConvergenceReport and the inferred skill means; new engines only need an entry here.
+SUITE_ENGINES = dict(basic=(_suite_basic, 10 ** 6),
+                     matrix=(_suite_matrix, None),
+                     sharded=(_suite_sharded, None),
+                     stochastic=(_suite_stochastic, None))
+SUITE_SCALES = ((10 ** 3, 10 ** 4), (10 ** 4, 10 ** 5), (10 ** 5, 10 ** 6), (10 ** 6, 10 ** 7))
+
+
+def _suite_run(engine: str, N: int, K: int, num_iterations: int, league: Dict) -> Dict:
+    winner_ids, losser_ids, skills = power_law_games(N, K, **league)
+    rss_before = peak_rss()
+    t0 = time.perf_counter()
+    report, means = SUITE_ENGINES[engine][0](winner_ids, losser_ids, N, num_iterations)
+    elapsed = time.perf_counter() - t0
+    # the sharded engine records no sweep when every shard is independent
+    sweep_times = report.sweep_times[1:] or report.sweep_times or [elapsed / num_iterations]
+    return dict(engine=engine, N=N, K=K,
+                max_games_per_player=int(np.bincount(
+                    np.concatenate([winner_ids, losser_ids]), minlength=N).max()),
+                sweeps=report.iterations,
+                seconds=elapsed,
+                seconds_per_sweep=float(np.median(sweep_times)),
+                peak_rss_mb=peak_rss() / 1e3,
+                rss_growth_mb=(peak_rss() - rss_before) / 1e3,
+                kendall_tau=float(scipy.stats.kendalltau(means, skills)[0]))
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(engines=None, scales=SUITE_SCALES, num_iterations: int = 10, path: str = None,
+                exponent: float = 2.5, communities: int = 16, mixing: float = 0.05,
+                seed: int = 0) -> Dict:
+    """
+    Every engine of `SUITE_ENGINES` on `power_law_games` leagues of each (N, K) of `scales`,
+    each run in a fresh process: time per sweep (median), peak RSS and its growth while the
+    engine is built and run, and Kendall tau of the inferred skills against the true ones after
+    `num_iterations` sweeps. The results are written as JSON to `path` (by default
+    bench_suite_<commit>.json) along with the commit and environment, for `compare_suite`.
+    The memory of the sharded engine's workers is not included.
+    """
+    league = dict(exponent=exponent, communities=communities, mixing=mixing, seed=seed)
+    commit = _git_commit()
+    results = dict(commit=commit,
+                   date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   python=platform.python_version(),
+                   numpy=np.__version__,
+                   cpu_count=os.cpu_count(),
+                   num_iterations=num_iterations,
+                   league=league,
+                   runs=[])
+    context = multiprocessing.get_context('spawn')
+    for N, K in scales:
+        for engine in engines or SUITE_ENGINES:
+            max_games = SUITE_ENGINES[engine][1]
+            if max_games is not None and K > max_games:
+                continue
+            # not a multiprocessing.Pool: its daemonic workers cannot start the sharded pool
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                run = executor.submit(_suite_run, engine, N, K, num_iterations, league).result()
+            results['runs'].append(run)
+            print(f'{engine:>8} N={N:<8} K={K:<9} {run["seconds_per_sweep"]:8.3f}s/sweep '
+                  f'peak RSS {run["peak_rss_mb"]:7.0f}MB (+{run["rss_growth_mb"]:.0f}MB) '
+                  f'Kendall tau {run["kendall_tau"]:.4f}')
+    path = path or f'bench_suite_{(commit or "unknown")[:10]}.json'
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {path}')
+    return results
+
+
+def compare_suite(baseline_path: str, path: str, time_tolerance: float = 0.1,
+                  memory_tolerance: float = 0.1, tau_tolerance: float = 0.005) -> int:
+    """
+    Compares two `bench_suite` result files run by run, flagging as regressions a time per
+    sweep up by more than `time_tolerance` (relative), a peak RSS up by more than
+    `memory_tolerance` (relative) and a Kendall tau lower by more than `tau_tolerance`
+    (absolute). Returns the number of regressions.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(path) as f:
+        current = json.load(f)
+    print(f'{baseline["commit"]} -> {current["commit"]}')
+    previous_runs = {(run['engine'], run['N'], run['K']): run for run in baseline['runs']}
+    regressions = 0
+    for run in current['runs']:
+        previous = previous_runs.get((run['engine'], run['N'], run['K']))
+        if previous is None:
+            continue
+        time_ratio = run['seconds_per_sweep'] / previous['seconds_per_sweep']
+        rss_ratio = run['peak_rss_mb'] / previous['peak_rss_mb']
+        tau_change = run['kendall_tau'] - previous['kendall_tau']
+        flags = [name for name, regressed in (('time', time_ratio > 1. + time_tolerance),
+                                              ('memory', rss_ratio > 1. + memory_tolerance),
+                                              ('accuracy', tau_change < -tau_tolerance))
+                 if regressed]
+        regressions += len(flags)
+        print(f'{run["engine"]:>8} N={run["N"]:<8} K={run["K"]:<9} time x{time_ratio:.2f} '
+              f'peak RSS x{rss_ratio:.2f} Kendall tau {tau_change:+.4f} '
+              f'{"REGRESSION: " + ", ".join(flags) if flags else ""}')
+    return regressions
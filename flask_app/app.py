@@ -1,31 +1,77 @@
 import os
+import threading
+from collections import deque
 
 import pandas as pd
 from flask import Flask, render_template, url_for, redirect
-from pymongo import MongoClient
 
-from ranking_system.matrix_ep import MatrixEPLoop
-from ranking_system.matrix_stats import PlayerStatsFactory, GameStatsFactory
 from sampling import MatchGenerator
-
-client = MongoClient('mongodb://localhost:27017')
-db = client.SentencesDatabase
-client.close()
-games_db = db['_games']
+from training import TrainingWorker, InMemoryCollection
 
 HOME_DIR = os.environ['HOME']
 CELEB_DIR = HOME_DIR + '/celebrity_dataset/'
 app = Flask(__name__, static_folder=CELEB_DIR + 'img_align_celeba')
 
+# Loaded once: handlers only read the match generator and the worker's latest snapshot
+players_df = pd.read_csv(CELEB_DIR + 'clustered_celeb.txt', sep=',')
+match_gen = MatchGenerator(players_df)
+# Matches are prefetched in batches, picked by informativeness once a ranking is available
+PREFETCHED_MATCHES = 64
+prefetched = deque()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def open_games_store():
+    """
+    Games collection: EP_GAMES_STORE=memory keeps the votes in process instead of Mongo (local
+    runs).
+    """
+    if os.environ.get('EP_GAMES_STORE') == 'memory':
+        return InMemoryCollection()
+    from pymongo import MongoClient
+    client = MongoClient('mongodb://localhost:27017')
+    return client.SentencesDatabase['_games']
+
+
+def get_worker() -> TrainingWorker:
+    """
+    Training worker, started with its connection to the games store on the first request rather
+    than at import.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = TrainingWorker(open_games_store(), players_df,
+                                     describe=lambda group_id: read_group(players_df, group_id))
+            _worker.start()
+    return _worker
+
+
+def next_match():
+    try:
+        return prefetched.popleft()
+    except IndexError:
+        snapshot = get_worker().snapshot
+        posterior = match_gen.posterior_by_group(snapshot.player_names, snapshot.means,
+                                                 snapshot.precisions) if snapshot else ()
+        matches = match_gen.generate_random_matches(PREFETCHED_MATCHES, *posterior)
+        (left_paths, left_ids), (right_paths, right_ids) = matches['left'], matches['right']
+        prefetched.extend(dict(left=(str(left_path), left_id), right=(str(right_path), right_id))
+                          for left_path, left_id, right_path, right_id
+                          in zip(left_paths, left_ids, right_paths, right_ids))
+        return prefetched.popleft()
+
 
 @app.route('/', methods=['GET'])
 def home_page():
     next_path = '/stats'
-    match_gen = MatchGenerator.create_from_csv(CELEB_DIR + 'clustered_celeb.txt')
-    match = match_gen.generate_random_match()
+    match = next_match()
     left_image_path, left_id = match['left'][0], match['left'][1]
     right_image_path, right_id = match['right'][0], match['right'][1]
-    num_matches = len(list(games_db.find({}))) + 1
+    num_matches = get_worker().num_matches + 1
 
     return render_template('index.html',
                            left_image_path=left_image_path,
@@ -40,24 +86,20 @@ def home_page():
 
 @app.route('/stats/<winner>/<losser>', methods=['GET'])
 def stats(winner, losser):
-    games_db.insert_one({
-        'winner': int(winner) + 1,
-        'losser': int(losser) + 1,
-    })
+    worker = get_worker()
+    try:
+        worker.record_vote(worker.player_id(int(winner)), worker.player_id(int(losser)))
+    except ValueError as error:
+        return str(error), 400
     return redirect(url_for('home_page'))
 
 
 @app.route('/ranking', methods=['GET'])
 def ranking():
-    game_df = pd.DataFrame(games_db.find({}))
-    players_df = pd.read_csv(CELEB_DIR + 'clustered_celeb.txt', sep=',')
-    players, player_names, N = PlayerStatsFactory.create_from_dataframe(
-        players_df, name_col='group_id')
-    games, history = GameStatsFactory.create_from_dataframe(game_df, N)
-    ep = MatrixEPLoop(players, games, history, player_names)
-    ep.run(100, logging=False)
-    first_position = ep.produce_ranking(logging=False)[0]
-    return f"{read_group(players_df, first_position)}", 200
+    snapshot = get_worker().snapshot
+    if snapshot is None:
+        return 'Ranking not trained yet, try again shortly', 503
+    return f"{snapshot.description}", 200
 
 
 def read_group(df, group_id):
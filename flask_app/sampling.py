@@ -4,14 +4,26 @@ import pandas as pd
 import numpy as np
 import os
 
+from ranking_system.simulation import win_probability
+
 HOME_DIR = os.environ['HOME']
 
 
 class MatchGenerator:
+    """
+    Samples matches between two distinct groups, each side showing a random image of its group.
+    Images are indexed by group at construction: `image_ids` holds the image ids sorted by group
+    and the images of `group_ids[g]` are `image_ids[offsets[g]:offsets[g + 1]]`.
+    """
+
     def __init__(self, df: pd.DataFrame):
         self.df = df
-        self.group_ids = list(set(df['group_id']))
+        groups = df['group_id'].to_numpy()
+        order = np.argsort(groups, kind='stable')
+        self.group_ids, counts = np.unique(groups, return_counts=True)
         self.num_groups = len(self.group_ids)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.image_ids = df['id'].to_numpy()[order].astype(str)
 
     @staticmethod
     def create_from_csv(path: str):
@@ -19,17 +31,68 @@ class MatchGenerator:
         return MatchGenerator(df)
 
     def generate_random_match(self) -> Dict:
-        left_group, right_group = np.random.choice(self.group_ids, 2, replace=False)
+        left = np.random.randint(self.num_groups)
+        right = (left + np.random.randint(1, self.num_groups)) % self.num_groups
+        left_group, right_group = self.group_ids[left], self.group_ids[right]
         left_img_path, left_group_id = self.sample_from_group(left_group)
         right_img_path, right_group_id = self.sample_from_group(right_group)
         return dict(left=(left_img_path, left_group_id),
                     right=(right_img_path, right_group_id))
 
     def sample_from_group(self, group_id):
-        sample = self.df.loc[self.df['group_id'] == group_id].sample()
-        img_path = sample['id'].to_string().split(' ')[-1]
+        group = np.searchsorted(self.group_ids, group_id)
+        start, end = self.offsets[group], self.offsets[group + 1]
+        img_path = str(self.image_ids[np.random.randint(start, end)])
         return img_path, group_id
 
+    def generate_random_matches(self,
+                                n: int,
+                                means: np.ndarray = None,
+                                precisions: np.ndarray = None,
+                                candidates: int = 8,
+                                rng: np.random.Generator = None) -> Dict:
+        """
+        Samples `n` matches at once, returned as `generate_random_match` does but with arrays of
+        image paths and group ids on each side. Pairs of groups are uniform unless the posterior
+        skills of the groups are given (`means`, `precisions` aligned with `group_ids`, see
+        `posterior_by_group`): then `candidates` uniform pairs are drawn per match and one is
+        kept with probability proportional to its informativeness, p (1 - p) (var_1 + var_2),
+        which favours close matches (win probability p near 0.5) between uncertain groups.
+        """
+        rng = rng or np.random.default_rng()
+        num_pairs = n * candidates if means is not None else n
+        left = rng.integers(0, self.num_groups, size=num_pairs)
+        right = (left + rng.integers(1, self.num_groups, size=num_pairs)) % self.num_groups
+        if means is not None:
+            p = win_probability(means, precisions, left, right)
+            variances = 1. / np.asarray(precisions, dtype=np.float64)
+            scores = (p * (1. - p) * (variances[left] + variances[right])).reshape(n, candidates)
+            cumulative = np.cumsum(scores, axis=1)
+            picks = (cumulative < rng.random((n, 1)) * cumulative[:, -1:]).sum(axis=1)
+            chosen = np.arange(n) * candidates + np.minimum(picks, candidates - 1)
+            left, right = left[chosen], right[chosen]
+        return dict(left=(self._sample_images(left, rng), self.group_ids[left]),
+                    right=(self._sample_images(right, rng), self.group_ids[right]))
+
+    def posterior_by_group(self, player_names, means: np.ndarray, precisions: np.ndarray):
+        """
+        Aligns the marginal skills of an EP loop whose players are the groups `player_names`
+        with `group_ids`. Groups without a player keep the prior N(0, 1).
+        """
+        aligned_means = np.zeros((self.num_groups,), dtype=np.float64)
+        aligned_precisions = np.ones((self.num_groups,), dtype=np.float64)
+        player_names = np.asarray(player_names)
+        groups = np.searchsorted(self.group_ids, player_names).clip(max=self.num_groups - 1)
+        known = self.group_ids[groups] == player_names
+        aligned_means[groups[known]] = np.asarray(means)[known]
+        aligned_precisions[groups[known]] = np.asarray(precisions)[known]
+        return aligned_means, aligned_precisions
+
+    def _sample_images(self, groups: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        counts = self.offsets[groups + 1] - self.offsets[groups]
+        return self.image_ids[self.offsets[groups] + (rng.random(len(groups)) * counts)
+                              .astype(np.int64)]
+
 
 if __name__ == '__main__':
     match_gen = MatchGenerator.create_from_csv(HOME_DIR + '/celebrity_dataset/clustered_celeb.txt')
@@ -0,0 +1,217 @@
+import itertools
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import PlayerStatsFactory, GameStatsFactory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class RankingSnapshot:
+    """
+    Immutable result of a training round, served as is by the request handlers: the marginal
+    skills (`means`, `precisions`) of `player_names` and a description of the best player.
+    """
+    version: int
+    num_games: int
+    top_players: Tuple
+    description: str
+    player_names: Sequence
+    means: np.ndarray
+    precisions: np.ndarray
+
+
+class TrainingWorker(threading.Thread):
+    """
+    Background thread keeping a `MatrixEPLoop` fitted to the games collection. It retrains
+    after `retrain_every` new votes, or every `interval` seconds if any vote arrived meanwhile:
+    new games are appended to the loop and refined around their players, the first round runs
+    a full EP fit. Each round publishes a new `RankingSnapshot` by replacing the `snapshot`
+    reference, so handlers read either the previous or the next snapshot, never a partial one.
+    Players are the distinct `name_col` groups of `players_df` in sorted order, player i + 1
+    (1-based, as stored in the collection) being `group_ids[i]` whatever the order of the
+    file: `player_id` maps a group to its player. `record_vote` rejects other ids, and
+    training skips (and logs) any such game found in the collection. A failed round is logged
+    and retried with the next votes, the previous snapshot being served meanwhile.
+    """
+
+    def __init__(self,
+                 games_collection,
+                 players_df: pd.DataFrame,
+                 describe: Callable = str,
+                 name_col: str = 'group_id',
+                 retrain_every: int = 10,
+                 interval: float = 60.,
+                 num_iterations: int = 100,
+                 tol: float = 1e-3,
+                 top: int = 10):
+        super().__init__(daemon=True)
+        self.games_collection = games_collection
+        self.players_df = players_df
+        self.describe = describe
+        self.name_col = name_col
+        self.retrain_every = retrain_every
+        self.interval = interval
+        self.num_iterations = num_iterations
+        self.tol = tol
+        self.top = top
+        self.group_ids = np.unique(players_df[name_col].to_numpy())
+        self.num_players = len(self.group_ids)
+        self.num_matches = games_collection.count_documents({})
+        self.snapshot: RankingSnapshot = None
+        self.ep: MatrixEPLoop = None
+        self._new_votes = 0
+        # Games of the collection skipped by training, for their unknown players
+        self._num_skipped = 0
+        self._stopped = False
+        self._wakeup = threading.Condition()
+
+    def player_id(self, group_id) -> int:
+        """
+        1-based player of the group `group_id`. Raises a ValueError for an unknown group.
+        """
+        player = int(np.searchsorted(self.group_ids, group_id))
+        if player == self.num_players or self.group_ids[player] != group_id:
+            raise ValueError(f'Unknown group {group_id}')
+        return player + 1
+
+    def record_vote(self, winner: int, losser: int):
+        """
+        Inserts a game and wakes the worker up once `retrain_every` votes are pending. Raises a
+        ValueError for players out of [1, `num_players`].
+        """
+        if not self._known_players(winner, losser):
+            raise ValueError(f'Vote between unknown players {winner} and {losser}, expected '
+                             f'ids in [1, {self.num_players}]')
+        self.games_collection.insert_one({'winner': winner, 'losser': losser})
+        with self._wakeup:
+            self.num_matches += 1
+            self._new_votes += 1
+            if self._new_votes >= self.retrain_every:
+                self._wakeup.notify()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+
+    def run(self):
+        failed = False
+        while True:
+            with self._wakeup:
+                if self.snapshot is not None or failed:
+                    self._wakeup.wait_for(
+                        lambda: self._stopped or self._new_votes >= self.retrain_every,
+                        timeout=self.interval)
+                if self._stopped:
+                    return
+                if self.snapshot is not None and not self._new_votes:
+                    continue
+                self._new_votes = 0
+            try:
+                self.train()
+                failed = False
+            except Exception:
+                logger.exception('Training round failed, retrying with the next votes')
+                failed = True
+
+    def train(self) -> RankingSnapshot:
+        """
+        Fits the loop to the games inserted since the last round and publishes its ranking.
+        """
+        if self.ep is None:
+            N, player_names = self.num_players, self.group_ids.tolist()
+            players = PlayerStatsFactory.allocate(N)
+            self._num_skipped = 0
+            games, history = GameStatsFactory.create_from_records(self._games_since(0), N)
+            ep = MatrixEPLoop(players, games, history, player_names)
+            ep.run(self.num_iterations, logging=False, tol=self.tol)
+            self.ep = ep
+        else:
+            new_games = pd.DataFrame(list(self._games_since(self.ep.history.K +
+                                                            self._num_skipped)),
+                                     columns=['winner', 'losser'])
+            if len(new_games):
+                self.ep.add_games(new_games)
+                self.ep.refine(self.num_iterations, scope='neighbourhood', tol=self.tol)
+        top_players = tuple(self.ep.player_names[i] for i in self.ep.ranking().top_k(self.top))
+        version = self.snapshot.version + 1 if self.snapshot is not None else 0
+        self.snapshot = RankingSnapshot(version=version,
+                                        num_games=self.ep.history.K,
+                                        top_players=top_players,
+                                        description=self.describe(top_players[0])
+                                        if top_players else '',
+                                        player_names=tuple(self.ep.player_names),
+                                        means=self.ep.player_stats[:, 0, 0].copy(),
+                                        precisions=self.ep.player_stats[:, 0, 1].copy())
+        return self.snapshot
+
+    def _games_since(self, num_documents: int):
+        """
+        Games of the collection from its `num_documents`-th document on, skipping those between
+        unknown players.
+        """
+        for game in self.games_collection.find({}, {'winner': 1, 'losser': 1, '_id': 0}) \
+                .skip(num_documents):
+            if self._known_players(game['winner'], game['losser']):
+                yield game
+            else:
+                self._num_skipped += 1
+                logger.warning('Skipping game %s between unknown players', game)
+
+    def _known_players(self, *player_ids: int) -> bool:
+        """
+        Whether every id is the 1-based index of a player of `group_ids`.
+        """
+        return all(isinstance(player_id, (int, np.integer)) and
+                   1 <= player_id <= self.num_players for player_id in player_ids)
+
+
+class InMemoryCollection:
+    """
+    In-process stand-in for the subset of the pymongo collection API used by the app, to run
+    it without a Mongo server.
+    """
+
+    def __init__(self, documents: List[Dict] = None):
+        self.documents = list(documents or [])
+        self._lock = threading.Lock()
+
+    def insert_one(self, document: Dict):
+        with self._lock:
+            self.documents.append(dict(document))
+
+    def count_documents(self, filter: Dict) -> int:
+        assert not filter
+        return len(self.documents)
+
+    def find(self, filter: Dict = None, projection: Dict = None) -> 'InMemoryCursor':
+        assert not filter
+        return InMemoryCursor(self.documents, projection)
+
+
+class InMemoryCursor:
+
+    def __init__(self, documents: List[Dict], projection: Dict = None):
+        self.documents = documents
+        self.fields = [key for key, value in (projection or {}).items() if value]
+        self.start = 0
+        self.stop = len(documents)
+
+    def skip(self, num_documents: int) -> 'InMemoryCursor':
+        self.start = num_documents
+        return self
+
+    def batch_size(self, batch_size: int) -> 'InMemoryCursor':
+        return self
+
+    def __iter__(self):
+        for document in itertools.islice(self.documents, self.start, self.stop):
+            yield {key: document[key] for key in self.fields} if self.fields else dict(document)
@@ -2,36 +2,69 @@ import time
 
 import numpy as np
 
-from games_players import PlayerList, GameList
-from utils import StandardGaussian
+from .games_players import PlayerList, GameList
+from .matrix_updates import MessageSanitiser
+from .ranking import MarginalSkillQueries
+from .simulation import simulate_games, simulate_tournament
+from .utils import StandardGaussian, ConvergenceReport, marginal_residual
 
 
-class BasicEPLoop:
+class BasicEPLoop(MarginalSkillQueries):
     """
     Basic EP loop executing belief progation from games outcomes to player skill through message
-    passing.
+    passing. Invalid messages are handled as in `MatrixEPLoop` (see `MessageSanitiser`), and
+    `noise` is the variance of the performances around the skills.
     """
 
-    def __init__(self, players: PlayerList, games: GameList):
+    def __init__(self, players: PlayerList, games: GameList, sanitise: str = 'skip',
+                 noise: float = 1.):
         self.players = players
         self.games = games
+        self.noise = noise
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
         self.players.get_player_games(games)
+        self.rankings = {}
 
-    def run(self, num_iterations, logging=True):
+    @property
+    def player_stats(self) -> np.ndarray:
+        return self.players.player_stats
+
+    def run(self, num_iterations, logging=True, tol=None, damping=0.) -> ConvergenceReport:
+        """
+        Runs up to `num_iterations` EP sweeps, stopping early once the marginal skills move less
+        than `tol`. Downwards players messages are damped keeping a `damping` fraction of their
+        previous values.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.sanitiser.num_sanitised if self.sanitiser is not None else 0
         t0 = time.time()
+        self.players.update_marginal_skills()
         for tau in range(num_iterations):
+            t_sweep = time.time()
+            previous_skills, previous_precisions = self.players.skills, self.players.precisions
+            self.games.update_messages(self.players, damping, self.sanitiser, self.noise)
             self.players.update_marginal_skills()
-            self.games.update_messages(self.players)
-            if logging and (tau + 1) % (num_iterations // 4) == 0:
+            report.record(marginal_residual(previous_skills, previous_precisions,
+                                            self.players.skills, self.players.precisions),
+                          time.time() - t_sweep)
+            if logging and (tau + 1) % max(num_iterations // 4, 1) == 0:
                 print(f'#### EP iteration #{tau + 1} completed #### time elapsed {time.time()-t0}')
-        self.players.update_marginal_skills()
+            if report.converged:
+                break
+        if self.sanitiser is not None:
+            report.num_sanitised = self.sanitiser.num_sanitised - num_sanitised
+        self.invalidate_rankings()
+        if logging and tol is not None:
+            print(f'#### EP {"converged" if report.converged else "did not converge"} after '
+                  f'{report.iterations} iterations #### residual {report.residuals[-1]}')
+        return report
 
     # TODO
     def simulate_game(self, player_1: int, player_2: int, logging=True):
         p1_mean, p2_mean = self.players.skills[player_1], self.players.skills[player_2]
         p1_prec, p2_prec = self.players.precisions[player_1], self.players.precisions[player_2]
         probs_p1_wins = StandardGaussian().cdf(
-            (p1_mean - p2_mean) / np.sqrt(1. + 1. / p1_prec + 1. / p2_prec))
+            (p1_mean - p2_mean) / np.sqrt(self.noise + 1. / p1_prec + 1. / p2_prec))
         did_p1_win = np.random.binomial(1, probs_p1_wins)
         if did_p1_win:
             winner, losser = player_1, player_2
@@ -41,16 +74,29 @@ class BasicEPLoop:
             print(f'{self.players.names[winner]} beated {self.players.names[losser]}')
         return winner, losser
 
-    def produce_ranking(self):
+    def simulate_games(self, pairs: np.ndarray, rng: np.random.Generator = None):
+        """
+        Samples the outcomes of the (M, 2) array of player pairs. Returns winners and lossers.
+        """
+        return simulate_games(self.players.skills, self.players.precisions, pairs, rng,
+                              self.noise)
+
+    def simulate_tournament(self, bracket: np.ndarray, n_samples: int,
+                            rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Champions of `n_samples` simulated single-elimination tournaments, see
+        `simulation.simulate_tournament`.
+        """
+        return simulate_tournament(self.players.skills, self.players.precisions,
+                                   bracket, n_samples, rng, self.noise)
+
+    def produce_ranking(self, top=10):
         """
         Produce a top-10 ranking of the players based on the marginal skill distribution mean.
         """
-        skills = self.players.skills
         player_names = self.players.names
-        player_names = np.take_along_axis(np.array(player_names), skills.argsort(), axis=0)
-        top = 10
-        for position, player_name in enumerate(reversed(player_names[-top:])):
-            print(f"Position #{position + 1}: {player_name}")
+        for position, player in enumerate(self.ranking().top_k(top)):
+            print(f"Position #{position + 1}: {player_names[player]}")
 
 
 if __name__ == '__main__':
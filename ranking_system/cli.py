@@ -0,0 +1,206 @@
+"""
+Command line interface, installed as `ranking-ep` (or run as `python -m ranking_system`):
+
+    ranking-ep fit --players data/players.csv --games data/games.csv -o model.ep
+    ranking-ep rank model.ep --top 10
+    ranking-ep predict model.ep Rafael-Nadal Juan-Monaco
+    ranking-ep bench layout snapshot
+
+`rank` and `predict` read a snapshot written by `fit` (memory-mapped, see
+`MatrixEPLoop.load`) or fit the players and games CSVs on the fly. `--noise` and
+`--draw-margin` override the ones saved in a snapshot (`fit` resumes its sweeps with them);
+the prior, dtype and compression are those of the snapshot. Players are given by name or
+by 1-based id, as in the games CSV. Modules are imported by the subcommand that needs them, so
+that answering from a snapshot does not pay for the imports of pandas or scipy.
+"""
+import argparse
+import sys
+
+# Model options left unset on the command line: those of a snapshot, or these when fitting CSVs
+_FIT_DEFAULTS = dict(noise=1., draw_margin=0., prior_mean=0., prior_variance=1., dtype='mixed')
+# Options fixed by the arrays of a snapshot
+_SNAPSHOT_FIXED = ('prior_mean', 'prior_variance', 'dtype', 'compress')
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    return args.command(args) or 0
+
+
+def fit(args) -> int:
+    """
+    Fits the CSVs, or resumes the sweeps of a snapshot, and saves the model to `--output`.
+    """
+    ep = _load_model(args, mode='c')
+    if args.snapshot:
+        ep.run(args.iterations, logging=False, tol=args.tol, damping=args.damping)
+    ep.save(args.output)
+    print(f'Saved the model of {ep.history.N} players and {ep.history.K} games to '
+          f'{args.output}')
+    return 0
+
+
+def rank(args) -> int:
+    """
+    Top `--top` players by marginal skill mean, or by its `--conservative` lower estimate.
+    """
+    ep = _load_model(args)
+    ranking = ep.ranking(args.conservative)
+    means, precisions = ep.player_stats[:, 0, 0], ep.player_stats[:, 0, 1]
+    for position, player in enumerate(ranking.top_k(args.top)):
+        print(f'Position #{position + 1}: {_name(ep, player)} '
+              f'(mean {means[player]:.4f}, std {precisions[player] ** -0.5:.4f})')
+    return 0
+
+
+def predict(args) -> int:
+    """
+    Probability that the first player of each pair beats the second one, for the pair given on
+    the command line or every `player_1,player_2` row of `--pairs`.
+    """
+    import numpy as np
+    if args.snapshot and args.players and args.games:
+        # fitting the CSVs: the first positional argument is a player, not a snapshot
+        args.pair, args.snapshot = [args.snapshot] + args.pair, None
+    ep = _load_model(args)
+    if args.pairs:
+        import pandas as pd
+        pairs = pd.read_csv(args.pairs, dtype=str)[['player_1', 'player_2']].to_numpy()
+    elif len(args.pair) == 2:
+        pairs = np.array([args.pair])
+    else:
+        print('predict needs two players or --pairs', file=sys.stderr)
+        return 2
+    names = ep.player_names
+    p1_idx, p2_idx = ([_player_index(player, names) for player in pairs[:, side]]
+                      for side in (0, 1))
+    probabilities = ep.predict_win_probability(np.array(p1_idx), np.array(p2_idx))
+    for player_1, player_2, probability in zip(p1_idx, p2_idx, probabilities):
+        print(f'P({_name(ep, player_1)} beats {_name(ep, player_2)}) = {probability:.4f}')
+    return 0
+
+
+def bench(args) -> int:
+    """
+    Runs the benchmarks of the top-level `benchmarks` package, which is not installed with
+    ranking_system: run from the root of a checkout of the repository.
+    """
+    try:
+        from benchmarks.__main__ import main as run_benchmarks
+    except ModuleNotFoundError as error:
+        if error.name != 'benchmarks':
+            raise
+        raise SystemExit('The benchmarks are not installed with ranking_system: run '
+                         '`python -m ranking_system bench` (or `python -m benchmarks`) from the '
+                         'root of a checkout of the repository')
+    return run_benchmarks(args.names)
+
+
+def _load_model(args, mode='r'):
+    """
+    `MatrixEPLoop` of the snapshot `args.snapshot` (memory-mapped in `mode`), or fitted to the
+    `args.players`/`args.games` CSVs.
+    """
+    from .matrix_ep import MatrixEPLoop
+    if args.snapshot:
+        fixed = [option for option in _SNAPSHOT_FIXED if getattr(args, option) not in (None, False)]
+        if fixed:
+            raise SystemExit(f'{", ".join(_flag(option) for option in fixed)} only apply to '
+                             f'fitting CSVs: a snapshot keeps its own')
+        ep = MatrixEPLoop.load(args.snapshot, mmap=True, mode=mode)
+        if args.noise is not None:
+            ep.noise = args.noise
+        if args.draw_margin is not None:
+            ep.draw_margin = args.draw_margin
+        return ep
+    if not (args.players and args.games):
+        raise SystemExit('Give a snapshot or both --players and --games CSVs')
+    for option, default in _FIT_DEFAULTS.items():
+        if getattr(args, option) is None:
+            setattr(args, option, default)
+    from .matrix_stats import PlayerStatsFactory, GameStatsFactory
+    player_stats, player_names, N = PlayerStatsFactory.create_from_csv(args.players,
+                                                                       policy=args.dtype)
+    game_stats, history = GameStatsFactory.create_from_csv(args.games, N, policy=args.dtype,
+                                                           compress=args.compress)
+    player_stats = PlayerStatsFactory.allocate(N, player_stats.dtype, args.prior_mean,
+                                               args.prior_variance)
+    ep = MatrixEPLoop(player_stats, game_stats, history, player_names,
+                      draw_margin=args.draw_margin, dtype_policy=args.dtype, noise=args.noise)
+    ep.run(args.iterations, logging=False, tol=args.tol, damping=args.damping)
+    return ep
+
+
+def _player_index(player: str, names) -> int:
+    """
+    0-based index of a player given by name or, failing that, by 1-based id.
+    """
+    import numpy as np
+    if isinstance(names, np.ndarray):
+        matches = np.flatnonzero(names.astype(str) == player)
+        if len(matches):
+            return int(matches[0])
+    elif names is not None:
+        try:
+            return int(names.index(player))
+        except ValueError:
+            pass
+    if not player.isdigit():
+        raise SystemExit(f'Unknown player {str(player)!r}')
+    return int(player) - 1
+
+
+def _flag(option: str) -> str:
+    return '--' + option.replace('_', '-')
+
+
+def _name(ep, player: int) -> str:
+    return str(ep.player_names[player]) if ep.player_names is not None else str(player + 1)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='ranking-ep',
+                                     description='Expectation propagation rankings')
+    commands = parser.add_subparsers(dest='name', required=True)
+
+    model = argparse.ArgumentParser(add_help=False)
+    model.add_argument('snapshot', nargs='?', help='model snapshot written by fit')
+    model.add_argument('--players', help='players CSV with a name column')
+    model.add_argument('--games', help='games CSV with 1-based winner/losser (and draw) columns')
+    model.add_argument('--iterations', type=int, default=100, help='EP sweeps')
+    model.add_argument('--tol', type=float, default=1e-4,
+                       help='stop once the marginals move less than this')
+    model.add_argument('--damping', type=float, default=0.)
+    model.add_argument('--noise', type=float,
+                       help="performance noise variance (default: 1, or the snapshot's)")
+    model.add_argument('--prior-mean', type=float, help='default: 0')
+    model.add_argument('--prior-variance', type=float, help='default: 1')
+    model.add_argument('--draw-margin', type=float, help="default: 0, or the snapshot's")
+    model.add_argument('--dtype', choices=('float32', 'float64', 'mixed'),
+                       help='default: mixed')
+    model.add_argument('--compress', action='store_true',
+                       help='one message block per distinct game')
+
+    command = commands.add_parser('fit', parents=[model], help='fit and save a model')
+    command.add_argument('-o', '--output', required=True, help='snapshot to write')
+    command.set_defaults(command=fit)
+
+    command = commands.add_parser('rank', parents=[model], help='print the top players')
+    command.add_argument('--top', type=int, default=10)
+    command.add_argument('--conservative', type=float, default=0.,
+                         help='rank by mean minus this many standard deviations')
+    command.set_defaults(command=rank)
+
+    command = commands.add_parser('predict', parents=[model], help='win probabilities')
+    command.add_argument('pair', nargs='*', help='two players, by name or 1-based id')
+    command.add_argument('--pairs', help='CSV of player_1,player_2 pairs')
+    command.set_defaults(command=predict)
+
+    command = commands.add_parser('bench', help='run benchmarks (all by default)')
+    command.add_argument('names', nargs='*')
+    command.set_defaults(command=bench)
+    return parser
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,90 +1,207 @@
-from dataclasses import dataclass
-from typing import Dict, List
-import pandas as pd
+from dataclasses import dataclass, field
+from typing import List, TYPE_CHECKING
 import numpy as np
 
-from messages import GameToSkill, MarginalSkills, SkillToGame, GameToPerformance, PerformanceToGame, \
-    MarginalPerformance, Skill
+from .matrix_stats import PlayerStats, GameStats, GameStatsFactory, WinLossHistory
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixWorkspace
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class GaussianView:
+    """
+    Gaussian stored as the (mean, precision) pair `stats[idx, row, :]` of a player or game stats
+    array, read and written like a `GaussianDistribution`.
+    """
+    __slots__ = ('stats', 'idx', 'row')
+
+    def __init__(self, stats: np.ndarray, idx: int, row: int):
+        self.stats = stats
+        self.idx = idx
+        self.row = row
+
+    @property
+    def mean(self):
+        return self.stats[self.idx, self.row, 0]
+
+    @mean.setter
+    def mean(self, mean):
+        self.stats[self.idx, self.row, 0] = mean
+
+    @property
+    def precision(self):
+        return self.stats[self.idx, self.row, 1]
+
+    @precision.setter
+    def precision(self, precision):
+        self.stats[self.idx, self.row, 1] = precision
+
+    @property
+    def variance(self):
+        assert self.precision > 0
+        return 1. / self.precision
+
+    @property
+    def natural_mean(self):
+        return self.precision * self.mean
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(mean={self.mean}, precision={self.precision})'
 
 
 class Player:
-    def __init__(self, idx: int, name):
+    """
+    Lightweight view of row `row` of a `PlayerStats` array: marginal skill (0), prior skill (1)
+    and sum of the messages from played games (2). Standalone players own a single-row array
+    until a `PlayerList` gathers them into a shared one.
+    """
+    __slots__ = ('idx', 'name', 'games_played', 'stats', 'row')
+
+    def __init__(self, idx: int, name, prior_mean: float = 0., prior_variance: float = 1.):
         self.idx = idx
         self.name = name
-        self.prior_skill = Skill(mean=0., precision=1.)  # Prior
-        self.marginal_skill = MarginalSkills()  # Posterior to be updated
         self.games_played = []
+        self.stats = np.zeros((1, 3, 2), dtype=np.float32)
+        # Prior Skill(mean=prior_mean, precision=1. / prior_variance)
+        self.stats[0, 1, :] = prior_mean, 1. / prior_variance
+        self.row = 0
+
+    @property
+    def marginal_skill(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 0)
+
+    @property
+    def prior_skill(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 1)
 
     def update_marginal(self):
         downwards_messages = [
             game.downwards_winner if game.winner_idx == self.idx else game.downwards_losser
             for game in self.games_played
         ]
-        self.marginal_skill.update(self.prior_skill, downwards_messages)
+        update_precision = self.prior_skill.precision + \
+            np.sum([message.precision for message in downwards_messages])
+        update_natural_mean = self.prior_skill.natural_mean + \
+            np.sum([message.natural_mean for message in downwards_messages])
+        self.marginal_skill.precision = update_precision
+        self.marginal_skill.mean = update_natural_mean / update_precision
 
 
 class Game:
+    """
+    Lightweight view of row `row` of a `GameStats` array holding the messages of the game (see
+    `MatrixMessageUpdates`). Standalone games own a single-row array until a `GameList` gathers
+    them into a shared one; updates run the vectorised message updates on that row.
+    """
+    __slots__ = ('winner_idx', 'losser_idx', 'stats', 'row')
+
     def __init__(self, winner_idx: int, losser_idx: int):
         self.winner_idx = winner_idx
         self.losser_idx = losser_idx
-        # Messages P1 - upwards / downwards
-        self.upwards_winner = SkillToGame()
-        self.downwards_winner = GameToSkill(mean=0., precision=0.)
-        # Messages P2 - upwards / downwards
-        self.upwards_losser = SkillToGame()
-        self.downwards_losser = GameToSkill(mean=0., precision=0.)
-        # Messages game
-        self.upwards_game = GameToPerformance()
-        self.downwards_game = PerformanceToGame()
-        self.marginal_performance = MarginalPerformance()
+        self.stats = GameStatsFactory.allocate(1)
+        self.row = 0
+
+    # Messages P1 - upwards / downwards
+    @property
+    def upwards_winner(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 0)
+
+    @property
+    def downwards_winner(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 6)
+
+    # Messages P2 - upwards / downwards
+    @property
+    def upwards_losser(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 1)
+
+    @property
+    def downwards_losser(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 5)
+
+    # Messages game
+    @property
+    def upwards_game(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 2)
+
+    @property
+    def downwards_game(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 4)
+
+    @property
+    def marginal_performance(self) -> GaussianView:
+        return GaussianView(self.stats, self.row, 3)
+
+    @property
+    def game_stats(self) -> GameStats:
+        return self.stats[self.row:self.row + 1]
 
     def update_upwards_player_messages(self, players: 'PlayerList'):
         winner, losser = players[self.winner_idx], players[self.losser_idx]
-        self.upwards_winner.update(marginal_skill=winner.marginal_skill,
-                                   message=self.downwards_winner)
-        self.upwards_losser.update(marginal_skill=losser.marginal_skill,
-                                   message=self.downwards_losser)
+        game_stats = self.game_stats
+        game_stats[0, 7, :] = winner.stats[winner.row, 0, :]
+        game_stats[0, 8, :] = losser.stats[losser.row, 0, :]
+        MatrixMessageUpdates.update_upwards_player_messages(game_stats)
 
-    def update_upwards_game_message(self):
-        self.upwards_game.update(winner_message=self.upwards_winner,
-                                 losser_message=self.upwards_losser)
+    def update_upwards_game_message(self, noise=1.):
+        MatrixMessageUpdates.update_upwards_game_message(self.game_stats, noise=noise)
 
     def update_marginal_performance(self):
-        self.marginal_performance.update(players_message=self.upwards_game)
+        MatrixMessageUpdates.update_marginal_performance(self.game_stats)
 
     def update_downwards_game_message(self):
-        self.downwards_game.update(marginal_performance=self.marginal_performance,
-                                   message=self.upwards_game)
-
-    def update_downwards_players_message(self):
-        self.downwards_winner.update(top_message=self.downwards_game,
-                                     bottom_message=self.upwards_losser,
-                                     is_winner=True
-                                     )
-        self.downwards_losser.update(top_message=self.downwards_game,
-                                     bottom_message=self.upwards_winner,
-                                     is_winner=False)
-
-    def update_messages(self, players: 'PlayerList'):
+        MatrixMessageUpdates.update_downwards_game_message(self.game_stats)
+
+    def update_downwards_players_message(self, damping=0., noise=1.):
+        game_stats = self.game_stats
+        previous_downwards = game_stats[:, 5:7, :].copy()
+        MatrixMessageUpdates.update_downwards_players_message(game_stats, noise=noise)
+        MatrixMessageUpdates.damp_downwards_players_messages(game_stats, previous_downwards,
+                                                             damping)
+
+    def update_messages(self, players: 'PlayerList', damping=0., noise=1.):
         self.update_upwards_player_messages(players)
-        self.update_upwards_game_message()
+        self.update_upwards_game_message(noise)
         self.update_marginal_performance()
         self.update_downwards_game_message()
-        self.update_downwards_players_message()
+        self.update_downwards_players_message(damping, noise)
 
 
 @dataclass
 class PlayerList:
+    """
+    Players sharing a single `PlayerStats` array, on which marginal skills are updated at once.
+    """
     player_list: List[Player]
+    player_stats: PlayerStats = field(init=False)
+    games: 'GameList' = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.player_stats = np.zeros((len(self.player_list), 3, 2), dtype=np.float32)
+        for row, player in enumerate(self.player_list):
+            self.player_stats[row] = player.stats[player.row]
+            player.stats, player.row = self.player_stats, row
 
     def get_player_games(self, games: 'GameList'):
+        games.history(len(self))  # checks the player ids
+        self.games = games
         for game in games:
             self.player_list[game.winner_idx].games_played.append(game)
             self.player_list[game.losser_idx].games_played.append(game)
 
     def update_marginal_skills(self):
-        for player in self.player_list:
-            player.update_marginal()
+        if self.games is None:
+            self.player_stats[:, 2, :] = 0.
+        else:
+            self.player_stats = MatrixSkillUpdates.compute_message_games(
+                self.games.game_stats, self.player_stats, self.games.history(len(self)),
+                self.games.workspace)
+        self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
 
     def __getitem__(self, item):
         return self.player_list[item]
@@ -94,25 +211,19 @@ class PlayerList:
 
     @property
     def skills(self) -> np.ndarray:
-        N = len(self)
-        skills = np.zeros((N, ), dtype=np.float32)
-        for id in range(N):
-            skills[id] = self[id].marginal_skill.mean
-        return skills
+        return self.player_stats[:, 0, 0].copy()
 
     @property
     def precisions(self):
-        N = len(self)
-        precisions = np.zeros((N, ), dtype=np.float32)
-        for id in range(N):
-            precisions[id] = self[id].marginal_skill.precision
-        return precisions
+        return self.player_stats[:, 0, 1].copy()
+
     @property
     def names(self) -> List:
         return [player.name for player in self.player_list]
 
     @staticmethod
     def create_from_csv(path, sep=','):
+        import pandas as pd
         player_df = pd.read_csv(path, sep=sep)
         player_list = [
             Player(idx=idx, name=name) for idx, name in enumerate(player_df['name'].values)
@@ -122,11 +233,44 @@ class PlayerList:
 
 @dataclass
 class GameList:
+    """
+    Games sharing a single `GameStats` array, on which messages are updated at once.
+    """
     game_list: List[Game]
+    game_stats: GameStats = field(init=False)
+    winner_ids: np.ndarray = field(init=False)
+    losser_ids: np.ndarray = field(init=False)
+    workspace: MatrixWorkspace = field(init=False)
+    _history: WinLossHistory = field(init=False, default=None, repr=False)
+
+    def __post_init__(self):
+        K = len(self.game_list)
+        self.game_stats = GameStatsFactory.allocate(K)
+        self.winner_ids = np.array([game.winner_idx for game in self.game_list], dtype=np.int64)
+        self.losser_ids = np.array([game.losser_idx for game in self.game_list], dtype=np.int64)
+        for row, game in enumerate(self.game_list):
+            self.game_stats[row] = game.stats[game.row]
+            game.stats, game.row = self.game_stats, row
+        self.workspace = MatrixWorkspace(K, self.game_stats.dtype)
+
+    def history(self, N: int) -> WinLossHistory:
+        """
+        Incidence of the games over N players, built (and its ids checked) on the first call, when
+        the games meet their `PlayerList`, and cached for the sweeps.
+        """
+        if self._history is None or self._history.N != N:
+            self._history = WinLossHistory(self.winner_ids, self.losser_ids, N)
+        return self._history
 
-    def update_messages(self, players: PlayerList):
-        for game in self.game_list:
-            game.update_messages(players)
+    def update_messages(self, players: PlayerList, damping=0., sanitiser=None, noise=1.):
+        self.game_stats = MatrixSkillUpdates.insert_marginal_into_games(
+            self.game_stats, players.player_stats, self.history(len(players)))
+        previous_downwards = self.workspace.previous_downwards(self.game_stats) \
+            if damping else None
+        self.game_stats = MatrixMessageUpdates().update_game_messages(
+            self.game_stats, self.workspace, sanitiser=sanitiser, noise=noise)
+        self.game_stats = MatrixMessageUpdates.damp_downwards_players_messages(
+            self.game_stats, previous_downwards, damping, self.workspace)
 
     def __getitem__(self, item):
         return self.game_list[item]
@@ -136,8 +280,10 @@ class GameList:
 
     @staticmethod
     def create_from_csv(path, sep=','):
-        game_df = pd.read_csv(path, sep=sep)
-        game_list = [Game(winner_idx - 1, losser_idx - 1) for winner_idx, losser_idx
-                     in game_df[['winner', 'losser']].values
+        # the number of players is unknown until the games meet a PlayerList, which checks the
+        # ids (see `history`)
+        history = WinLossHistory.create_from_csv(path, N=0, sep=sep, check_ids=False)
+        game_list = [Game(winner_idx, losser_idx) for winner_idx, losser_idx
+                     in zip(history.winner_ids.tolist(), history.losser_ids.tolist())
                      ]
         return GameList(game_list)
@@ -0,0 +1,120 @@
+"""
+Choice of the hyperparameters of the game model, the performance noise and the prior variance
+of the skills, by maximising the EP evidence (`MatrixEvidence`) over a grid of candidates.
+
+Each candidate is a full `MatrixEPLoop` fit. The grid is walked in a snake order, so that
+consecutive candidates are neighbours, and cut into one chain per worker of a process pool: a
+chain fits its candidates one after the other, each warm-started from the game messages of the
+previous one, which are close to its fixed point. Without a draw margin the likelihood only
+depends on the skills in units of the performance noise, so the evidence is a function of
+prior_variance / noise alone (and not of the prior mean): a grid over one of them suffices.
+"""
+import itertools
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from .matrix_ep import MatrixEPLoop
+from .matrix_stats import WinLossHistory, GameStatsFactory, PlayerStatsFactory, DtypePolicy
+
+
+@dataclass
+class HyperparameterResult:
+    noise: float
+    prior_variance: float
+    log_evidence: float
+    iterations: int
+    converged: bool
+    fit_time: float
+
+
+def candidate_chains(noises: Sequence[float],
+                     prior_variances: Sequence[float],
+                     num_chains: int) -> List[List[Tuple[float, float]]]:
+    """
+    The (noise, prior_variance) grid in snake order (prior variances alternately increasing and
+    decreasing from one noise to the next), cut into at most `num_chains` contiguous chains of
+    neighbouring candidates.
+    """
+    noises, prior_variances = sorted(noises), sorted(prior_variances)
+    grid = [(noise, prior_variance)
+            for i, noise in enumerate(noises)
+            for prior_variance in (prior_variances if i % 2 == 0 else prior_variances[::-1])]
+    bounds = np.linspace(0, len(grid), min(num_chains, len(grid)) + 1).round().astype(int)
+    return [grid[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def hyperparameter_search(history: WinLossHistory,
+                          noises: Sequence[float] = (1.,),
+                          prior_variances: Sequence[float] = (1.,),
+                          prior_mean: float = 0.,
+                          draw_margin: float = 0.,
+                          num_iterations: int = 100,
+                          tol: float = 1e-4,
+                          damping: float = 0.3,
+                          num_workers: int = None,
+                          warm_start: bool = True,
+                          dtype_policy='float64') -> List[HyperparameterResult]:
+    """
+    Fits every (noise, prior_variance) candidate of the grid with up to `num_iterations` EP
+    sweeps (stopping once the marginals move less than `tol`) and returns the results, best
+    evidence first. Sweeps are damped by `damping` (see `MatrixEPLoop.run`): undamped EP
+    oscillates rather than converges on candidates with a small noise. Chains of candidates (see
+    `candidate_chains`) run over a pool of `num_workers` processes (default: one per CPU, in
+    process with a single worker), each fit warm-started from the previous one of its chain
+    unless `warm_start` is False.
+    """
+    num_workers = num_workers or os.cpu_count()
+    chains = candidate_chains(noises, prior_variances, num_workers)
+    settings = (history, prior_mean, draw_margin, num_iterations, tol, damping, warm_start,
+                DtypePolicy.resolve(dtype_policy))
+    if num_workers == 1:
+        _attach_settings(*settings)
+        results = [_fit_chain(chain) for chain in chains]
+    else:
+        # fork: the workers share the history with the parent rather than unpickling it
+        context = multiprocessing.get_context('fork')
+        with context.Pool(len(chains), initializer=_attach_settings,
+                          initargs=settings) as pool:
+            results = pool.map(_fit_chain, chains)
+    return sorted(itertools.chain.from_iterable(results), key=lambda r: -r.log_evidence)
+
+
+# Search settings of the worker processes, set by `_attach_settings`
+_worker = {}
+
+
+def _attach_settings(history, prior_mean, draw_margin, num_iterations, tol, damping,
+                     warm_start, dtype_policy):
+    _worker.update(history=history, prior_mean=prior_mean, draw_margin=draw_margin,
+                   num_iterations=num_iterations, tol=tol, damping=damping,
+                   warm_start=warm_start, dtype_policy=dtype_policy)
+
+
+def _fit_chain(chain: List[Tuple[float, float]]) -> List[HyperparameterResult]:
+    """
+    Fits the candidates of a chain in order, passing the game messages of each fit on to the
+    next one.
+    """
+    history, dtype_policy = _worker['history'], _worker['dtype_policy']
+    game_stats = None
+    results = []
+    for noise, prior_variance in chain:
+        t0 = time.time()
+        if game_stats is None or not _worker['warm_start']:
+            game_stats = GameStatsFactory.allocate(history.K, dtype_policy.storage)
+        players = PlayerStatsFactory.allocate(history.N, dtype_policy.storage,
+                                              _worker['prior_mean'], prior_variance)
+        ep = MatrixEPLoop(players, game_stats, history, None, draw_margin=_worker['draw_margin'],
+                          dtype_policy=dtype_policy, noise=noise)
+        report = ep.run(_worker['num_iterations'], logging=False, tol=_worker['tol'],
+                        damping=_worker['damping'])
+        results.append(HyperparameterResult(noise, prior_variance, ep.log_evidence(),
+                                            report.iterations, report.converged,
+                                            time.time() - t0))
+        game_stats = ep.game_stats
+    return results
@@ -1,46 +1,278 @@
 import time
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import numpy as np
 
-from matrix_stats import PlayerStats, GameStats, WinLossHistory, GameStatsFactory, \
-    PlayerStatsFactory
-from matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates
-from utils import GaussianDistribution, StandardGaussian
+from .matrix_stats import PlayerStats, GameStats, WinLossHistory, GameStatsFactory, \
+    PlayerStatsFactory, DtypePolicy
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixWorkspace, \
+    MessageSanitiser, MatrixEvidence
+from .profiling import NULL_PROFILER
+from .snapshot import write_snapshot, read_snapshot, encode_names, decode_names
+from .ranking import MarginalSkillQueries
+from .rank_uncertainty import RankUncertainty
+from .simulation import simulate_games, simulate_tournament
+from .utils import GaussianDistribution, StandardGaussian, ConvergenceReport, marginal_residual
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-class MatrixEPLoop:
+
+class MatrixEPLoop(MarginalSkillQueries):
     """
     Basic EP loop executing belief progation from games outcomes to player skill through message
     passing.
+
+    `dtype_policy` (see `DtypePolicy`) defaults to the one matching the dtype of `games`; given
+    explicitly, the stats are cast to its storage dtype. Invalid messages are handled by a
+    `MessageSanitiser` in mode `sanitise` ('skip', 'clip' or 'raise'), or left unchecked with
+    None. `noise` is the variance of the players' performances around their skills; the prior
+    of the skills is the one of `players` (see `PlayerStatsFactory.allocate`).
     """
 
     def __init__(self,
                  players: PlayerStats,
                  games: GameStats,
                  history: WinLossHistory,
-                 player_names: List):
-        self.player_stats = players
+                 player_names: List,
+                 pending_games: np.ndarray = None,
+                 draw_margin: float = 0.,
+                 dtype_policy=None,
+                 sanitise: str = 'skip',
+                 noise: float = 1.):
+        self.rankings = {}
+        self.dtype_policy = DtypePolicy.resolve(dtype_policy, games.dtype)
+        storage = self.dtype_policy.storage
+        if games.dtype != storage:
+            cast_games = GameStatsFactory.allocate(len(games), storage)
+            np.copyto(cast_games, games, casting='same_kind')
+            games = cast_games
+        self.player_stats = players.astype(storage, copy=False)
         self.game_stats = games
         self.history = history
         self.player_names = player_names
+        # Performance difference below which a game is a draw, see `history.draws`
+        self.draw_margin = draw_margin
+        self.noise = noise
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
+        self.workspace = MatrixWorkspace.create(history.K, self.dtype_policy)
+        # Games added since the last full run or refinement
+        self.pending_games = np.arange(history.K) if pending_games is None else pending_games
+
+    @property
+    def player_stats(self) -> PlayerStats:
+        return self._player_stats
 
-    def run(self, num_iterations, logging=True):
+    @player_stats.setter
+    def player_stats(self, player_stats: PlayerStats):
+        self._player_stats = player_stats
+        self.invalidate_rankings()
+
+    def run(self, num_iterations, logging=True, tol=None, damping=0.,
+            profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        Runs up to `num_iterations` EP sweeps, stopping early once the marginal skills move less
+        than `tol`. Downwards players messages are damped keeping a `damping` fraction of their
+        previous values. A `SweepProfiler` receives the stage timings of every sweep, see
+        `profiling.py`.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.num_sanitised
         t0 = time.time()
+        self.pending_games = np.arange(0)
+        self.game_stats, self.player_stats = MatrixSkillUpdates().update_skill_marginals(
+            self.game_stats, self.player_stats, self.history, self.workspace)
         for tau in range(num_iterations):
+            profiler.start_sweep()
+            t_sweep = time.time()
+            previous_marginals = self.player_stats[:, 0, :].copy()
+            with profiler.stage('damp_downwards_players_messages'):
+                previous_downwards = self.workspace.previous_downwards(self.game_stats) \
+                    if damping else None
+            self.game_stats = MatrixMessageUpdates().update_game_messages(
+                self.game_stats, self.workspace, self.draw_margin, self.history.draws,
+                self.sanitiser, profiler, self.noise)
+            with profiler.stage('damp_downwards_players_messages'):
+                self.game_stats = MatrixMessageUpdates.damp_downwards_players_messages(
+                    self.game_stats, previous_downwards, damping, self.workspace)
             self.game_stats, self.player_stats = MatrixSkillUpdates().update_skill_marginals(
-                self.game_stats, self.player_stats, self.history)
-            self.game_stats = MatrixMessageUpdates().update_game_messages(self.game_stats)
-            if logging and (tau + 1) % (num_iterations // 2) == 0:
+                self.game_stats, self.player_stats, self.history, self.workspace, profiler)
+            with profiler.stage('residual'):
+                residual = marginal_residual(previous_marginals[:, 0], previous_marginals[:, 1],
+                                             self.player_stats[:, 0, 0],
+                                             self.player_stats[:, 0, 1])
+            report.record(residual, time.time() - t_sweep)
+            profiler.end_sweep(residual)
+            if logging and (tau + 1) % max(num_iterations // 2, 1) == 0:
                 print(f'#### EP iteration #{tau + 1} completed #### time elapsed {time.time()-t0}')
-        self.game_stats, self.player_stats = MatrixSkillUpdates().update_skill_marginals(
-            self.game_stats, self.player_stats, self.history)
+            if report.converged:
+                break
+        report.num_sanitised = self.num_sanitised - num_sanitised
+        if logging and tol is not None:
+            print(f'#### EP {"converged" if report.converged else "did not converge"} after '
+                  f'{report.iterations} iterations #### residual {report.residuals[-1]}')
+        return report
+
+    def add_games(self, game_df: 'pd.DataFrame') -> np.ndarray:
+        """
+        Appends newly arrived games to `game_stats` and to the win/loss history. Their messages
+        start uninformative, as in `GameStatsFactory`, and are only fitted by the next `refine`
+        or `run`. Returns the indices of the new games.
+        """
+        new_history = WinLossHistory.create_from_dataframe(game_df, self.history.N)
+        new_games_idx = np.arange(self.history.K, self.history.K + new_history.K)
+        self.history.extend(new_history)
+        game_stats = GameStatsFactory.allocate(self.history.K, self.game_stats.dtype)
+        game_stats[:len(self.game_stats)] = self.game_stats
+        self.game_stats = game_stats
+        self.workspace = MatrixWorkspace.create(self.history.K, self.dtype_policy)
+        self.pending_games = np.concatenate([self.pending_games, new_games_idx])
+        return new_games_idx
+
+    def refine(self, num_sweeps, scope='neighbourhood', damping=0.5, tol=None,
+               logging=False, profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        Warm-started EP sweeps over a subset of the games, leaving every other message untouched:
+            - 'new': games added since the last run/refine
+            - 'neighbourhood': new games plus all games played by the players they involve
+            - 'all': every game
+        Downwards players messages are damped, keeping a `damping` fraction of the previous ones.
+        Stops early once the marginal skills of the players involved move less than `tol`.
+        `profiler` is as in `run`.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.num_sanitised
+        games_idx = self._refine_scope(scope)
+        winner_ids = self.history.winner_ids[games_idx]
+        losser_ids = self.history.losser_ids[games_idx]
+        draws = self.history.draws[games_idx] if self.history.draws is not None else None
+        counts = self.history.counts[games_idx] if self.history.counts is not None else None
+        players_idx = np.unique(np.concatenate([winner_ids, losser_ids]))
+        self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+        games = GameStatsFactory.allocate(len(games_idx), self.game_stats.dtype)
+        np.copyto(games, self.game_stats[games_idx])
+        workspace = MatrixWorkspace.create(len(games_idx), self.dtype_policy)
+        t0 = time.time()
+        for tau in range(num_sweeps):
+            profiler.start_sweep()
+            t_sweep = time.time()
+            previous_marginals = self.player_stats[players_idx, 0, :]
+            with profiler.stage('damp_downwards_players_messages'):
+                previous_downwards = workspace.previous_downwards(games)
+            with profiler.stage('insert_marginal_into_games'):
+                games[:, 7, :] = self.player_stats[winner_ids, 0, :]
+                games[:, 8, :] = self.player_stats[losser_ids, 0, :]
+            games = MatrixMessageUpdates().update_game_messages(games, workspace,
+                                                                self.draw_margin, draws,
+                                                                self.sanitiser, profiler,
+                                                                self.noise)
+            with profiler.stage('damp_downwards_players_messages'):
+                games = MatrixMessageUpdates.damp_downwards_players_messages(
+                    games, previous_downwards, damping, workspace)
+            with profiler.stage('add_message_games'):
+                self.player_stats = MatrixSkillUpdates.add_message_games(
+                    previous_downwards, self.player_stats, winner_ids, losser_ids, sign=-1.,
+                    counts=counts)
+                self.player_stats = MatrixSkillUpdates.add_message_games(
+                    games[:, 5:7, :], self.player_stats, winner_ids, losser_ids, sign=1.,
+                    counts=counts)
+            with profiler.stage('update_marginal'):
+                self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+            with profiler.stage('residual'):
+                marginals = self.player_stats[players_idx, 0, :]
+                residual = marginal_residual(previous_marginals[:, 0], previous_marginals[:, 1],
+                                             marginals[:, 0], marginals[:, 1])
+            report.record(residual, time.time() - t_sweep)
+            profiler.end_sweep(residual)
+            if logging:
+                print(f'#### EP refinement #{tau + 1} over {len(games_idx)} games completed '
+                      f'#### time elapsed {time.time()-t0}')
+            if report.converged:
+                break
+        self.game_stats[games_idx] = games
+        self.pending_games = np.arange(0)
+        report.num_sanitised = self.num_sanitised - num_sanitised
+        return report
+
+    def log_evidence(self) -> float:
+        """
+        EP approximation of the log marginal likelihood of the games under the current
+        hyperparameters (`noise`, `draw_margin` and the prior of `player_stats`), see
+        `MatrixEvidence`. Only meaningful once the sweeps have converged.
+        """
+        return MatrixEvidence.log_evidence(self.game_stats, self.player_stats, self.history,
+                                           self.draw_margin, self.noise)
+
+    @property
+    def num_sanitised(self) -> int:
+        """
+        Invalid messages handled by the sanitiser since the loop was created.
+        """
+        return self.sanitiser.num_sanitised if self.sanitiser is not None else 0
+
+    def _refine_scope(self, scope) -> np.ndarray:
+        if scope == 'all':
+            return np.arange(self.history.K)
+        if scope == 'new':
+            return self.pending_games
+        if scope == 'neighbourhood':
+            touched = np.zeros((self.history.N,), dtype=bool)
+            touched[self.history.winner_ids[self.pending_games]] = True
+            touched[self.history.losser_ids[self.pending_games]] = True
+            return np.flatnonzero(touched[self.history.winner_ids] |
+                                  touched[self.history.losser_ids])
+        raise ValueError(f'Unknown refine scope: {scope}')
+
+    def save(self, path):
+        """
+        Writes the EP state (messages, marginals, win/loss history and player names) to a single
+        snapshot file, see `snapshot.py`.
+        """
+        arrays = dict(player_stats=self.player_stats,
+                      game_stats=self.game_stats.transpose(2, 1, 0),
+                      winner_ids=self.history.winner_ids,
+                      losser_ids=self.history.losser_ids,
+                      pending_games=self.pending_games)
+        if self.history.draws is not None:
+            arrays.update(draws=self.history.draws)
+        if self.history.counts is not None:
+            arrays.update(counts=self.history.counts)
+        if self.player_names is not None:
+            arrays.update(encode_names(self.player_names))
+        write_snapshot(path, arrays, metadata=dict(
+            N=self.history.N, draw_margin=self.draw_margin, noise=self.noise,
+            accumulator=np.dtype(self.dtype_policy.accumulator).name))
+
+    @staticmethod
+    def load(path, mmap=True, mode='r') -> 'MatrixEPLoop':
+        """
+        Opens a snapshot written by `save`. With `mmap` the state is memory-mapped rather than
+        read: mode 'r' serves rankings read-only, 'c' allows resuming EP sweeps in memory
+        (copy-on-write) and 'r+' writes the sweeps through to the snapshot.
+        """
+        arrays, metadata = read_snapshot(path, mmap=mmap, mode=mode)
+        # ids were checked when the history was built: skip reading them all from the mapping
+        history = WinLossHistory(arrays['winner_ids'], arrays['losser_ids'], metadata['N'],
+                                 arrays.get('draws'), arrays.get('counts'), check_ids=False)
+        player_names = decode_names(arrays) if 'name_ids' in arrays or 'name_blob' in arrays \
+            else None
+        storage = arrays['game_stats'].dtype.type
+        dtype_policy = DtypePolicy(storage, np.dtype(metadata['accumulator']).type) \
+            if 'accumulator' in metadata else None
+        return MatrixEPLoop(arrays['player_stats'],
+                            arrays['game_stats'].transpose(2, 1, 0),
+                            history,
+                            player_names,
+                            pending_games=arrays['pending_games'],
+                            draw_margin=metadata.get('draw_margin', 0.),
+                            dtype_policy=dtype_policy,
+                            noise=metadata.get('noise', 1.))
 
     def simulate_game(self, player_1: int, player_2: int, logging=True):
         p1_mean, p2_mean = self.player_stats[player_1, 0, 0], self.player_stats[player_2, 0, 0]
         p1_prec, p2_prec = self.player_stats[player_1, 0, 1], self.player_stats[player_2, 0, 1]
         probs_p1_wins = StandardGaussian().cdf(
-            (p1_mean - p2_mean) / np.sqrt(1. + 1. / p1_prec + 1. / p2_prec))
+            (p1_mean - p2_mean) / np.sqrt(self.noise + 1. / p1_prec + 1. / p2_prec))
         did_p1_win = np.random.binomial(1, probs_p1_wins)
         if did_p1_win:
             winner, losser = player_1, player_2
@@ -50,23 +282,50 @@ class MatrixEPLoop:
             print(f'{self.player_names[winner]} beated {self.player_names[losser]}')
         return winner, losser
 
-    def produce_ranking(self, logging=True):
+    def simulate_games(self, pairs: np.ndarray, rng: np.random.Generator = None):
+        """
+        Samples the outcomes of the (M, 2) array of player pairs. Returns winners and lossers.
+        """
+        return simulate_games(self.player_stats[:, 0, 0], self.player_stats[:, 0, 1],
+                              pairs, rng, self.noise)
+
+    def simulate_tournament(self, bracket: np.ndarray, n_samples: int,
+                            rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Champions of `n_samples` simulated single-elimination tournaments, see
+        `simulation.simulate_tournament`.
+        """
+        return simulate_tournament(self.player_stats[:, 0, 0], self.player_stats[:, 0, 1],
+                                   bracket, n_samples, rng, self.noise)
+
+    def rank_uncertainty(self, num_samples: int, top_ks=(1, 10), players: np.ndarray = None,
+                         memory_budget: int = 2 ** 28,
+                         rng: np.random.Generator = None) -> RankUncertainty:
+        """
+        Probabilities of ranking in the top k and rank intervals of the `players` tracked, from
+        `num_samples` samples of the marginal skills, see `rank_uncertainty.py`.
+        """
+        return RankUncertainty(self.player_stats[:, 0, 0], self.player_stats[:, 0, 1], top_ks,
+                               players, memory_budget=memory_budget, rng=rng).sample(num_samples)
+
+    def produce_ranking(self, logging=True, top=10):
         """
         Produce a top-10 ranking of the players based on the marginal skill distribution mean.
+        Returns the names of all the players, best first.
         """
-        skills = self.player_stats[:, 0, 0]
-        player_names = np.flip(np.take_along_axis(np.array(self.player_names),
-                                                  skills.argsort(), axis=0))
-        top = 10
+        ranking = self.ranking()
         if logging:
-            for position, player_name in enumerate(player_names[:top]):
-                print(f"Position #{position + 1}: {player_name}")
-        return player_names
+            for position, player in enumerate(ranking.top_k(top)):
+                print(f"Position #{position + 1}: {self.player_names[player]}")
+        return np.asarray(self.player_names)[ranking.order()]
 
 
 if __name__ == '__main__':
-    players, player_names, N = PlayerStatsFactory.create_from_csv('../data/players.csv')
-    games, history = GameStatsFactory.create_from_csv('../data/games.csv', N)
+    import os
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+    players, player_names, N = PlayerStatsFactory.create_from_csv(
+        os.path.join(data, 'players.csv'))
+    games, history = GameStatsFactory.create_from_csv(os.path.join(data, 'games.csv'), N)
     ep = MatrixEPLoop(players, games, history, player_names)
     ep.run(100)
     ep.produce_ranking()
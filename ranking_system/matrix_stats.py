@@ -1,36 +1,334 @@
+import itertools
 from collections import defaultdict
-from dataclasses import dataclass
-from typing import Tuple, Dict, List
+from dataclasses import dataclass, InitVar
+from typing import Tuple, Dict, List, Iterable, Union, TYPE_CHECKING
 
 import numpy as np
-import pandas as pd
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 PlayerStats = np.ndarray
 GameStats = np.ndarray
 
+_GAME_COLUMNS = ('winner', 'losser', 'draw')
+# CSV dtype of each game column: the draw flag takes a byte per game, as 0/1 or False/True
+_GAME_DTYPES = {'winner': np.int64, 'losser': np.int64, 'draw': bool}
+
+
+def check_player_ids(N: int, **player_ids: np.ndarray):
+    """
+    Raises a ValueError if any of the arrays of 0-based `player_ids`, given by role, has ids out
+    of [0, N).
+    """
+    for role, ids in player_ids.items():
+        if len(ids) and (ids.min() < 0 or ids.max() >= N):
+            invalid = ids[(ids < 0) | (ids >= N)]
+            raise ValueError(f'{len(invalid)} {role} ids out of [0, {N}) (0-based), '
+                             f'e.g. {int(invalid[0])}')
+
 
 @dataclass
 class WinLossHistory:
-    wins: Dict
-    losses: Dict
+    """
+    Win/loss incidence of the games table: game k was won by player `winner_ids[k]` and lost by
+    player `losser_ids[k]` (0-based player indices). The optional boolean mask `draws` flags
+    the games that ended in a draw, whose winner/loser order is then arbitrary.
+
+    The optional `counts` make game k stand for `counts[k]` identical games (see `compress`).
+    Identical games share their cavities, hence their messages, in every sweep of the parallel
+    EP schedule: one message block stands for all of them, the per-player sums of messages
+    counting it `counts[k]` times (`sum_over_wins`/`sum_over_losses`), which is EP on the
+    uncompressed games rather than an approximation of it.
+
+    Player ids are checked to lie in [0, N) on construction, raising a ValueError otherwise, so
+    that the gathers of the sweeps can skip bounds checks. `check_ids=False` skips the check for
+    ids known to be valid (subsets of a checked history, snapshots) or checked once N is known
+    (`GameList`).
+    """
+    winner_ids: np.ndarray
+    losser_ids: np.ndarray
     N: int
+    draws: np.ndarray = None
+    counts: np.ndarray = None
+    check_ids: InitVar[bool] = True
+
+    def __post_init__(self, check_ids: bool):
+        if check_ids:
+            check_player_ids(self.N, winner=self.winner_ids, losser=self.losser_ids)
+
+    @staticmethod
+    def create_from_dataframe(game_df: 'pd.DataFrame', N: int):
+        winner_ids = game_df['winner'].to_numpy(dtype=np.int64) - 1
+        losser_ids = game_df['losser'].to_numpy(dtype=np.int64) - 1
+        draws = game_df['draw'].to_numpy(dtype=bool) if 'draw' in game_df else None
+        return WinLossHistory(winner_ids, losser_ids, N, draws)
+
+    @staticmethod
+    def create_from_csv(path, N: int, sep=',', chunksize: int = 2 ** 20,
+                        check_ids: bool = True) -> 'WinLossHistory':
+        """
+        Streams the `winner`/`losser` columns of a games CSV in chunks of `chunksize` rows, so
+        that only one chunk of the table is held in memory at a time.
+        """
+        import pandas as pd
+        builder = WinLossHistoryBuilder(N)
+        for chunk in pd.read_csv(path, sep=sep, usecols=lambda column: column in _GAME_COLUMNS,
+                                 dtype=_GAME_DTYPES, chunksize=chunksize):
+            builder.append(chunk['winner'].to_numpy() - 1, chunk['losser'].to_numpy() - 1,
+                           chunk['draw'].to_numpy() if 'draw' in chunk else None)
+        return builder.build(check_ids)
 
     @staticmethod
-    def create_from_dataframe(game_df: pd.DataFrame, N: int):
-        K = len(game_df)
+    def create_from_records(records: Iterable[Dict], N: int,
+                            batch_size: int = 2 ** 16) -> 'WinLossHistory':
+        """
+        Consumes an iterable of `{'winner': ..., 'losser': ...}` records (e.g. a Mongo cursor) in
+        batches of `batch_size`.
+        """
+        builder = WinLossHistoryBuilder(N)
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            builder.append(
+                np.fromiter((record['winner'] for record in batch), np.int64, len(batch)) - 1,
+                np.fromiter((record['losser'] for record in batch), np.int64, len(batch)) - 1,
+                np.fromiter((record.get('draw', False) for record in batch), bool, len(batch)))
+        return builder.build()
+
+    def compress(self) -> 'WinLossHistory':
+        """
+        History with one game per distinct (winner, losser, draw) triple, sorted by winner then
+        losser, and the number of games it stands for as `counts`.
+        """
+        keys = (self.winner_ids * self.N + self.losser_ids) * 2 + self.game_draws
+        keys, groups = np.unique(keys, return_inverse=True)
+        counts = np.bincount(groups, weights=self.counts).astype(np.int64)
+        pairs, draws = keys // 2, (keys % 2).astype(bool)
+        return WinLossHistory(pairs // self.N, pairs % self.N, self.N,
+                              draws if self.draws is not None else None, counts, check_ids=False)
+
+    def extend(self, other: 'WinLossHistory'):
+        """
+        Appends the games of `other` after the current ones.
+        """
+        assert other.N == self.N
+        if self.counts is not None or other.counts is not None:
+            self.counts = np.concatenate([self.game_counts, other.game_counts])
+        if self.draws is not None or other.draws is not None:
+            self.draws = np.concatenate([self.game_draws, other.game_draws])
+        self.winner_ids = np.concatenate([self.winner_ids, other.winner_ids])
+        self.losser_ids = np.concatenate([self.losser_ids, other.losser_ids])
+
+    @property
+    def game_draws(self) -> np.ndarray:
+        """
+        The `draws` mask, all False when the history has none.
+        """
+        return self.draws if self.draws is not None else np.zeros((self.K,), dtype=bool)
+
+    @property
+    def game_counts(self) -> np.ndarray:
+        """
+        The `counts`, all ones when the history has none.
+        """
+        return self.counts if self.counts is not None else np.ones((self.K,), dtype=np.int64)
+
+    def subset(self, games_idx: np.ndarray) -> 'WinLossHistory':
+        return WinLossHistory(self.winner_ids[games_idx], self.losser_ids[games_idx], self.N,
+                              self.draws[games_idx] if self.draws is not None else None,
+                              self.counts[games_idx] if self.counts is not None else None,
+                              check_ids=False)
+
+    @property
+    def K(self) -> int:
+        return len(self.winner_ids)
+
+    @property
+    def num_games(self) -> int:
+        """
+        Number of games played, K unless the history is compressed.
+        """
+        return int(self.counts.sum()) if self.counts is not None else self.K
+
+    @property
+    def wins(self) -> Dict:
         wins = defaultdict(list)
+        for i, winner_idx in enumerate(self.winner_ids):
+            wins[int(winner_idx)].append(i)
+        return wins
+
+    @property
+    def losses(self) -> Dict:
         losses = defaultdict(list)
-        for i in range(K):
-            winner_idx = int(game_df['winner'].loc[i]) - 1
-            losser_idx = int(game_df['losser'].loc[i]) - 1
-            wins[winner_idx].append(i)
-            losses[losser_idx].append(i)
-        return WinLossHistory(wins, losses, N)
+        for i, losser_idx in enumerate(self.losser_ids):
+            losses[int(losser_idx)].append(i)
+        return losses
 
     @property
     def player_ids(self):
         return list(range(self.N))
 
+    def sum_over_wins(self, game_values: np.ndarray) -> np.ndarray:
+        """
+        Per-player sum of `game_values` (length K) over the games each player won, each game
+        counted `counts` times. Without values, the number of games won.
+        """
+        return np.bincount(self.winner_ids, weights=self._weights(game_values),
+                           minlength=self.N)
+
+    def sum_over_losses(self, game_values: np.ndarray) -> np.ndarray:
+        """
+        Per-player sum of `game_values` (length K) over the games each player lost, each game
+        counted `counts` times. Without values, the number of games lost.
+        """
+        return np.bincount(self.losser_ids, weights=self._weights(game_values),
+                           minlength=self.N)
+
+    def _weights(self, game_values: np.ndarray) -> np.ndarray:
+        if self.counts is None or game_values is None:
+            return self.counts if game_values is None else game_values
+        return game_values * self.counts
+
+
+class WinLossHistoryBuilder:
+    """
+    Accumulates batches of 0-based winner/loser ids into preallocated buffers whose capacity
+    doubles when full, then hands them over to a `WinLossHistory` trimmed to the K games seen.
+    """
+
+    def __init__(self, N: int, capacity: int = 2 ** 16):
+        self.N = N
+        self.K = 0
+        self.winner_ids = np.empty((capacity,), dtype=np.int64)
+        self.losser_ids = np.empty((capacity,), dtype=np.int64)
+        self.draws = np.zeros((capacity,), dtype=bool)
+        self.has_draws = False
+
+    def append(self, winner_ids: np.ndarray, losser_ids: np.ndarray, draws: np.ndarray = None):
+        n = len(winner_ids)
+        if self.K + n > len(self.winner_ids):
+            capacity = max(2 * len(self.winner_ids), self.K + n)
+            for buffer in (self.winner_ids, self.losser_ids, self.draws):
+                buffer.resize((capacity,), refcheck=False)
+        self.winner_ids[self.K:self.K + n] = winner_ids
+        self.losser_ids[self.K:self.K + n] = losser_ids
+        self.draws[self.K:self.K + n] = False if draws is None else draws
+        self.has_draws |= draws is not None and bool(np.any(draws))
+        self.K += n
+
+    def build(self, check_ids: bool = True) -> WinLossHistory:
+        for buffer in (self.winner_ids, self.losser_ids, self.draws):
+            buffer.resize((self.K,), refcheck=False)
+        return WinLossHistory(self.winner_ids, self.losser_ids, self.N,
+                              self.draws if self.has_draws else None, check_ids=check_ids)
+
+
+@dataclass
+class TeamGameHistory:
+    """
+    Ragged incidence of games between teams of any size, a game of two one-player teams being
+    the usual two-player game. Stored as offsets into flat arrays:
+        - game g opposes the teams game_offsets[g]:game_offsets[g + 1], in finishing order, with
+          ranks `team_ranks` (0 is first, equal ranks are draws)
+        - team j is made of the players member_ids[team_offsets[j]:team_offsets[j + 1]]
+    Every game is compared as a chain of adjacent teams in finishing order (`comparisons`).
+    Player ids are checked to lie in [0, N) as in `WinLossHistory`.
+    """
+    game_offsets: np.ndarray
+    team_offsets: np.ndarray
+    member_ids: np.ndarray
+    team_ranks: np.ndarray
+    N: int
+
+    def __post_init__(self):
+        if np.any(np.diff(self.team_offsets) <= 0) or np.any(np.diff(self.game_offsets) < 2):
+            raise ValueError('Teams need at least one player and games at least two teams')
+        check_player_ids(self.N, member=self.member_ids)
+
+    @staticmethod
+    def create_from_dataframe(df: 'pd.DataFrame', N: int, game_col='game', team_col='team',
+                              player_col='player', rank_col='rank') -> 'TeamGameHistory':
+        """
+        From one row per player of each game: the game and team ids, the (1-based) player and
+        the rank of the team in the game.
+        """
+        df = df.sort_values([game_col, rank_col, team_col], kind='stable')
+        games = df[game_col].to_numpy()
+        teams = df[team_col].to_numpy()
+        new_team = np.ones((len(df),), dtype=bool)
+        new_team[1:] = (games[1:] != games[:-1]) | (teams[1:] != teams[:-1])
+        team_starts = np.flatnonzero(new_team)
+        team_games = games[team_starts]
+        new_game = np.ones((len(team_starts),), dtype=bool)
+        new_game[1:] = team_games[1:] != team_games[:-1]
+        return TeamGameHistory(
+            game_offsets=np.append(np.flatnonzero(new_game), len(team_starts)),
+            team_offsets=np.append(team_starts, len(df)),
+            member_ids=df[player_col].to_numpy(dtype=np.int64) - 1,
+            team_ranks=df[rank_col].to_numpy()[team_starts],
+            N=N)
+
+    @property
+    def G(self) -> int:
+        return len(self.game_offsets) - 1
+
+    @property
+    def num_teams(self) -> int:
+        return len(self.team_offsets) - 1
+
+    @property
+    def member_teams(self) -> np.ndarray:
+        """
+        Team of each entry of `member_ids`.
+        """
+        return np.repeat(np.arange(self.num_teams), np.diff(self.team_offsets))
+
+    def comparisons(self) -> WinLossHistory:
+        """
+        Adjacent teams of every game as a win/loss history over teams: the better placed team
+        as winner, flagged as a draw when both share their rank.
+        """
+        team_games = np.repeat(np.arange(self.G), np.diff(self.game_offsets))
+        better = np.flatnonzero(team_games[:-1] == team_games[1:])
+        return WinLossHistory(better, better + 1, self.num_teams,
+                              self.team_ranks[better] == self.team_ranks[better + 1])
+
+
+@dataclass(frozen=True)
+class DtypePolicy:
+    """
+    Floating point types of the EP state: `storage` for the player and game stats (messages and
+    marginals), `accumulator` for the workspace buffers of the moment matching kernel and of the
+    per-player message sums. Named policies, see `DTYPE_POLICIES`:
+        - 'float32': float32 throughout, for throughput
+        - 'float64': float64 throughout, for accuracy
+        - 'mixed': float32 stats with float64 accumulators (the default)
+    """
+    storage: type
+    accumulator: type
+
+    @staticmethod
+    def resolve(policy: Union[str, 'DtypePolicy'] = None, dtype=np.float32) -> 'DtypePolicy':
+        """
+        Policy given by name or as is. Without one, the policy matching arrays of `dtype`:
+        'float64' for float64 stats, 'mixed' otherwise.
+        """
+        if isinstance(policy, DtypePolicy):
+            return policy
+        if policy is None:
+            policy = 'float64' if np.dtype(dtype) == np.float64 else 'mixed'
+        if policy not in DTYPE_POLICIES:
+            raise ValueError(f'Unknown dtype policy: {policy}')
+        return DTYPE_POLICIES[policy]
+
+
+DTYPE_POLICIES = dict(float32=DtypePolicy(np.float32, np.float32),
+                      float64=DtypePolicy(np.float64, np.float64),
+                      mixed=DtypePolicy(np.float32, np.float64))
+
 
 class PlayerStatsFactory:
     """
@@ -38,22 +336,30 @@ class PlayerStatsFactory:
     """
 
     @staticmethod
-    def create_from_csv(path, sep=',', name_col='name') -> Tuple[PlayerStats, List, int]:
+    def allocate(N: int, dtype=np.float32, prior_mean: float = 0.,
+                 prior_variance: float = 1.) -> PlayerStats:
+        """
+        (N, 3, 2) player stats with the N(prior_mean, prior_variance) prior (N(0, 1) by
+        default) and no game messages yet.
+        """
+        player_stats = np.zeros((N, 3, 2), dtype=dtype)
+        player_stats[:, 1, 0] = prior_mean
+        player_stats[:, 1, 1] = 1. / prior_variance
+        return player_stats
+
+    @staticmethod
+    def create_from_csv(path, sep=',', name_col='name',
+                        policy='mixed') -> Tuple[PlayerStats, List, int]:
+        import pandas as pd
         player_df = pd.read_csv(path, sep=sep)
-        player_names = list(set(player_df[name_col].values))
-        N = len(player_names)
-        player_stats = np.zeros((N, 3, 2), dtype=np.float32)
-        player_stats[:, 1, 0] = np.zeros((N,), dtype=np.float32)
-        player_stats[:, 1, 1] = np.ones((N,), dtype=np.float32)
-        return player_stats, player_names, N
+        return PlayerStatsFactory.create_from_dataframe(player_df, name_col, policy)
 
     @staticmethod
-    def create_from_dataframe(player_df: pd.DataFrame, name_col='name'):
-        player_names = list(set(player_df[name_col].values))
+    def create_from_dataframe(player_df: 'pd.DataFrame', name_col='name', policy='mixed'):
+        # distinct names in file order: games refer to players by their 1-based row
+        player_names = list(dict.fromkeys(player_df[name_col].values))
         N = len(player_names)
-        player_stats = np.zeros((N, 3, 2), dtype=np.float32)
-        player_stats[:, 1, 0] = np.zeros((N,), dtype=np.float32)
-        player_stats[:, 1, 1] = np.ones((N,), dtype=np.float32)
+        player_stats = PlayerStatsFactory.allocate(N, DtypePolicy.resolve(policy).storage)
         return player_stats, player_names, N
 
 
@@ -63,20 +369,38 @@ class GameStatsFactory:
     """
 
     @staticmethod
-    def create_from_csv(path, N: int, sep=',') -> Tuple[GameStats, WinLossHistory]:
-        game_df = pd.read_csv(path, sep=sep)
-        K = len(game_df)
-        history = WinLossHistory.create_from_dataframe(game_df, N)
-        game_stats = np.zeros((K, 9, 2), dtype=np.float32)
-        game_stats[:, -2:, 0] = np.zeros((K, 2,), dtype=np.float32)
-        game_stats[:, -2:, 1] = np.zeros((K, 2,), dtype=np.float32)
-        return game_stats, history
+    def allocate(K: int, dtype=np.float32) -> GameStats:
+        """
+        Zeroed (K, 9, 2) game stats stored as a struct of arrays: the (K, 9, 2) array is a view
+        over a (2, 9, K) buffer, so each message parameter `game_stats[:, m, p]` is a contiguous
+        column while code indexing the (K, 9, 2) layout keeps working.
+        """
+        return np.zeros((2, 9, K), dtype=dtype).transpose(2, 1, 0)
+
+    @staticmethod
+    def create_from_csv(path, N: int, sep=',', chunksize: int = 2 ** 20,
+                        policy='mixed', compress=False) -> Tuple[GameStats, WinLossHistory]:
+        """
+        With `compress`, one message block per distinct game, see `WinLossHistory.compress`.
+        """
+        history = WinLossHistory.create_from_csv(path, N, sep=sep, chunksize=chunksize)
+        return GameStatsFactory._allocate_for(history, policy, compress)
 
     @staticmethod
-    def create_from_dataframe(game_df: pd.DataFrame, N: int) -> Tuple[GameStats, WinLossHistory]:
-        K = len(game_df)
+    def create_from_records(records: Iterable[Dict], N: int, batch_size: int = 2 ** 16,
+                            policy='mixed', compress=False) -> Tuple[GameStats, WinLossHistory]:
+        history = WinLossHistory.create_from_records(records, N, batch_size=batch_size)
+        return GameStatsFactory._allocate_for(history, policy, compress)
+
+    @staticmethod
+    def create_from_dataframe(game_df: 'pd.DataFrame', N: int,
+                              policy='mixed', compress=False) -> Tuple[GameStats, WinLossHistory]:
         history = WinLossHistory.create_from_dataframe(game_df, N)
-        game_stats = np.zeros((K, 9, 2), dtype=np.float32)
-        game_stats[:, -2:, 0] = np.zeros((K, 2,), dtype=np.float32)
-        game_stats[:, -2:, 1] = np.zeros((K, 2,), dtype=np.float32)
-        return game_stats, history
+        return GameStatsFactory._allocate_for(history, policy, compress)
+
+    @staticmethod
+    def _allocate_for(history: WinLossHistory, policy,
+                      compress: bool) -> Tuple[GameStats, WinLossHistory]:
+        if compress:
+            history = history.compress()
+        return GameStatsFactory.allocate(history.K, DtypePolicy.resolve(policy).storage), history
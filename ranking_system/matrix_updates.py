@@ -1,98 +1,296 @@
 from typing import Tuple
 
 import numpy as np
-import scipy.stats
 
-from matrix_stats import GameStats, PlayerStats, WinLossHistory
+from .matrix_stats import GameStats, PlayerStats, WinLossHistory, TeamGameHistory, DtypePolicy
+from .profiling import NULL_PROFILER, NullProfiler
+from .utils import psi_lambda, psi_lambda_draw, log_normaliser_draw
+
+
+class MatrixWorkspace:
+    """
+    Per-game scratch buffers preallocated once and reused by every sweep, so that message updates
+    write through ufunc `out=` arguments without allocating: `buffers` share the game stats
+    dtype, `wide` buffers have the `accumulator` dtype (see `DtypePolicy`), for the moment
+    matching kernel and the per-player sums.
+    """
+
+    def __init__(self, K: int, dtype=np.float32, accumulator=np.float64):
+        self.K = K
+        self.dtype = dtype
+        self.buffers = np.empty((2, K), dtype=dtype)
+        self.wide = np.empty((2, K), dtype=accumulator)
+        self.downwards = None
+
+    @staticmethod
+    def create(K: int, policy: DtypePolicy) -> 'MatrixWorkspace':
+        return MatrixWorkspace(K, policy.storage, policy.accumulator)
+
+    def previous_downwards(self, game_stats: GameStats) -> np.ndarray:
+        """
+        Copy of the downwards players messages `game_stats[:, 5:7, :]` kept for damping.
+        """
+        if self.downwards is None:
+            self.downwards = np.empty((2, 2, self.K), dtype=self.dtype).transpose(2, 1, 0)
+        np.copyto(self.downwards, game_stats[:, 5:7, :])
+        return self.downwards
+
+
+class MessageSanitiser:
+    """
+    Guard against invalid messages, e.g. a negative cavity precision from rounding once a
+    game's messages are near certain. Games whose cavity or downwards game precision is not
+    positive, or whose downwards game mean is not finite, are found in one pass (NaN fails
+    every comparison) and, depending on `mode`:
+        - 'skip': keep their previous downwards players messages (the EP skip-update rule)
+        - 'clip': clip their downwards players messages to uninformative ones (precision 0)
+        - 'raise': raise a ValueError naming how many games and the first one
+    `num_sanitised` counts the games sanitised so far.
+    """
+    MODES = ('skip', 'clip', 'raise')
+
+    def __init__(self, mode: str = 'skip'):
+        if mode not in self.MODES:
+            raise ValueError(f'Unknown sanitiser mode: {mode}')
+        self.mode = mode
+        self.num_sanitised = 0
+
+    def invalid_games(self, game_stats: GameStats, workspace: MatrixWorkspace = None) -> np.ndarray:
+        """
+        Indices of the games with invalid messages, once their downwards game message is
+        updated.
+        """
+        smallest = _workspace(game_stats, workspace).buffers[0]
+        np.minimum(game_stats[:, 0, 1], game_stats[:, 1, 1], out=smallest)
+        np.minimum(smallest, game_stats[:, 4, 1], out=smallest)
+        invalid = ~(smallest > 0.)
+        invalid |= ~np.isfinite(game_stats[:, 4, 0])
+        return np.flatnonzero(invalid)
+
+    def sanitise_games(self, game_stats: GameStats, invalid: np.ndarray,
+                       previous_downwards: np.ndarray) -> GameStats:
+        """
+        Handles the `invalid` games, `previous_downwards` holding their downwards players
+        messages before the update.
+        """
+        if not len(invalid):
+            return game_stats
+        self._count(len(invalid), invalid[0], 'games')
+        game_stats[invalid, 5:7, :] = previous_downwards if self.mode == 'skip' else 0.
+        return game_stats
+
+    def sanitise_members(self, member_messages: np.ndarray,
+                         cavity_precisions: np.ndarray) -> np.ndarray:
+        """
+        Messages from the team-sum factors to players leaving a non-positive cavity precision
+        are reset to uninformative ones in both 'skip' and 'clip' modes: the previous message
+        is the one at fault.
+        """
+        invalid = np.flatnonzero(~(cavity_precisions > 0.))
+        if len(invalid):
+            self._count(len(invalid), invalid[0], 'team members')
+            member_messages[invalid] = 0.
+        return member_messages
+
+    def _count(self, num_invalid: int, first: int, what: str):
+        if self.mode == 'raise':
+            raise ValueError(f'{num_invalid} {what} with invalid messages, the first at index '
+                             f'{first}')
+        self.num_sanitised += num_invalid
 
 
 class MatrixMessageUpdates:
 
     @staticmethod
-    def update_upwards_player_messages(game_stats: GameStats) -> GameStats:
-        marginal_w_precision = game_stats[:, 7, 1]
-        marginal_w_natural_mean = _natural_mean(marginal_w_precision, game_stats[:, 7, 0])
-        downwards_w_precision = game_stats[:, 6, 1]
-        downwards_w_natural_mean = _natural_mean(downwards_w_precision, game_stats[:, 6, 0])
+    def update_upwards_player_messages(game_stats: GameStats,
+                                       workspace: MatrixWorkspace = None) -> GameStats:
+        natural_mean, buffer = _workspace(game_stats, workspace).buffers
         # Winner update
-        game_stats[:, 0, 1] = marginal_w_precision - downwards_w_precision
-        if np.min(game_stats[:, 0, 1], axis=0) < 0:
-            raise ValueError
-        upwards_w_natural_mean = marginal_w_natural_mean - downwards_w_natural_mean
-        game_stats[:, 0, 0] = _mean(game_stats[:, 0, 1], upwards_w_natural_mean)
-
-        marginal_l_precision = game_stats[:, 8, 1]
-        marginal_l_natural_mean = _natural_mean(marginal_l_precision, game_stats[:, 8, 0])
-        downwards_l_precision = game_stats[:, 5, 1]
-        downwards_l_natural_mean = _natural_mean(downwards_l_precision, game_stats[:, 5, 0])
+        np.subtract(game_stats[:, 7, 1], game_stats[:, 6, 1], out=game_stats[:, 0, 1])
+        _natural_mean(game_stats[:, 7, 1], game_stats[:, 7, 0], out=natural_mean)
+        natural_mean -= _natural_mean(game_stats[:, 6, 1], game_stats[:, 6, 0], out=buffer)
+        _mean(game_stats[:, 0, 1], natural_mean, out=game_stats[:, 0, 0])
+
         # Loser update
-        game_stats[:, 1, 1] = marginal_l_precision - downwards_l_precision
-        if np.min(game_stats[:, 1, 1], axis=0) < 0:
-            raise ValueError
-        upwards_l_natural_mean = marginal_l_natural_mean - downwards_l_natural_mean
-        game_stats[:, 1, 0] = _mean(game_stats[:, 1, 1], upwards_l_natural_mean)
+        np.subtract(game_stats[:, 8, 1], game_stats[:, 5, 1], out=game_stats[:, 1, 1])
+        _natural_mean(game_stats[:, 8, 1], game_stats[:, 8, 0], out=natural_mean)
+        natural_mean -= _natural_mean(game_stats[:, 5, 1], game_stats[:, 5, 0], out=buffer)
+        _mean(game_stats[:, 1, 1], natural_mean, out=game_stats[:, 1, 0])
         return game_stats
 
     @staticmethod
-    def update_upwards_game_message(game_stats: GameStats) -> GameStats:
+    def update_upwards_game_message(game_stats: GameStats,
+                                    workspace: MatrixWorkspace = None,
+                                    noise: float = 1.) -> GameStats:
+        """
+        Performance difference of the game: difference of the players' cavity skills plus the
+        performance noise of variance `noise`.
+        """
+        buffer = _workspace(game_stats, workspace).buffers[0]
         upwards_w_mean, upwards_w_precision = game_stats[:, 0, 0], game_stats[:, 0, 1]
         upwards_l_mean, upwards_l_precision = game_stats[:, 1, 0], game_stats[:, 1, 1]
         # update
-        game_stats[:, 2, 0] = upwards_w_mean - upwards_l_mean
-        game_stats[:, 2, 1] = 1. / (1. + 1. / upwards_w_precision + 1. / upwards_l_precision)
+        np.subtract(upwards_w_mean, upwards_l_mean, out=game_stats[:, 2, 0])
+        _performance_precision(upwards_w_precision, upwards_l_precision, buffer,
+                               out=game_stats[:, 2, 1], noise=noise)
         return game_stats
 
     @staticmethod
-    def update_marginal_performance(game_stats: GameStats) -> GameStats:
+    def update_marginal_performance(game_stats: GameStats,
+                                    workspace: MatrixWorkspace = None,
+                                    draw_margin: float = 0.,
+                                    draws: np.ndarray = None) -> GameStats:
         """
         Updates suffient statistics of an approximation of marginal performance using moment
-        matching.
+        matching. With a `draw_margin` eps a win means a performance difference above eps, and
+        the games of the boolean mask `draws` are draws, |difference| <= eps.
         """
+        if draw_margin or draws is not None:
+            return MatrixMessageUpdates._update_marginal_performance_with_draws(
+                game_stats, draw_margin, draws)
+        workspace = _workspace(game_stats, workspace)
+        upwards_game_std, ratio = workspace.buffers
+        psi, lambda_ = workspace.wide
         upwards_game_mean, upwards_game_precision = game_stats[:, 2, 0], game_stats[:, 2, 1]
-        upwards_game_var = _var(upwards_game_precision)
-        upwards_game_std = _std(upwards_game_precision)
+        _std(upwards_game_precision, out=upwards_game_std)
+        np.divide(upwards_game_mean, upwards_game_std, out=ratio)
+        psi_lambda(ratio, out=(psi, lambda_))
         # Moment matching update
-        game_stats[:, 3, 0] = upwards_game_mean + upwards_game_std * _psi(
-            upwards_game_mean / upwards_game_std
-        )
-        game_stats[:, 3, 1] = _precision(upwards_game_var * (1. - _lambda(
-            upwards_game_mean / upwards_game_std
-        )))
+        np.multiply(upwards_game_std, psi, out=upwards_game_std)
+        np.add(upwards_game_mean, upwards_game_std, out=game_stats[:, 3, 0])
+        np.subtract(1., lambda_, out=lambda_)
+        lambda_ *= _var(upwards_game_precision, out=ratio)
+        _precision(lambda_, out=game_stats[:, 3, 1])
+        return game_stats
 
+    @staticmethod
+    def _update_marginal_performance_with_draws(game_stats: GameStats,
+                                                draw_margin: float,
+                                                draws: np.ndarray = None) -> GameStats:
+        if draws is not None and draws.any() and draw_margin <= 0.:
+            raise ValueError('Draws need a positive draw margin')
+        mean = game_stats[:, 2, 0].astype(np.float64)
+        std = _std(game_stats[:, 2, 1].astype(np.float64))
+        psi, lambda_ = psi_lambda((mean - draw_margin) / std)
+        if draws is not None and draws.any():
+            psi[draws], lambda_[draws] = psi_lambda_draw((-draw_margin - mean[draws]) / std[draws],
+                                                         (draw_margin - mean[draws]) / std[draws])
+        # Moment matching update
+        game_stats[:, 3, 0] = mean + std * psi
+        game_stats[:, 3, 1] = 1. / (std * std * (1. - lambda_))
         return game_stats
 
     @staticmethod
-    def update_downwards_game_message(game_stats: GameStats) -> GameStats:
+    def update_downwards_game_message(game_stats: GameStats,
+                                      workspace: MatrixWorkspace = None) -> GameStats:
+        natural_mean, buffer = _workspace(game_stats, workspace).buffers
         performance_precision = game_stats[:, 3, 1]
-        performance_natural_mean = _natural_mean(performance_precision, game_stats[:, 3, 0])
         upwards_game_precision = game_stats[:, 2, 1]
-        upwards_game_natural_mean = _natural_mean(upwards_game_precision, game_stats[:, 2, 0])
         # update
-        game_stats[:, 4, 1] = performance_precision - upwards_game_precision
-        downwards_game_natural_mean = performance_natural_mean - upwards_game_natural_mean
-        game_stats[:, 4, 0] = _mean(game_stats[:, 4, 1], downwards_game_natural_mean)
+        np.subtract(performance_precision, upwards_game_precision, out=game_stats[:, 4, 1])
+        _natural_mean(performance_precision, game_stats[:, 3, 0], out=natural_mean)
+        natural_mean -= _natural_mean(upwards_game_precision, game_stats[:, 2, 0], out=buffer)
+        _mean(game_stats[:, 4, 1], natural_mean, out=game_stats[:, 4, 0])
         return game_stats
 
     @staticmethod
-    def update_downwards_players_message(game_stats: GameStats) -> GameStats:
+    def update_downwards_players_message(game_stats: GameStats,
+                                         workspace: MatrixWorkspace = None,
+                                         noise: float = 1.) -> GameStats:
+        buffer = _workspace(game_stats, workspace).buffers[0]
         downwards_game_mean, downwards_game_precision = game_stats[:, 4, 0], game_stats[:, 4, 1]
         # Winner update
         upwards_l_mean, upwards_l_precision = game_stats[:, 1, 0], game_stats[:, 1, 1]
-        game_stats[:, 6, 0] = upwards_l_mean + downwards_game_mean
-        game_stats[:, 6, 1] = 1. / (1. + 1. / upwards_l_precision + 1. / downwards_game_precision)
+        np.add(upwards_l_mean, downwards_game_mean, out=game_stats[:, 6, 0])
+        _performance_precision(upwards_l_precision, downwards_game_precision, buffer,
+                               out=game_stats[:, 6, 1], noise=noise)
 
         # losser update
         upwards_w_mean, upwards_w_precision = game_stats[:, 0, 0], game_stats[:, 0, 1]
-        game_stats[:, 5, 0] = upwards_w_mean - downwards_game_mean
-        game_stats[:, 5, 1] = 1. / (1. + 1. / upwards_w_precision + 1. / downwards_game_precision)
+        np.subtract(upwards_w_mean, downwards_game_mean, out=game_stats[:, 5, 0])
+        _performance_precision(upwards_w_precision, downwards_game_precision, buffer,
+                               out=game_stats[:, 5, 1], noise=noise)
         return game_stats
 
-    def update_game_messages(self, game_stats: GameStats) -> GameStats:
-        game_stats = self.update_upwards_player_messages(game_stats)
-        game_stats = self.update_upwards_game_message(game_stats)
-        game_stats = self.update_marginal_performance(game_stats)
-        game_stats = self.update_downwards_game_message(game_stats)
-        game_stats = self.update_downwards_players_message(game_stats)
+    @staticmethod
+    def damp_downwards_players_messages(game_stats: GameStats,
+                                        previous_downwards: np.ndarray,
+                                        damping: float,
+                                        workspace: MatrixWorkspace = None) -> GameStats:
+        """
+        Replaces the downwards players messages by a convex combination, in natural parameters,
+        keeping a `damping` fraction of their previous values `previous_downwards`, i.e. a copy
+        of `game_stats[:, 5:7, :]` taken before the update.
+        """
+        if damping == 0.:
+            return game_stats
+        natural_mean, buffer = _workspace(game_stats, workspace).buffers
+        for message, previous in ((5, previous_downwards[:, 0, :]),
+                                  (6, previous_downwards[:, 1, :])):
+            precision = game_stats[:, message, 1]
+            _natural_mean(precision, game_stats[:, message, 0], out=natural_mean)
+            natural_mean *= 1. - damping
+            _natural_mean(previous[:, 1], previous[:, 0], out=buffer)
+            buffer *= damping
+            natural_mean += buffer
+            # update
+            precision *= 1. - damping
+            np.multiply(previous[:, 1], damping, out=buffer)
+            precision += buffer
+            _mean(precision, natural_mean, out=game_stats[:, message, 0])
+        return game_stats
+
+    def update_game_messages(self,
+                             game_stats: GameStats,
+                             workspace: MatrixWorkspace = None,
+                             draw_margin: float = 0.,
+                             draws: np.ndarray = None,
+                             sanitiser: 'MessageSanitiser' = None,
+                             profiler: NullProfiler = NULL_PROFILER,
+                             noise: float = 1.) -> GameStats:
+        """
+        Runs every message update of the games, each timed as a stage of `profiler`, with
+        performance noise of variance `noise`. The updates do not check their inputs: a
+        `sanitiser` screens the games for invalid messages (e.g. a negative cavity precision) in
+        a single pass before the downwards players messages are overwritten, and handles them
+        according to its mode.
+        """
+        workspace = _workspace(game_stats, workspace)
+        if sanitiser is None:
+            game_stats = self._update_factor_messages(game_stats, workspace, draw_margin, draws,
+                                                      profiler, noise)
+            with profiler.stage('update_downwards_players_message'):
+                return self.update_downwards_players_message(game_stats, workspace, noise)
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            game_stats = self._update_factor_messages(game_stats, workspace, draw_margin, draws,
+                                                      profiler, noise)
+            with profiler.stage('sanitise'):
+                invalid = sanitiser.invalid_games(game_stats, workspace)
+                previous_downwards = game_stats[invalid, 5:7, :]
+            with profiler.stage('update_downwards_players_message'):
+                game_stats = self.update_downwards_players_message(game_stats, workspace, noise)
+        with profiler.stage('sanitise'):
+            return sanitiser.sanitise_games(game_stats, invalid, previous_downwards)
+
+    def _update_factor_messages(self,
+                                game_stats: GameStats,
+                                workspace: MatrixWorkspace,
+                                draw_margin: float,
+                                draws: np.ndarray,
+                                profiler: NullProfiler,
+                                noise: float = 1.) -> GameStats:
+        """
+        Every update but the downwards players messages.
+        """
+        with profiler.stage('update_upwards_player_messages'):
+            game_stats = self.update_upwards_player_messages(game_stats, workspace)
+        with profiler.stage('update_upwards_game_message'):
+            game_stats = self.update_upwards_game_message(game_stats, workspace, noise)
+        with profiler.stage('update_marginal_performance'):
+            game_stats = self.update_marginal_performance(game_stats, workspace, draw_margin,
+                                                          draws)
+        with profiler.stage('update_downwards_game_message'):
+            game_stats = self.update_downwards_game_message(game_stats, workspace)
         return game_stats
 
 
@@ -101,19 +299,45 @@ class MatrixSkillUpdates:
     @staticmethod
     def compute_message_games(game_stats: GameStats,
                               player_stats: PlayerStats,
-                              history: WinLossHistory):
-        downwards_l_precision = game_stats[:, 5, 1]
-        downwards_l_natural_mean = _natural_mean(downwards_l_precision, game_stats[:, 5, 0])
-        downwards_w_precision = game_stats[:, 6, 1]
-        downwards_w_natural_mean = _natural_mean(downwards_w_precision, game_stats[:, 6, 0])
+                              history: WinLossHistory,
+                              workspace: MatrixWorkspace = None):
+        # float64 weights are passed to np.bincount without an intermediate copy
+        weights = _workspace(game_stats, workspace).wide[0]
         # Updates
+        np.copyto(weights, game_stats[:, 5, 1])
+        player_stats[:, 2, 1] = history.sum_over_losses(weights)
+        np.copyto(weights, game_stats[:, 6, 1])
+        player_stats[:, 2, 1] += history.sum_over_wins(weights)
+        _natural_mean(game_stats[:, 5, 1], game_stats[:, 5, 0], out=weights)
+        player_stats[:, 2, 0] = history.sum_over_losses(weights)
+        _natural_mean(game_stats[:, 6, 1], game_stats[:, 6, 0], out=weights)
+        player_stats[:, 2, 0] += history.sum_over_wins(weights)
+        return player_stats
 
-        for player_id in history.player_ids:
-            loss_idx, win_idx = history.losses[player_id], history.wins[player_id]
-            player_stats[player_id, 2, 1] = np.sum(downwards_l_precision[loss_idx])
-            player_stats[player_id, 2, 1] += np.sum(downwards_w_precision[win_idx])
-            player_stats[player_id, 2, 0] = np.sum(downwards_l_natural_mean[loss_idx])
-            player_stats[player_id, 2, 0] += np.sum(downwards_w_natural_mean[win_idx])
+    @staticmethod
+    def add_message_games(downwards: np.ndarray,
+                          player_stats: PlayerStats,
+                          winner_ids: np.ndarray,
+                          losser_ids: np.ndarray,
+                          sign: float = 1.,
+                          counts: np.ndarray = None) -> PlayerStats:
+        """
+        Adds (sign=1) or removes (sign=-1) the downwards players messages of a subset of games,
+        `downwards` laid out as `game_stats[:, 5:7, :]` and played by `winner_ids`/`losser_ids`,
+        to the per-player sums of game messages, each `counts` times (see
+        `WinLossHistory.counts`).
+        """
+        downwards_l_precision = downwards[:, 0, 1]
+        downwards_l_natural_mean = _natural_mean(downwards_l_precision, downwards[:, 0, 0])
+        downwards_w_precision = downwards[:, 1, 1]
+        downwards_w_natural_mean = _natural_mean(downwards_w_precision, downwards[:, 1, 0])
+        if counts is not None:
+            sign = sign * counts
+        # Updates
+        np.add.at(player_stats[:, 2, 1], losser_ids, sign * downwards_l_precision)
+        np.add.at(player_stats[:, 2, 1], winner_ids, sign * downwards_w_precision)
+        np.add.at(player_stats[:, 2, 0], losser_ids, sign * downwards_l_natural_mean)
+        np.add.at(player_stats[:, 2, 0], winner_ids, sign * downwards_w_natural_mean)
         return player_stats
 
     @staticmethod
@@ -131,50 +355,228 @@ class MatrixSkillUpdates:
     def insert_marginal_into_games(game_stats: GameStats,
                                    player_stats: PlayerStats,
                                    history: WinLossHistory) -> GameStats:
-        marginal_mean, marginal_precision = player_stats[:, 0, 0], player_stats[:, 0, 1]
-        for player_id in history.player_ids:
-            loss_idx, win_idx = history.losses[player_id], history.wins[player_id]
-            game_stats[win_idx, 7, 0] = np.tile(marginal_mean[player_id - 1], (len(win_idx),))
-            game_stats[win_idx, 7, 1] = np.tile(marginal_precision[player_id - 1], (len(win_idx),))
-            game_stats[loss_idx, 8, 0] = np.tile(marginal_mean[player_id - 1], (len(loss_idx),))
-            game_stats[loss_idx, 8, 1] = np.tile(marginal_precision[player_id - 1],
-                                                 (len(loss_idx),))
+        # ids are in range (checked by WinLossHistory): 'clip' only spares the buffered output
+        # of 'raise'
+        for message, player_ids in ((7, history.winner_ids), (8, history.losser_ids)):
+            np.take(player_stats[:, 0, 0], player_ids, out=game_stats[:, message, 0], mode='clip')
+            np.take(player_stats[:, 0, 1], player_ids, out=game_stats[:, message, 1], mode='clip')
         return game_stats
 
     def update_skill_marginals(self,
                                game_stats: GameStats,
                                player_stats: PlayerStats,
-                               history: WinLossHistory) -> Tuple[GameStats, PlayerStats]:
-        player_stats = self.compute_message_games(game_stats, player_stats, history)
-        player_stats = self.update_marginal(player_stats)
-        game_stats = self.insert_marginal_into_games(game_stats, player_stats, history)
+                               history: WinLossHistory,
+                               workspace: MatrixWorkspace = None,
+                               profiler=NULL_PROFILER) -> Tuple[GameStats, PlayerStats]:
+        with profiler.stage('compute_message_games'):
+            player_stats = self.compute_message_games(game_stats, player_stats, history,
+                                                      workspace)
+        with profiler.stage('update_marginal'):
+            player_stats = self.update_marginal(player_stats)
+        with profiler.stage('insert_marginal_into_games'):
+            game_stats = self.insert_marginal_into_games(game_stats, player_stats, history)
         return game_stats, player_stats
 
 
-def _natural_mean(precision, mean):
-    return precision * mean
+class MatrixTeamUpdates:
+    """
+    Team-sum performance factors: the performance of a team is the sum of its players' skills,
+    the performance noise being added once per comparison of two teams as in the two-player
+    model. Teams are stored as `PlayerStats` rows (prior: message from the sum
+    factor, row 2: messages from the comparisons of the team, as two-player games between
+    teams) and the messages from the sum factors to the players as one (mean, precision) row per
+    entry of `history.member_ids`.
+    """
 
+    @staticmethod
+    def update_team_priors(team_stats: PlayerStats,
+                           player_stats: PlayerStats,
+                           member_messages: np.ndarray,
+                           history: TeamGameHistory,
+                           sanitiser: 'MessageSanitiser' = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Message from each sum factor to its team: the sum of the players' cavity skills (their
+        marginal without the message from this team). Returns the cavity means and variances
+        of the players of each team, flat as `member_ids`. A `sanitiser` resets the messages
+        leaving a non-positive cavity precision before they are removed (see
+        `MessageSanitiser.sanitise_members`).
+        """
+        marginals = player_stats[history.member_ids, 0, :].astype(np.float64)
+        cavity_precisions = marginals[:, 1] - member_messages[:, 1]
+        if sanitiser is not None:
+            member_messages = sanitiser.sanitise_members(member_messages, cavity_precisions)
+            cavity_precisions = marginals[:, 1] - member_messages[:, 1]
+        cavity_means = _mean(cavity_precisions, _natural_mean(marginals[:, 1], marginals[:, 0]) -
+                             _natural_mean(member_messages[:, 1], member_messages[:, 0]))
+        cavity_vars = _var(cavity_precisions)
+        team_stats[:, 1, 0] = np.add.reduceat(cavity_means, history.team_offsets[:-1])
+        team_stats[:, 1, 1] = _precision(np.add.reduceat(cavity_vars, history.team_offsets[:-1]))
+        return cavity_means, cavity_vars
 
-def _mean(precision, natural_mean):
-    return natural_mean / precision
-
-
-def _var(precision):
-    assert np.min(precision, axis=0) > 0.
-    return 1. / precision
-
-
-def _precision(var):
-    return 1. / var
-
+    @staticmethod
+    def update_member_messages(team_stats: PlayerStats,
+                               member_messages: np.ndarray,
+                               cavity_means: np.ndarray,
+                               cavity_vars: np.ndarray,
+                               history: TeamGameHistory,
+                               damping: float = 0.) -> np.ndarray:
+        """
+        Message from each sum factor to its players: the product of the comparison messages of
+        the team minus the cavity skills of the team mates. With `damping`, a convex combination
+        in natural parameters keeping that fraction of the previous messages, as
+        `MatrixMessageUpdates.damp_downwards_players_messages`.
+        """
+        previous = member_messages.copy() if damping else None
+        member_teams = history.member_teams
+        precision = team_stats[member_teams, 2, 1].astype(np.float64)
+        informative = precision > 0.
+        mean = np.divide(team_stats[member_teams, 2, 0], precision, where=informative,
+                         out=np.zeros_like(precision))
+        team_means = np.add.reduceat(cavity_means, history.team_offsets[:-1])[member_teams]
+        team_vars = np.add.reduceat(cavity_vars, history.team_offsets[:-1])[member_teams]
+        member_messages[:, 0] = mean - (team_means - cavity_means)
+        member_messages[:, 1] = np.divide(
+            1., np.divide(1., precision, where=informative, out=np.zeros_like(precision)) +
+            team_vars - cavity_vars, where=informative, out=np.zeros_like(precision))
+        if damping:
+            natural_mean = (1. - damping) * _natural_mean(member_messages[:, 1],
+                                                          member_messages[:, 0]) + \
+                damping * _natural_mean(previous[:, 1], previous[:, 0])
+            member_messages[:, 1] *= 1. - damping
+            member_messages[:, 1] += damping * previous[:, 1]
+            np.divide(natural_mean, member_messages[:, 1], where=member_messages[:, 1] > 0.,
+                      out=member_messages[:, 0])
+        return member_messages
 
-def _std(precision):
-    return np.sqrt(1. / precision)
+    @staticmethod
+    def compute_member_messages(player_stats: PlayerStats,
+                                member_messages: np.ndarray,
+                                history: TeamGameHistory) -> PlayerStats:
+        """
+        Per-player sums of the messages from the sum factors of their teams.
+        """
+        player_stats[:, 2, 1] = np.bincount(history.member_ids, weights=member_messages[:, 1],
+                                            minlength=history.N)
+        player_stats[:, 2, 0] = np.bincount(history.member_ids,
+                                            weights=_natural_mean(member_messages[:, 1],
+                                                                  member_messages[:, 0]),
+                                            minlength=history.N)
+        return player_stats
 
 
-def _psi(x: np.ndarray) -> np.ndarray:
-    return scipy.stats.norm.pdf(x) / scipy.stats.norm.cdf(x)
+class MatrixEvidence:
+    """
+    EP approximation of the log marginal likelihood (evidence) of the games, the objective for
+    choosing the hyperparameters (performance noise, draw margin, prior). With the Gaussian
+    log-partition A(mean, precision) = (mean ** 2 * precision - log(precision)) / 2 (its
+    2 pi terms cancel out) of the marginals q, the priors p and the cavities of each game,
+        log Z_EP = sum_k (log Z_k + A(cavity_w) + A(cavity_l) - A(q_w) - A(q_l))
+                   + sum_i (A(q_i) - A(p_i))
+    where Z_k is the normaliser of the truncated performance difference that
+    `update_marginal_performance` moment matches. It is the EP estimate only at a fixed point of
+    the sweeps; with a single game it is exact.
+    """
 
+    @staticmethod
+    def log_normalisers(upwards_game_mean: np.ndarray,
+                        upwards_game_var: np.ndarray,
+                        draw_margin: float = 0.,
+                        draws: np.ndarray = None) -> np.ndarray:
+        """
+        Log probability of each game outcome given its upwards game message N(mean, var) (the
+        difference of the cavity skills plus noise): log Phi((mean - eps) / std) for a win and
+        log(Phi((eps - mean) / std) - Phi((-eps - mean) / std)) for a draw.
+        """
+        import scipy.special
+        if draws is not None and draws.any() and draw_margin <= 0.:
+            raise ValueError('Draws need a positive draw margin')
+        mean = np.asarray(upwards_game_mean, dtype=np.float64)
+        std = np.sqrt(upwards_game_var, dtype=np.float64)
+        log_z = scipy.special.log_ndtr((mean - draw_margin) / std)
+        if draws is not None and draws.any():
+            log_z[draws] = log_normaliser_draw((-draw_margin - mean[draws]) / std[draws],
+                                               (draw_margin - mean[draws]) / std[draws])
+        return log_z
 
-def _lambda(x: np.ndarray) -> np.ndarray:
-    return _psi(x) * (_psi(x) + x)
+    @staticmethod
+    def log_evidence(game_stats: GameStats,
+                     player_stats: PlayerStats,
+                     history: WinLossHistory,
+                     draw_margin: float = 0.,
+                     noise: float = 1.,
+                     chunk_size: int = 2 ** 20) -> float:
+        """
+        log Z_EP of the games from their downwards players messages and the players' marginals
+        and priors, in float64. Games are reduced `chunk_size` at a time, each weighted by its
+        count (see `WinLossHistory.counts`).
+        """
+        marginals = player_stats[:, 0, :].astype(np.float64)
+        priors = player_stats[:, 1, :].astype(np.float64)
+        log_evidence = np.sum(_log_partition(marginals[:, 0], marginals[:, 1]) -
+                              _log_partition(priors[:, 0], priors[:, 1]))
+        for start in range(0, history.K, chunk_size):
+            games = slice(start, min(start + chunk_size, history.K))
+            log_z = np.zeros((games.stop - start,), dtype=np.float64)
+            cavities = []
+            for message, player_ids in ((6, history.winner_ids), (5, history.losser_ids)):
+                mean, precision = marginals[player_ids[games], 0], marginals[player_ids[games], 1]
+                message_mean = game_stats[games, message, 0].astype(np.float64)
+                message_precision = game_stats[games, message, 1].astype(np.float64)
+                cavity_precision = precision - message_precision
+                cavity_mean = _mean(cavity_precision, _natural_mean(precision, mean) -
+                                    _natural_mean(message_precision, message_mean))
+                log_z += _log_partition(cavity_mean, cavity_precision) - \
+                    _log_partition(mean, precision)
+                cavities.append((cavity_mean, _var(cavity_precision)))
+            (winner_mean, winner_var), (losser_mean, losser_var) = cavities
+            draws = history.draws[games] if history.draws is not None else None
+            log_z += MatrixEvidence.log_normalisers(winner_mean - losser_mean,
+                                                    noise + winner_var + losser_var,
+                                                    draw_margin, draws)
+            log_evidence += np.dot(log_z, history.counts[games]) \
+                if history.counts is not None else np.sum(log_z)
+        return float(log_evidence)
+
+
+def _workspace(game_stats: GameStats, workspace: MatrixWorkspace = None) -> MatrixWorkspace:
+    if workspace is None or workspace.K != len(game_stats):
+        return MatrixWorkspace(len(game_stats), game_stats.dtype)
+    return workspace
+
+
+def _natural_mean(precision, mean, out=None):
+    return np.multiply(precision, mean, out=out)
+
+
+def _mean(precision, natural_mean, out=None):
+    return np.divide(natural_mean, precision, out=out)
+
+
+def _var(precision, out=None):
+    return np.divide(1., precision, out=out)
+
+
+def _precision(var, out=None):
+    return np.divide(1., var, out=out)
+
+
+def _std(precision, out=None):
+    return np.sqrt(np.divide(1., precision, out=out), out=out)
+
+
+def _log_partition(mean, precision):
+    """
+    Log-partition of N(mean, 1 / precision) in natural parameters, without its 2 pi term.
+    """
+    return 0.5 * (mean * mean * precision - np.log(precision))
+
+
+def _performance_precision(precision_a, precision_b, buffer, out=None, noise=1.):
+    """
+    Precision of the sum (or difference) of two Gaussians plus performance noise of variance
+    `noise`, 1 / (noise + 1 / precision_a + 1 / precision_b).
+    """
+    out = np.divide(1., precision_a, out=out)
+    out += np.divide(1., precision_b, out=buffer)
+    out += noise
+    return np.divide(1., out, out=out)
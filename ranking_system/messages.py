@@ -5,7 +5,7 @@ from dataclasses import dataclass
 import numpy as np
 from typing import List
 
-from utils import GaussianDistribution, StandardGaussian, Parameter
+from .utils import GaussianDistribution, Parameter, psi_lambda
 
 
 @dataclass
@@ -35,10 +35,12 @@ class GameToSkill(Message):
     def update(self,
                top_message: 'PerformanceToGame',
                bottom_message: 'SkillToGame',
-               is_winner: bool):
+               is_winner: bool,
+               noise: float = 1.):
         """
         For a given game and player, top_message represents the performace to game message comming
         from game results, where as bottom_message the skill to game message coming from players.
+        `noise` is the variance of the players' performances around their skills.
 
         Type of update: Marginalising product of Gaussians
         Notes: has to be computed for each game
@@ -48,7 +50,7 @@ class GameToSkill(Message):
             update_mean = bottom_message.mean + top_message.mean
         else:
             update_mean = bottom_message.mean - top_message.mean
-        update_variance = 1. + top_message.variance + bottom_message.variance
+        update_variance = noise + top_message.variance + bottom_message.variance
         self.update_mean_and_precision(updated_mean=update_mean, updated_var=update_variance)
         self.step += 1
 
@@ -114,17 +116,18 @@ class GameToPerformance(Message):
 
     def update(self,
                winner_message: SkillToGame,
-               losser_message: SkillToGame):
+               losser_message: SkillToGame,
+               noise: float = 1.):
         """
         For a given game, winner_message and losser_messages are the `SkillToGames` of each
-        players the winner and the losser.
+        players the winner and the losser, `noise` the variance of the performances.
 
         Type of update: Marginalising product of Gaussians
         Notes: has to be computed for each game
         """
         assert winner_message.step == losser_message.step
         update_mean = winner_message.mean - losser_message.mean
-        update_variance = 1. + winner_message.variance + losser_message.variance
+        update_variance = noise + winner_message.variance + losser_message.variance
 
         self.update_mean_and_precision(updated_mean=update_mean, updated_var=update_variance)
         self.step += 1
@@ -149,14 +152,9 @@ class MarginalPerformance(GaussianDistribution):
         """
         Explanation of moment matching
         """
-        normal = StandardGaussian()
-
-        update_mean = players_message.mean + players_message.std * normal.psi(
-            players_message.mean / players_message.std
-        )
-        update_variance = players_message.variance * (1. - normal.lambda_(
-            players_message.mean / players_message.std
-        ))
+        psi, lambda_ = psi_lambda(players_message.mean / players_message.std)
+        update_mean = players_message.mean + players_message.std * psi
+        update_variance = players_message.variance * (1. - lambda_)
 
         self.update_mean_and_precision(updated_mean=update_mean, updated_var=update_variance)
         self.step += 1
@@ -0,0 +1,293 @@
+import os
+import time
+import multiprocessing
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+
+from .matrix_ep import MatrixEPLoop
+from .matrix_stats import PlayerStats, GameStats, WinLossHistory
+from .matrix_updates import MatrixSkillUpdates
+from .profiling import NULL_PROFILER
+from .utils import ConvergenceReport, marginal_residual
+
+
+@dataclass
+class Shard:
+    """
+    A contiguous range of games of the shard-ordered game stats, with the players they involve.
+    `winner_ids`/`losser_ids` index into `player_ids`. A shard is independent when none of its
+    players plays in another shard.
+    """
+    start: int
+    end: int
+    player_ids: np.ndarray
+    winner_ids: np.ndarray
+    losser_ids: np.ndarray
+    independent: bool
+    draws: np.ndarray = None
+    counts: np.ndarray = None
+
+
+@dataclass
+class GraphPartition:
+    """
+    Split of the player/game graph into shards of roughly equal number of games. Whole connected
+    components are packed together; components larger than a shard are cut along a reverse
+    Cuthill-McKee ordering of their players, which keeps the players sharing games close and
+    hence the boundary between parts small. `order[k]` is the original index of the k-th game
+    of the shard-ordered game stats.
+    """
+    order: np.ndarray
+    shards: List[Shard]
+
+    @staticmethod
+    def create_from_history(history: WinLossHistory, num_shards: int) -> 'GraphPartition':
+        N, K = history.N, history.K
+        adjacency = scipy.sparse.coo_matrix(
+            (np.ones(K, dtype=np.int8), (history.winner_ids, history.losser_ids)),
+            shape=(N, N)).tocsr()
+        adjacency = adjacency + adjacency.T
+        num_components, component = scipy.sparse.csgraph.connected_components(
+            adjacency, directed=False)
+        games_per_component = np.bincount(component[history.winner_ids],
+                                          minlength=num_components)
+        degree = np.bincount(history.winner_ids, minlength=N) + \
+            np.bincount(history.losser_ids, minlength=N)
+        target = max(int(np.ceil(K / num_shards)), 1)
+
+        player_shard = np.zeros((N,), dtype=np.int64)
+        # Small components: longest-processing-time packing into bins of ~target games
+        small = np.flatnonzero(games_per_component <= target)
+        num_bins = max(int(np.ceil(games_per_component[small].sum() / target)), 1)
+        bin_load = np.zeros((num_bins,), dtype=np.int64)
+        component_shard = np.zeros((num_components,), dtype=np.int64)
+        for c in small[np.argsort(-games_per_component[small], kind='stable')]:
+            component_shard[c] = np.argmin(bin_load)
+            bin_load[component_shard[c]] += games_per_component[c]
+        player_shard[:] = component_shard[component]
+        # Large components: cut into parts of ~target games along the RCM order
+        num_shards = num_bins
+        large = np.flatnonzero(games_per_component > target)
+        if len(large):
+            rcm_order = scipy.sparse.csgraph.reverse_cuthill_mckee(adjacency,
+                                                                   symmetric_mode=True)
+            for c in large:
+                players = rcm_order[component[rcm_order] == c]
+                num_parts = int(np.ceil(games_per_component[c] / target))
+                load = np.cumsum(degree[players]) / (2. * games_per_component[c])
+                parts = np.minimum((load * num_parts).astype(np.int64), num_parts - 1)
+                player_shard[players] = num_shards + parts
+                num_shards += num_parts
+
+        game_shard = player_shard[history.winner_ids]
+        order = np.argsort(game_shard, kind='stable')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(game_shard, minlength=num_shards))])
+        is_boundary = player_shard[history.winner_ids] != player_shard[history.losser_ids]
+        boundary_shards = np.zeros((num_shards,), dtype=bool)
+        boundary_shards[game_shard[is_boundary]] = True
+        boundary_shards[player_shard[history.losser_ids[is_boundary]]] = True
+        shards = []
+        for s in range(num_shards):
+            if bounds[s] == bounds[s + 1]:
+                continue
+            games_idx = order[bounds[s]:bounds[s + 1]]
+            winner_ids, losser_ids = history.winner_ids[games_idx], history.losser_ids[games_idx]
+            plays = np.zeros((N,), dtype=bool)
+            plays[winner_ids] = True
+            plays[losser_ids] = True
+            local_ids = np.cumsum(plays) - 1
+            shards.append(Shard(start=int(bounds[s]),
+                                end=int(bounds[s + 1]),
+                                player_ids=np.flatnonzero(plays),
+                                winner_ids=local_ids[winner_ids],
+                                losser_ids=local_ids[losser_ids],
+                                independent=not boundary_shards[s],
+                                draws=history.draws[games_idx]
+                                if history.draws is not None else None,
+                                counts=history.counts[games_idx]
+                                if history.counts is not None else None))
+        return GraphPartition(order, shards)
+
+
+class ShardedMatrixEPLoop(MatrixEPLoop):
+    """
+    MatrixEPLoop running its sweeps over a process pool. The games are split into shards (see
+    `GraphPartition`) whose message blocks live in shared memory. Independent shards run all
+    their sweeps in a single task. The others run `inner_sweeps` sweeps per outer iteration,
+    treating the messages from games of other shards as part of their players' prior. Their
+    per-player message sums are then gathered to refresh the marginals of boundary players.
+    With `inner_sweeps=1` this is the same schedule as `MatrixEPLoop.run`.
+    """
+
+    def __init__(self,
+                 players: PlayerStats,
+                 games: GameStats,
+                 history: WinLossHistory,
+                 player_names: List,
+                 num_workers: int = None,
+                 num_shards: int = None,
+                 draw_margin: float = 0.,
+                 dtype_policy=None,
+                 sanitise: str = 'skip',
+                 noise: float = 1.):
+        super().__init__(players, games, history, player_names, draw_margin=draw_margin,
+                         dtype_policy=dtype_policy, sanitise=sanitise, noise=noise)
+        self.num_workers = num_workers or os.cpu_count()
+        self.num_shards = num_shards or self.num_workers
+
+    def run(self, num_iterations, logging=True, tol=None, damping=0.,
+            inner_sweeps=1, profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        `profiler` times the stages run in this process: one sweep for the independent shards
+        (stage 'independent_shards') and then one per outer iteration over the coupled ones.
+        The stages inside the workers are not timed.
+        """
+        report = ConvergenceReport(tol=tol)
+        t0 = time.time()
+        self.pending_games = np.arange(0)
+        partition = GraphPartition.create_from_history(self.history, self.num_shards)
+        independent = [i for i, shard in enumerate(partition.shards) if shard.independent]
+        coupled = [i for i, shard in enumerate(partition.shards) if not shard.independent]
+
+        K, N = self.history.K, self.history.N
+        games_memory = shared_memory.SharedMemory(create=True,
+                                                  size=max(self.game_stats.nbytes, 1))
+        sums_memory = shared_memory.SharedMemory(create=True, size=max(N * 2 * 8, 1))
+        game_stats = message_sums = None
+        try:
+            game_stats = np.ndarray((2, 9, K), dtype=self.game_stats.dtype,
+                                    buffer=games_memory.buf).transpose(2, 1, 0)
+            # partition.order is a permutation of the games: 'clip' never clips
+            for message in range(9):
+                for parameter in range(2):
+                    np.take(self.game_stats[:, message, parameter], partition.order,
+                            out=game_stats[:, message, parameter], mode='clip')
+            message_sums = np.ndarray((N, 2), dtype=np.float64, buffer=sums_memory.buf)
+            ordered_history = self.history.subset(partition.order)
+            self.player_stats = MatrixSkillUpdates.compute_message_games(
+                game_stats, self.player_stats, ordered_history)
+            message_sums[:] = self.player_stats[:, 2, :]
+            self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+
+            context = multiprocessing.get_context('fork')
+            with context.Pool(self.num_workers,
+                              initializer=_attach_shared_state,
+                              initargs=(games_memory.name, sums_memory.name,
+                                        game_stats.dtype, K, N,
+                                        self.player_stats[:, 1, :].copy(),
+                                        partition.shards, self.draw_margin,
+                                        self.dtype_policy,
+                                        self.sanitiser.mode if self.sanitiser else None,
+                                        self.noise)) as pool:
+                profiler.start_sweep()
+                with profiler.stage('independent_shards'):
+                    results = pool.starmap(_run_shard, [(s, num_iterations, damping, tol)
+                                                        for s in independent])
+                for s, (sums, num_sanitised) in zip(independent, results):
+                    message_sums[partition.shards[s].player_ids] = sums
+                    report.num_sanitised += num_sanitised
+                if independent:
+                    profiler.end_sweep(float('nan'))
+                if logging and independent:
+                    print(f'#### {len(independent)} independent shards completed #### '
+                          f'time elapsed {time.time()-t0}')
+
+                for tau in range(num_iterations if coupled else 0):
+                    profiler.start_sweep()
+                    t_sweep = time.time()
+                    previous_marginals = self.player_stats[:, 0, :].copy()
+                    with profiler.stage('coupled_shards'):
+                        results = pool.starmap(_run_shard, [(s, inner_sweeps, damping, None)
+                                                            for s in coupled])
+                    with profiler.stage('compute_message_games'):
+                        for s in coupled:
+                            message_sums[partition.shards[s].player_ids] = 0.
+                        for s, (sums, num_sanitised) in zip(coupled, results):
+                            message_sums[partition.shards[s].player_ids] += sums
+                            report.num_sanitised += num_sanitised
+                        self.player_stats[:, 2, :] = message_sums
+                    with profiler.stage('update_marginal'):
+                        self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+                    residual = marginal_residual(
+                        previous_marginals[:, 0], previous_marginals[:, 1],
+                        self.player_stats[:, 0, 0], self.player_stats[:, 0, 1])
+                    report.record(residual, time.time() - t_sweep)
+                    profiler.end_sweep(residual)
+                    if logging and (tau + 1) % max(num_iterations // 2, 1) == 0:
+                        print(f'#### EP iteration #{tau + 1} completed over {len(coupled)} '
+                              f'coupled shards #### time elapsed {time.time()-t0}')
+                    if report.converged:
+                        break
+
+            for message in range(9):
+                for parameter in range(2):
+                    self.game_stats[:, message, parameter][partition.order] = \
+                        game_stats[:, message, parameter]
+        finally:
+            del game_stats, message_sums
+            games_memory.close()
+            games_memory.unlink()
+            sums_memory.close()
+            sums_memory.unlink()
+        self.game_stats, self.player_stats = MatrixSkillUpdates().update_skill_marginals(
+            self.game_stats, self.player_stats, self.history, self.workspace)
+        return report
+
+
+# Worker state: attached once per process of the pool
+_worker = {}
+
+
+def _attach_shared_state(games_name, sums_name, dtype, K, N, priors, shards, draw_margin,
+                         dtype_policy, sanitise, noise):
+    games_memory = shared_memory.SharedMemory(name=games_name)
+    sums_memory = shared_memory.SharedMemory(name=sums_name)
+    _worker.update(
+        memories=(games_memory, sums_memory),
+        game_stats=np.ndarray((2, 9, K), dtype=dtype,
+                              buffer=games_memory.buf).transpose(2, 1, 0),
+        message_sums=np.ndarray((N, 2), dtype=np.float64, buffer=sums_memory.buf),
+        priors=priors,
+        shards=shards,
+        draw_margin=draw_margin,
+        dtype_policy=dtype_policy,
+        sanitise=sanitise,
+        noise=noise,
+        loops={},
+    )
+
+
+def _run_shard(shard_idx: int, num_sweeps: int, damping: float, tol) -> Tuple[np.ndarray, int]:
+    """
+    Runs EP sweeps over the games of a shard, in place in the shared game stats. Messages from
+    games of other shards are folded into the prior of the shard's players. Returns the shard's
+    own per-player message sums and the number of messages sanitised by these sweeps.
+    """
+    shard = _worker['shards'][shard_idx]
+    if shard_idx not in _worker['loops']:
+        n = len(shard.player_ids)
+        _worker['loops'][shard_idx] = MatrixEPLoop(
+            np.zeros((n, 3, 2), dtype=_worker['game_stats'].dtype),
+            _worker['game_stats'][shard.start:shard.end],
+            WinLossHistory(shard.winner_ids, shard.losser_ids, n, shard.draws, shard.counts),
+            player_names=None,
+            draw_margin=_worker['draw_margin'],
+            dtype_policy=_worker['dtype_policy'],
+            sanitise=_worker['sanitise'],
+            noise=_worker['noise'])
+    ep = _worker['loops'][shard_idx]
+    ep.player_stats = MatrixSkillUpdates.compute_message_games(ep.game_stats, ep.player_stats,
+                                                               ep.history, ep.workspace)
+    # cavity prior: prior times the messages of this shard's players from other shards' games
+    priors = _worker['priors'][shard.player_ids]
+    external = _worker['message_sums'][shard.player_ids] - ep.player_stats[:, 2, :]
+    precision = priors[:, 1] + external[:, 1]
+    ep.player_stats[:, 1, 1] = precision
+    ep.player_stats[:, 1, 0] = (priors[:, 1] * priors[:, 0] + external[:, 0]) / precision
+    report = ep.run(num_sweeps, logging=False, tol=tol, damping=damping)
+    return ep.player_stats[:, 2, :].astype(np.float64), report.num_sanitised
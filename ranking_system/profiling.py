@@ -0,0 +1,173 @@
+"""
+Instrumentation of EP sweeps. The loops' `run` methods take a profiler: `SweepProfiler` times
+every message update stage, records the residual of each sweep and optionally the memory
+allocated by each stage (`tracemalloc`), while the default `NULL_PROFILER` does nothing. Each
+completed sweep is published as a `SweepMetrics` to the profiler's callbacks, e.g. `log_sweep`
+or an exporter consuming `SweepMetrics.samples()`.
+"""
+import time
+import tracemalloc
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# tracemalloc.reset_peak is new in Python 3.9. On 3.8 clearing the traces resets the peak too,
+# at the cost of forgetting the blocks allocated before the stage (a stage freeing them is not
+# credited) and the traces of any other tracemalloc user.
+_reset_peak = getattr(tracemalloc, 'reset_peak', tracemalloc.clear_traces)
+
+
+@dataclass
+class SweepMetrics:
+    """
+    Measurements of one EP sweep: wall time and call count per stage (named after the
+    `MatrixMessageUpdates`/`MatrixSkillUpdates` step), and with memory tracing the bytes each
+    stage left allocated and its transient peak above its starting point.
+    """
+    sweep: int
+    residual: float
+    seconds: float
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+    stage_calls: Dict[str, int] = field(default_factory=dict)
+    stage_allocated_bytes: Dict[str, int] = field(default_factory=dict)
+    stage_peak_bytes: Dict[str, int] = field(default_factory=dict)
+
+    def samples(self, prefix: str = 'ep') -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        Flat (metric name, labels, value) samples, the shape expected by Prometheus-style
+        exporters.
+        """
+        samples = [(f'{prefix}_sweep_seconds', {}, self.seconds),
+                   (f'{prefix}_sweep_residual', {}, self.residual)]
+        for name, values in ((f'{prefix}_stage_seconds', self.stage_seconds),
+                             (f'{prefix}_stage_calls', self.stage_calls),
+                             (f'{prefix}_stage_allocated_bytes', self.stage_allocated_bytes),
+                             (f'{prefix}_stage_peak_bytes', self.stage_peak_bytes)):
+            samples.extend((name, {'stage': stage}, value) for stage, value in values.items())
+        return samples
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullProfiler:
+    """
+    Disabled instrumentation: every hook is a no-op, `stage` returning a shared context
+    manager, so an uninstrumented sweep only pays a few attribute lookups per stage.
+    """
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def start_sweep(self):
+        pass
+
+    def end_sweep(self, residual: float):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 't0', 'memory')
+
+    def __init__(self, profiler: 'SweepProfiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.trace_memory:
+            _reset_peak()
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t0
+        profiler = self.profiler
+        profiler._seconds[self.name] += elapsed
+        profiler._calls[self.name] += 1
+        if profiler.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            profiler._allocated[self.name] += current - self.memory
+            profiler._peak[self.name] = max(profiler._peak[self.name], peak - self.memory)
+        return False
+
+
+class SweepProfiler(NullProfiler):
+    """
+    Per-stage timers and per-sweep residuals of EP runs, kept in `sweeps` and passed to each of
+    `callbacks` as a sweep completes. With `trace_memory`, allocations are traced with
+    `tracemalloc` (started on the first sweep if needed, and stopped by `close` in that case),
+    which slows the numpy updates down noticeably: use it to study memory, not time.
+    """
+
+    def __init__(self, trace_memory: bool = False,
+                 callbacks: Iterable[Callable[[SweepMetrics], None]] = ()):
+        self.trace_memory = trace_memory
+        self.callbacks = list(callbacks)
+        self.sweeps: List[SweepMetrics] = []
+        self._started_tracing = False
+        self._reset()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def start_sweep(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._reset()
+        self._t0 = time.perf_counter()
+
+    def end_sweep(self, residual: float):
+        metrics = SweepMetrics(sweep=len(self.sweeps),
+                               residual=residual,
+                               seconds=time.perf_counter() - self._t0,
+                               stage_seconds=dict(self._seconds),
+                               stage_calls=dict(self._calls),
+                               stage_allocated_bytes=dict(self._allocated),
+                               stage_peak_bytes=dict(self._peak))
+        self.sweeps.append(metrics)
+        for callback in self.callbacks:
+            callback(metrics)
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def totals(self) -> Dict[str, float]:
+        """
+        Seconds spent in each stage over all the sweeps recorded, largest first.
+        """
+        totals = defaultdict(float)
+        for metrics in self.sweeps:
+            for stage, seconds in metrics.stage_seconds.items():
+                totals[stage] += seconds
+        return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+    def _reset(self):
+        self._seconds = defaultdict(float)
+        self._calls = defaultdict(int)
+        self._allocated = defaultdict(int)
+        self._peak = defaultdict(int)
+        self._t0 = time.perf_counter()
+
+
+def log_sweep(metrics: SweepMetrics, print_fn: Callable = print):
+    """
+    `SweepProfiler` callback printing one line per sweep with its slowest stages.
+    """
+    stages = sorted(metrics.stage_seconds.items(), key=lambda item: -item[1])[:3]
+    print_fn(f'#### EP sweep #{metrics.sweep + 1} {metrics.seconds:.3f}s residual '
+             f'{metrics.residual:.2e} #### ' +
+             ', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in stages))
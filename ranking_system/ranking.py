@@ -0,0 +1,120 @@
+from typing import Callable, Tuple
+
+import numpy as np
+
+from .simulation import win_probability
+
+
+class Ranking:
+    """
+    Players ordered by decreasing score: the mean of their marginal skill or, with
+    `conservative=c`, the conservative estimate mean - c * std. Ties are broken by player index.
+
+    `marginal_skills` returns the (means, precisions) arrays of the players. Scores and orderings
+    are computed lazily and cached until `invalidate` is called: top-k queries partially sort
+    with `np.argpartition` and the full order is only sorted when a query needs it. The cache
+    does not see in-place edits of the arrays behind `marginal_skills`: call `invalidate` after
+    them.
+    """
+
+    def __init__(self,
+                 marginal_skills: Callable[[], Tuple[np.ndarray, np.ndarray]],
+                 conservative: float = 0.):
+        self.marginal_skills = marginal_skills
+        self.conservative = conservative
+        self.invalidate()
+
+    def invalidate(self):
+        self._scores = None
+        self._top = np.arange(0)
+        self._order = None
+        self._positions = None
+
+    @property
+    def scores(self) -> np.ndarray:
+        if self._scores is None:
+            means, precisions = self.marginal_skills()
+            scores = np.asarray(means, dtype=np.float64)
+            if self.conservative:
+                scores = scores - self.conservative / np.sqrt(precisions)
+            self._scores = scores
+        return self._scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    def top_k(self, k: int) -> np.ndarray:
+        """
+        Indices of the `k` best players, best first.
+        """
+        k = min(k, len(self))
+        if self._order is not None:
+            return self._order[:k]
+        if k > len(self._top):
+            if 2 * k >= len(self):
+                return self.order()[:k]
+            top = np.argpartition(-self.scores, k - 1)[:k]
+            # every player tied with the k-th score, which argpartition splits arbitrarily
+            top = np.flatnonzero(self.scores >= self.scores[top].min())
+            if 2 * len(top) >= len(self):
+                return self.order()[:k]
+            self._top = top[np.lexsort((top, -self.scores[top]))]
+        return self._top[:k]
+
+    def page(self, offset: int, limit: int) -> np.ndarray:
+        """
+        Indices of the players at positions [offset, offset + limit), best first.
+        """
+        return self.top_k(offset + limit)[offset:offset + limit]
+
+    def order(self) -> np.ndarray:
+        """
+        Indices of all the players, best first.
+        """
+        if self._order is None:
+            self._order = np.argsort(-self.scores, kind='stable')
+        return self._order
+
+    def rank_of(self, player: int) -> int:
+        """
+        0-based position of `player` in the ranking.
+        """
+        if self._positions is None:
+            self._positions = np.empty((len(self),), dtype=np.int64)
+            self._positions[self.order()] = np.arange(len(self))
+        return int(self._positions[player])
+
+
+class MarginalSkillQueries:
+    """
+    Ranking and prediction queries shared by the engines, read from the marginal skills (row 0)
+    of their (N, 3, 2) `player_stats` with their performance `noise`. The engines keep the
+    `rankings` cache, `Ranking`s by `conservative` value, and call `invalidate_rankings` whenever
+    the marginal skills change.
+    """
+    player_stats: np.ndarray
+    noise: float
+    rankings: dict
+
+    def ranking(self, conservative: float = 0.) -> Ranking:
+        """
+        Cached ranking of the players by marginal skill mean minus `conservative` standard
+        deviations. In-place edits of `player_stats` need `ranking(...).invalidate()`.
+        """
+        if conservative not in self.rankings:
+            self.rankings[conservative] = Ranking(self._marginal_skills, conservative)
+        return self.rankings[conservative]
+
+    def invalidate_rankings(self):
+        for ranking in self.rankings.values():
+            ranking.invalidate()
+
+    def predict_win_probability(self, p1_idx: np.ndarray, p2_idx: np.ndarray) -> np.ndarray:
+        """
+        Probability that each player of `p1_idx` beats the player at the same position of
+        `p2_idx`.
+        """
+        return win_probability(*self._marginal_skills(), p1_idx, p2_idx, self.noise)
+
+    def _marginal_skills(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.player_stats[:, 0, 0], self.player_stats[:, 0, 1]
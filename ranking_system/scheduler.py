@@ -0,0 +1,88 @@
+"""
+Active match scheduling: candidate pairs of players are scored by the expected reduction of the
+entropy of their marginal skills if the game were played, and the most informative ones are
+scheduled. The posterior after each outcome is obtained by running the candidate game through
+the EP message updates (`MatrixMessageUpdates`) from the current marginals, so the scores follow
+the same moment matching as training.
+"""
+import numpy as np
+
+from .matrix_stats import PlayerStats, GameStatsFactory
+from .matrix_updates import MatrixMessageUpdates
+from .simulation import win_probability
+
+
+def expected_information_gain(player_stats: PlayerStats,
+                              p1_idx: np.ndarray,
+                              p2_idx: np.ndarray,
+                              noise: float = 1.) -> np.ndarray:
+    """
+    Expected entropy reduction (nats) of the marginal skills of both players of each pair
+    (`p1_idx[m]`, `p2_idx[m]`) after observing the outcome of a game between them, under
+    performance noise of variance `noise` (that of the loop the marginals come from).
+    """
+    p1_idx, p2_idx = np.asarray(p1_idx), np.asarray(p2_idx)
+    M = len(p1_idx)
+    marginals = player_stats[:, 0, :].astype(np.float64)
+    # Both outcomes at once: rows [0, M) p1 beats p2, rows [M, 2M) p2 beats p1
+    winners = np.concatenate([p1_idx, p2_idx])
+    lossers = np.concatenate([p2_idx, p1_idx])
+    games = GameStatsFactory.allocate(2 * M, dtype=np.float64)
+    games[:, 7, :] = marginals[winners]
+    games[:, 8, :] = marginals[lossers]
+    games = MatrixMessageUpdates().update_game_messages(games, noise=noise)
+    # Entropy reduction of a Gaussian: log(std_before / std_after) = 0.5 log(prec_after / prec)
+    gains = 0.5 * (np.log1p(games[:, 6, 1] / games[:, 7, 1]) +
+                   np.log1p(games[:, 5, 1] / games[:, 8, 1]))
+    p1_wins = win_probability(marginals[:, 0], marginals[:, 1], p1_idx, p2_idx, noise)
+    return p1_wins * gains[:M] + (1. - p1_wins) * gains[M:]
+
+
+def neighbourhood_candidates(means: np.ndarray, window: int) -> np.ndarray:
+    """
+    Pairs of players at most `window` positions apart in the ordering by skill mean: the close
+    matches, among which the informative ones lie, in O(N window) rather than O(N^2) pairs.
+    Returns an (M, 2) array of player indices.
+    """
+    order = np.argsort(means, kind='stable')
+    N = len(order)
+    offsets = np.arange(1, min(window, N - 1) + 1)
+    first = np.repeat(np.arange(N), len(offsets))
+    second = first + np.tile(offsets, N)
+    valid = second < N
+    return np.stack([order[first[valid]], order[second[valid]]], axis=1)
+
+
+def schedule_matches(player_stats: PlayerStats,
+                     k: int,
+                     window: int = 8,
+                     num_random: int = 0,
+                     distinct_players: bool = True,
+                     rng: np.random.Generator = None,
+                     noise: float = 1.) -> np.ndarray:
+    """
+    The `k` candidate pairs with the largest expected information gain, best first, as a (k, 2)
+    array. Candidates are the skill-sorted neighbourhood pairs plus `num_random` uniformly drawn
+    pairs, which let uncertain players meet far from their current mean. With
+    `distinct_players` every player appears in at most one of the scheduled pairs, so that a
+    round of games can be played at once. `noise` is as in `expected_information_gain`.
+    """
+    N = len(player_stats)
+    candidates = neighbourhood_candidates(player_stats[:, 0, 0], window)
+    if num_random:
+        rng = rng or np.random.default_rng()
+        p1 = rng.integers(0, N, size=num_random)
+        p2 = (p1 + rng.integers(1, N, size=num_random)) % N
+        candidates = np.concatenate([candidates, np.stack([p1, p2], axis=1)])
+    gains = expected_information_gain(player_stats, candidates[:, 0], candidates[:, 1], noise)
+    ranked = np.argsort(-gains, kind='stable')
+    if not distinct_players:
+        return candidates[ranked[:k]]
+    scheduled, busy = [], np.zeros((N,), dtype=bool)
+    for p1, p2 in candidates[ranked]:
+        if not busy[p1] and not busy[p2]:
+            busy[p1] = busy[p2] = True
+            scheduled.append((p1, p2))
+            if len(scheduled) == k:
+                break
+    return np.array(scheduled, dtype=np.int64).reshape(-1, 2)
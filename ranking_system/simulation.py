@@ -0,0 +1,66 @@
+"""
+Vectorised predictions from marginal skills (`means`, `precisions` indexed by player): player
+1 beats player 2 with probability Phi((mean_1 - mean_2) / sqrt(noise + var_1 + var_2)), the
+posterior predictive of the probit game model with performance noise of variance `noise` (1 by
+default).
+"""
+import numpy as np
+
+
+def win_probability(means: np.ndarray,
+                    precisions: np.ndarray,
+                    p1_idx: np.ndarray,
+                    p2_idx: np.ndarray,
+                    noise: float = 1.) -> np.ndarray:
+    """
+    Probability that each player of `p1_idx` beats the player at the same position of `p2_idx`.
+    """
+    import scipy.special
+    means = np.asarray(means, dtype=np.float64)
+    variances = 1. / np.asarray(precisions, dtype=np.float64)
+    p1_idx, p2_idx = np.asarray(p1_idx), np.asarray(p2_idx)
+    std = np.sqrt(noise + variances[p1_idx] + variances[p2_idx])
+    return scipy.special.ndtr((means[p1_idx] - means[p2_idx]) / std)
+
+
+def simulate_games(means: np.ndarray,
+                   precisions: np.ndarray,
+                   pairs: np.ndarray,
+                   rng: np.random.Generator = None,
+                   noise: float = 1.):
+    """
+    Samples the outcome of each game of `pairs` (array of shape (M, 2) of player indices).
+    Returns the winners and lossers arrays.
+    """
+    rng = rng or np.random.default_rng()
+    pairs = np.asarray(pairs)
+    p1_wins = rng.random(len(pairs)) < win_probability(means, precisions, pairs[:, 0],
+                                                       pairs[:, 1], noise)
+    winners = np.where(p1_wins, pairs[:, 0], pairs[:, 1])
+    lossers = np.where(p1_wins, pairs[:, 1], pairs[:, 0])
+    return winners, lossers
+
+
+def simulate_tournament(means: np.ndarray,
+                        precisions: np.ndarray,
+                        bracket: np.ndarray,
+                        n_samples: int,
+                        rng: np.random.Generator = None,
+                        noise: float = 1.) -> np.ndarray:
+    """
+    Samples `n_samples` runs of a single-elimination tournament at once. `bracket` lists the
+    players in draw order (first round: bracket[0] v bracket[1], bracket[2] v bracket[3], ...),
+    its length a power of 2, padded with -1 for byes. Returns the champion of each sample.
+    """
+    rng = rng or np.random.default_rng()
+    bracket = np.asarray(bracket)
+    if len(bracket) & (len(bracket) - 1):
+        raise ValueError(f'Bracket size {len(bracket)} is not a power of 2, pad it with -1 byes')
+    remaining = np.tile(bracket, (n_samples, 1))
+    while remaining.shape[1] > 1:
+        p1, p2 = remaining[:, 0::2], remaining[:, 1::2]
+        probs_p1_wins = win_probability(means, precisions, np.maximum(p1, 0), np.maximum(p2, 0),
+                                        noise)
+        probs_p1_wins = np.where(p2 < 0, 1., np.where(p1 < 0, 0., probs_p1_wins))
+        remaining = np.where(rng.random(p1.shape) < probs_p1_wins, p1, p2)
+    return remaining[:, 0]
@@ -0,0 +1,138 @@
+"""
+Snapshot file layout (little-endian):
+    magic (8 bytes) | version (uint32) | header length (uint32) | JSON header | array sections
+The JSON header holds free-form metadata plus an index of the array sections, each given by
+dtype, shape and byte offset from the start of the sections. The first section starts at the
+first multiple of `ALIGNMENT` after the header and every section is aligned likewise, so that
+they can be memory-mapped in place.
+"""
+import json
+import os
+import secrets
+import struct
+from collections.abc import Sequence
+from typing import Dict, Tuple
+
+import numpy as np
+
+MAGIC = b'EPSNAP\x00\x00'
+VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct('<8sII')
+
+
+def write_snapshot(path, arrays: Dict[str, np.ndarray], metadata: Dict = None):
+    """
+    Writes the arrays and metadata to a temporary file next to `path`, then renames it over
+    `path`: the arrays may be memory-mapped from the snapshot being replaced (e.g. a model
+    resumed and saved in place), which truncating `path` would pull from under them, and
+    readers never see a partially written snapshot.
+    """
+    index, offset = {}, 0
+    for name, array in arrays.items():
+        index[name] = dict(dtype=array.dtype.str, shape=list(array.shape), offset=offset)
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(dict(metadata=metadata or {}, arrays=index)).encode()
+    data_start = _align(_PREAMBLE.size + len(header))
+    temporary_path = f'{os.fspath(path)}.{secrets.token_hex(4)}.tmp'
+    try:
+        with open(temporary_path, 'xb') as f:
+            f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + index[name]['offset'])
+                np.ascontiguousarray(array).tofile(f)
+            f.truncate(max(data_start + offset, f.tell()))
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def read_snapshot(path, mmap=True, mode='r') -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Returns the arrays and metadata of a snapshot. With `mmap` the arrays are `np.memmap`s
+    opened with `mode` ('r' read-only, 'c' copy-on-write, 'r+' writing through to the file),
+    so opening costs O(1) regardless of the snapshot size.
+    """
+    with open(path, 'rb') as f:
+        magic, version, header_length = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an EP snapshot')
+        if version > VERSION:
+            raise ValueError(f'{path} has snapshot version {version}, newer than the supported '
+                             f'version {VERSION}')
+        header = json.loads(f.read(header_length))
+        data_start = _align(_PREAMBLE.size + header_length)
+        arrays = {}
+        for name, section in header['arrays'].items():
+            dtype, shape = np.dtype(section['dtype']), tuple(section['shape'])
+            offset = data_start + section['offset']
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(path, dtype=dtype, mode=mode, offset=offset,
+                                         shape=shape)
+            else:
+                f.seek(offset)
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))) \
+                    .reshape(shape)
+    return arrays, header['metadata']
+
+
+def encode_names(names) -> Dict[str, np.ndarray]:
+    """
+    Names as array sections: integer ids as a single int64 array, anything else as the offsets
+    into a blob of UTF-8 encoded strings.
+    """
+    if all(isinstance(name, (int, np.integer)) for name in names):
+        return dict(name_ids=np.asarray(names, dtype=np.int64))
+    encoded = [str(name).encode() for name in names]
+    offsets = np.zeros((len(encoded) + 1,), dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+    return dict(name_offsets=offsets, name_blob=np.frombuffer(b''.join(encoded), dtype=np.uint8))
+
+
+def decode_names(arrays: Dict[str, np.ndarray]):
+    if 'name_ids' in arrays:
+        return arrays['name_ids']
+    return SnapshotNames(arrays['name_offsets'], arrays['name_blob'])
+
+
+class SnapshotNames(Sequence):
+    """
+    Read-only list of player names decoded on access from a (memory-mapped) UTF-8 blob.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+        return self.blob[self.offsets[item]:self.offsets[item + 1]].tobytes().decode()
+
+    def index(self, name: str, *args) -> int:
+        """
+        Position of `name`, searched in the encoded blob rather than by decoding every name.
+        """
+        encoded, blob = name.encode(), self.blob.tobytes()
+        position = blob.find(encoded)
+        while position >= 0:
+            item = int(np.searchsorted(self.offsets, position))
+            if item < len(self) and self.offsets[item] == position and \
+                    self.offsets[item + 1] == position + len(encoded):
+                return item
+            position = blob.find(encoded, position + 1)
+        raise ValueError(f'{name!r} is not a player name')
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
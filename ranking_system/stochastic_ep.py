@@ -0,0 +1,182 @@
+import time
+from typing import List
+
+import numpy as np
+
+from .matrix_stats import PlayerStats, WinLossHistory, GameStatsFactory, DtypePolicy
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixWorkspace, \
+    MessageSanitiser
+from .profiling import NULL_PROFILER
+from .ranking import MarginalSkillQueries
+from .utils import ConvergenceReport, marginal_residual
+
+# Roles of the tied sites, in the order of the downwards players messages game_stats[:, 5:7]
+LOSS, WIN = 0, 1
+
+
+class StochasticEPLoop(MarginalSkillQueries):
+    """
+    Stochastic EP (averaged-site EP): instead of one downwards message per game, every player
+    keeps one tied site per role, the average message of the games they won and the one of the
+    games they lost, so that their marginal is
+        prior * win_site ** num_wins * loss_site ** num_losses
+    and the messages take O(N) memory whatever the number of games. Games are processed in
+    shuffled minibatches of `batch_size`: the cavity of a game removes the player's site once,
+    the game's messages are updated with `MatrixMessageUpdates` as in `MatrixEPLoop`, and each
+    site moves towards the new messages of its games by `step_size / num_games` per game, in
+    natural parameters. A `step_size` of 1 replaces the site by the new average whenever all
+    of its games are in one minibatch; smaller steps average out the noise of small batches.
+
+    The messages of a minibatch live in a reused `GameStats` buffer, so besides the win/loss
+    history (which can be memory-mapped, see `MatrixEPLoop.load`) memory is O(N + batch_size).
+    The result approximates full EP: each site averages its player's messages. Minibatches are
+    blocks of `batch_size` consecutive games visited in a shuffled order, so that no O(K)
+    permutation is held either: games stored in a meaningful order (e.g. by date or player)
+    should be shuffled once beforehand. `dtype_policy`, `sanitise` and `noise` are as in
+    `MatrixEPLoop`, sites being kept in the accumulator dtype.
+    """
+
+    def __init__(self,
+                 players: PlayerStats,
+                 history: WinLossHistory,
+                 player_names: List = None,
+                 batch_size: int = 2 ** 16,
+                 step_size: float = 0.5,
+                 draw_margin: float = 0.,
+                 dtype_policy=None,
+                 sanitise: str = 'skip',
+                 seed: int = 0,
+                 noise: float = 1.):
+        self.dtype_policy = DtypePolicy.resolve(dtype_policy, players.dtype)
+        self.player_stats = players.astype(self.dtype_policy.accumulator)
+        self.history = history
+        self.player_names = player_names
+        self.batch_size = min(batch_size, max(history.K, 1))
+        self.step_size = step_size
+        self.draw_margin = draw_margin
+        self.noise = noise
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
+        self.rng = np.random.default_rng(seed)
+        self.rankings = {}
+        # Tied sites (natural mean, precision) per player and role, and the games they average
+        self.sites = np.zeros((history.N, 2, 2), dtype=self.dtype_policy.accumulator)
+        self.num_games = np.stack([history.sum_over_losses(None), history.sum_over_wins(None)],
+                                  axis=1)
+        self.steps = np.divide(step_size, self.num_games, where=self.num_games > 0,
+                               out=np.zeros(self.num_games.shape))
+        self.game_stats = GameStatsFactory.allocate(self.batch_size, self.dtype_policy.storage)
+        self.workspace = MatrixWorkspace.create(self.batch_size, self.dtype_policy)
+
+    def run(self, num_iterations, logging=True, tol=None,
+            profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        Runs up to `num_iterations` passes (epochs) over the games in shuffled minibatches,
+        stopping early once the marginal skills move less than `tol` over a pass. `profiler`
+        is as in `MatrixEPLoop.run`, a pass being recorded as a sweep.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.num_sanitised
+        t0 = time.time()
+        self.update_marginals()
+        for tau in range(num_iterations):
+            profiler.start_sweep()
+            t_sweep = time.time()
+            previous_marginals = self.player_stats[:, 0, :].copy()
+            for start in self._batch_starts():
+                self.update_batch(self._batch_games(start), profiler)
+            with profiler.stage('update_marginal'):
+                self.update_marginals()
+            residual = marginal_residual(previous_marginals[:, 0], previous_marginals[:, 1],
+                                         self.player_stats[:, 0, 0], self.player_stats[:, 0, 1])
+            report.record(residual, time.time() - t_sweep)
+            profiler.end_sweep(residual)
+            if logging and (tau + 1) % max(num_iterations // 2, 1) == 0:
+                print(f'#### SEP pass #{tau + 1} completed #### time elapsed {time.time()-t0}')
+            if report.converged:
+                break
+        report.num_sanitised = self.num_sanitised - num_sanitised
+        self.invalidate_rankings()
+        return report
+
+    def update_batch(self, games_idx: slice, profiler=NULL_PROFILER):
+        """
+        One stochastic EP step over the games `games_idx`: their messages are recomputed from
+        the current marginals and tied sites, then every site involved moves towards the
+        average of its new messages.
+        """
+        winner_ids = self.history.winner_ids[games_idx]
+        losser_ids = self.history.losser_ids[games_idx]
+        draws = self.history.draws[games_idx] if self.history.draws is not None else None
+        counts = self.history.counts[games_idx] if self.history.counts is not None else None
+        games = self.game_stats[:len(winner_ids)]
+        with profiler.stage('insert_sites_into_games'):
+            for message, player_ids in ((7, winner_ids), (8, losser_ids)):
+                games[:, message, 0] = self.player_stats[:, 0, 0][player_ids]
+                games[:, message, 1] = self.player_stats[:, 0, 1][player_ids]
+            sites = {}
+            for message, role, player_ids in ((5, LOSS, losser_ids), (6, WIN, winner_ids)):
+                sites[role] = self.sites[player_ids, role, :]
+                games[:, message, 1] = sites[role][:, 1]
+                games[:, message, 0] = np.divide(sites[role][:, 0], sites[role][:, 1],
+                                                 where=sites[role][:, 1] > 0.,
+                                                 out=np.zeros(len(player_ids)))
+        games = MatrixMessageUpdates().update_game_messages(
+            games, self.workspace, self.draw_margin, draws, self.sanitiser, profiler,
+            self.noise)
+        with profiler.stage('update_sites'):
+            for message, role, player_ids in ((5, LOSS, losser_ids), (6, WIN, winner_ids)):
+                steps = self.steps[player_ids, role]
+                precision = games[:, message, 1].astype(np.float64)
+                natural_mean = precision * games[:, message, 0]
+                for parameter, new in ((0, natural_mean), (1, precision)):
+                    change = np.subtract(new, sites[role][:, parameter], out=new)
+                    if counts is not None:
+                        change *= counts
+                    # a site moves by step_size / num_games, the sum of its num_games copies in
+                    # the player's messages by step_size
+                    np.add.at(self.player_stats[:, 2, parameter], player_ids,
+                              self.step_size * change)
+                    np.add.at(self.sites[:, role, parameter], player_ids, steps * change)
+        with profiler.stage('update_marginal'):
+            self._update_marginals(np.concatenate([winner_ids, losser_ids]))
+
+    def update_marginals(self) -> PlayerStats:
+        """
+        Sums of game messages implied by the tied sites, and the marginals.
+        """
+        self.player_stats[:, 2, :] = np.einsum('nr,nrp->np', self.num_games, self.sites)
+        self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+        return self.player_stats
+
+    @property
+    def num_sanitised(self) -> int:
+        """
+        Invalid messages handled by the sanitiser since the loop was created.
+        """
+        return self.sanitiser.num_sanitised if self.sanitiser is not None else 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of the EP state: player stats, tied sites and the minibatch buffers.
+        """
+        return self.player_stats.nbytes + self.sites.nbytes + self.num_games.nbytes + \
+            self.steps.nbytes + self.game_stats.base.nbytes + self.workspace.buffers.nbytes + \
+            self.workspace.wide.nbytes
+
+    def _update_marginals(self, players_idx: np.ndarray):
+        """
+        `MatrixSkillUpdates.update_marginal` restricted to the players of a minibatch.
+        """
+        prior_precision = self.player_stats[:, 1, 1][players_idx]
+        precision = prior_precision + self.player_stats[:, 2, 1][players_idx]
+        natural_mean = prior_precision * self.player_stats[:, 1, 0][players_idx] + \
+            self.player_stats[:, 2, 0][players_idx]
+        self.player_stats[players_idx, 0, 1] = precision
+        self.player_stats[players_idx, 0, 0] = natural_mean / precision
+
+    def _batch_starts(self) -> np.ndarray:
+        return self.rng.permutation(np.arange(0, self.history.K, self.batch_size))
+
+    def _batch_games(self, start: int) -> slice:
+        return slice(start, min(start + self.batch_size, self.history.K))
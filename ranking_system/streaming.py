@@ -0,0 +1,237 @@
+"""
+Streaming ranking by assumed density filtering (ADF): games are consumed once, in arrival
+order, and each one updates the marginal skills of its two players straight away, so an
+estimate is available after every game rather than after a batch of EP sweeps. The update of a
+game is the moment matching of `MarginalPerformance._moment_matching_update`, run through the
+vectorised `MatrixMessageUpdates` from the current marginals (the cavity of a game seen for the
+first time is the marginal itself), then multiplied into both marginals: O(1) per game.
+"""
+import itertools
+import math
+from typing import Iterable, Dict, List
+
+import numpy as np
+
+from .matrix_ep import MatrixEPLoop
+from .matrix_stats import PlayerStats, WinLossHistory, GameStatsFactory, DtypePolicy, \
+    check_player_ids
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixWorkspace, \
+    MessageSanitiser
+from .ranking import MarginalSkillQueries
+from .utils import psi_lambda
+
+
+def disjoint_rounds(winner_ids: np.ndarray, losser_ids: np.ndarray) -> np.ndarray:
+    """
+    Round of each game such that the games of a round involve distinct players and every
+    player's games are in increasing rounds in arrival order: updating the rounds one after
+    the other, each as a batch, gives the same marginals as updating the games one by one.
+    """
+    last_round = {}
+    previous_round = last_round.get
+    rounds = []
+    for winner, losser in zip(winner_ids.tolist(), losser_ids.tolist()):
+        # plain comparisons: a max() call per game is a large part of the cost of this loop
+        game_round = previous_round(winner, -1)
+        losser_round = previous_round(losser, -1)
+        if losser_round > game_round:
+            game_round = losser_round
+        game_round += 1
+        last_round[winner] = last_round[losser] = game_round
+        rounds.append(game_round)
+    return np.asarray(rounds, dtype=np.int64)
+
+
+class StreamingRanker(MarginalSkillQueries):
+    """
+    ADF ranker over a stream of games. `update` takes a single game, `update_games` arrays of
+    games in arrival order (vectorised over `disjoint_rounds`) and `consume` any iterable of
+    `(winner, losser)` or `(winner, losser, draw)` tuples of 0-based player indices (e.g. a CSV
+    reader or a change stream), in micro-batches of `batch_size`. Marginals are kept in the
+    accumulator dtype of `dtype_policy`; `draw_margin`, `sanitise` and `noise` are as in
+    `MatrixEPLoop`.
+
+    With `record_messages`, the message of every game to its players is kept (O(K) memory) so
+    that `to_matrix_ep` can hand the filtered state to `MatrixEPLoop` as a warm start: ADF is
+    the first EP sweep, refined by the following ones.
+    """
+
+    def __init__(self,
+                 players: PlayerStats,
+                 player_names: List = None,
+                 batch_size: int = 2 ** 12,
+                 draw_margin: float = 0.,
+                 dtype_policy=None,
+                 sanitise: str = 'skip',
+                 record_messages: bool = False,
+                 noise: float = 1.):
+        self.dtype_policy = DtypePolicy.resolve(dtype_policy, players.dtype)
+        self.player_stats = MatrixSkillUpdates.update_marginal(
+            players.astype(self.dtype_policy.accumulator))
+        self.player_names = player_names
+        self.batch_size = batch_size
+        self.draw_margin = draw_margin
+        self.noise = noise
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
+        self.rankings = {}
+        self.num_games = 0
+        self.game_stats = GameStatsFactory.allocate(batch_size, self.dtype_policy.storage)
+        self.workspace = MatrixWorkspace.create(batch_size, self.dtype_policy)
+        self.record_messages = record_messages
+        self.recorded = []
+
+    def update(self, winner: int, losser: int, draw: bool = False):
+        """
+        Filters a single game. Decisive games with a zero draw margin take a scalar path, the
+        `MatrixMessageUpdates` steps written out for one game; any other game, or one whose
+        messages would be invalid, goes through `update_games`. Player ids are checked as in
+        `WinLossHistory`.
+        """
+        N = len(self.player_stats)
+        if not (0 <= winner < N and 0 <= losser < N):
+            check_player_ids(N, winner=np.array([winner]), losser=np.array([losser]))
+        if draw or self.draw_margin or not self._update_single(winner, losser):
+            self.update_games(np.array([winner]), np.array([losser]),
+                              np.array([draw]) if draw else None)
+
+    def update_games(self, winner_ids: np.ndarray, losser_ids: np.ndarray,
+                     draws: np.ndarray = None):
+        """
+        Filters games in arrival order, each round of `disjoint_rounds` in one vectorised
+        update of at most `batch_size` games.
+        """
+        if not len(winner_ids):
+            return
+        check_player_ids(len(self.player_stats), winner=winner_ids, losser=losser_ids)
+        rounds = disjoint_rounds(winner_ids, losser_ids)
+        num_recorded = len(self.recorded)
+        order = np.argsort(rounds, kind='stable')
+        bounds = np.flatnonzero(np.diff(rounds[order], prepend=-1, append=-1))
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            for batch_start in range(start, stop, self.batch_size):
+                games_idx = order[batch_start:min(batch_start + self.batch_size, stop)]
+                self._update_round(winner_ids[games_idx], losser_ids[games_idx],
+                                   draws[games_idx] if draws is not None else None)
+        if self.record_messages:
+            self.recorded[num_recorded:] = [self._in_arrival_order(self.recorded[num_recorded:],
+                                                                   order)]
+        self.num_games += len(winner_ids)
+        self.invalidate_rankings()
+
+    def consume(self, games: Iterable, batch_size: int = None) -> int:
+        """
+        Filters every game of the iterable, `batch_size` (default: the ranker's) at a time.
+        Returns the number of games consumed.
+        """
+        batch_size = batch_size or self.batch_size
+        games = iter(games)
+        num_games = 0
+        while True:
+            chunk = np.array(list(itertools.islice(games, batch_size)), dtype=np.int64)
+            if not len(chunk):
+                return num_games
+            self.update_games(chunk[:, 0], chunk[:, 1],
+                              chunk[:, 2] != 0 if chunk.shape[1] > 2 else None)
+            num_games += len(chunk)
+
+    def consume_records(self, records: Iterable[Dict], batch_size: int = None) -> int:
+        """
+        `consume` over `{'winner': ..., 'losser': ...}` records with 1-based player ids, as in
+        `WinLossHistory.create_from_records`.
+        """
+        return self.consume(((record['winner'] - 1, record['losser'] - 1,
+                              record.get('draw', False)) for record in records), batch_size)
+
+    def to_matrix_ep(self) -> MatrixEPLoop:
+        """
+        `MatrixEPLoop` over the games filtered so far, in arrival order, its game messages set
+        to the ones recorded by ADF so that its first sweep starts from the filtered marginals.
+        """
+        if not self.record_messages:
+            raise ValueError('Warm starting EP needs a ranker created with record_messages')
+        winner_ids, losser_ids, draws, messages = (
+            np.concatenate([batch[field] for batch in self.recorded]) for field in range(4))
+        game_stats = GameStatsFactory.allocate(len(winner_ids), self.dtype_policy.storage)
+        game_stats[:, 5:7, :] = messages
+        history = WinLossHistory(winner_ids, losser_ids, len(self.player_stats),
+                                 draws if draws.any() else None)
+        return MatrixEPLoop(self.player_stats.astype(self.dtype_policy.storage), game_stats,
+                            history, self.player_names, draw_margin=self.draw_margin,
+                            dtype_policy=self.dtype_policy,
+                            sanitise=self.sanitiser.mode if self.sanitiser is not None else None,
+                            noise=self.noise)
+
+    def _update_single(self, winner: int, losser: int) -> bool:
+        """
+        ADF update of one decisive game in float64 scalars, False (and nothing updated) if a
+        message is invalid.
+        """
+        winner_mean, winner_precision = self.player_stats[winner, 0, :].tolist()
+        losser_mean, losser_precision = self.player_stats[losser, 0, :].tolist()
+        # Upwards game message and moment matching of the performance
+        game_mean = winner_mean - losser_mean
+        game_var = self.noise + 1. / winner_precision + 1. / losser_precision
+        psi, lambda_ = psi_lambda(game_mean / math.sqrt(game_var))
+        performance_precision = 1. / (game_var * (1. - lambda_))
+        # Downwards game message
+        downwards_precision = performance_precision - 1. / game_var
+        if not (downwards_precision > 0.):
+            return False
+        downwards_mean = (performance_precision * (game_mean + math.sqrt(game_var) * psi) -
+                          game_mean / game_var) / downwards_precision
+        if not math.isfinite(downwards_mean):
+            return False
+        messages = np.empty((1, 2, 2))
+        for message, player, mean in ((0, losser, winner_mean - downwards_mean),
+                                      (1, winner, losser_mean + downwards_mean)):
+            other_precision = winner_precision if message == 0 else losser_precision
+            precision = 1. / (self.noise + 1. / other_precision + 1. / downwards_precision)
+            messages[0, message] = mean, precision
+            stats = self.player_stats[player]
+            stats[2, 1] += precision
+            stats[2, 0] += precision * mean
+            stats[0, 1] = stats[1, 1] + stats[2, 1]
+            stats[0, 0] = (stats[1, 1] * stats[1, 0] + stats[2, 0]) / stats[0, 1]
+        if self.record_messages:
+            self.recorded.append((np.array([winner]), np.array([losser]), np.zeros(1, bool),
+                                  messages.astype(self.dtype_policy.storage)))
+        self.num_games += 1
+        self.invalidate_rankings()
+        return True
+
+    def _update_round(self, winner_ids: np.ndarray, losser_ids: np.ndarray,
+                      draws: np.ndarray = None):
+        """
+        ADF update of games between distinct players.
+        """
+        games = self.game_stats[:len(winner_ids)]
+        games[:, 5:7, :] = 0.
+        for message, player_ids in ((7, winner_ids), (8, losser_ids)):
+            games[:, message, :] = self.player_stats[player_ids, 0, :]
+        games = MatrixMessageUpdates().update_game_messages(
+            games, self.workspace, self.draw_margin, draws, self.sanitiser, noise=self.noise)
+        for message, player_ids in ((5, losser_ids), (6, winner_ids)):
+            precision = games[:, message, 1].astype(np.float64)
+            self.player_stats[player_ids, 2, 1] += precision
+            self.player_stats[player_ids, 2, 0] += precision * games[:, message, 0]
+            prior_precision = self.player_stats[player_ids, 1, 1]
+            marginal_precision = prior_precision + self.player_stats[player_ids, 2, 1]
+            self.player_stats[player_ids, 0, 0] = (
+                prior_precision * self.player_stats[player_ids, 1, 0] +
+                self.player_stats[player_ids, 2, 0]) / marginal_precision
+            self.player_stats[player_ids, 0, 1] = marginal_precision
+        if self.record_messages:
+            self.recorded.append((winner_ids, losser_ids,
+                                  draws if draws is not None else np.zeros(len(games), bool),
+                                  games[:, 5:7, :].copy()))
+
+    @staticmethod
+    def _in_arrival_order(batches: List, order: np.ndarray) -> tuple:
+        """
+        Merges the recorded rounds of one `update_games` call back into a single batch in
+        arrival order (`order` sorting the games by round).
+        """
+        arrival = np.empty_like(order)
+        arrival[order] = np.arange(len(order))
+        return tuple(np.concatenate([batch[field] for batch in batches])[arrival]
+                     for field in range(4))
@@ -0,0 +1,116 @@
+import time
+from typing import List, TYPE_CHECKING
+
+import numpy as np
+
+from .matrix_stats import PlayerStats, GameStatsFactory, TeamGameHistory, DtypePolicy
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixTeamUpdates, \
+    MatrixWorkspace, MessageSanitiser
+from .profiling import NULL_PROFILER
+from .ranking import MarginalSkillQueries
+from .utils import ConvergenceReport, marginal_residual
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class TeamEPLoop(MarginalSkillQueries):
+    """
+    EP loop over games between teams of any size with ranked outcomes and draws (see
+    `TeamGameHistory`). A sweep sends the players' cavity skills up the team-sum factors, runs
+    the comparisons of adjacent teams as a batch of two-player games between teams (with a
+    draw margin for the tied ones), and sends the result back down to the players. On games of
+    two one-player teams it is the same schedule as `MatrixEPLoop.run`.
+
+    All the comparisons of a game are updated at once, which oscillates slowly once teams of
+    several players meet more than one other team; `damping` of the messages from the sum
+    factors to the players (fraction of the previous message kept) damps it out.
+    `dtype_policy`, `sanitise` and `noise` (the variance of a team's performance around the sum
+    of its members' skills) are as in `MatrixEPLoop`.
+    """
+
+    def __init__(self,
+                 players: PlayerStats,
+                 history: TeamGameHistory,
+                 player_names: List,
+                 draw_margin: float = 0.,
+                 damping: float = 0.3,
+                 dtype_policy=None,
+                 sanitise: str = 'skip',
+                 noise: float = 1.):
+        self.dtype_policy = DtypePolicy.resolve(dtype_policy, players.dtype)
+        players = players.astype(self.dtype_policy.storage, copy=False)
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
+        self.player_stats = players
+        self.history = history
+        self.player_names = player_names
+        self.draw_margin = draw_margin
+        self.noise = noise
+        self.damping = damping
+        self.rankings = {}
+        self.comparisons = history.comparisons()
+        self.team_stats = np.zeros((history.num_teams, 3, 2), dtype=players.dtype)
+        self.comparison_stats = GameStatsFactory.allocate(self.comparisons.K, players.dtype)
+        self.member_messages = np.zeros((len(history.member_ids), 2), dtype=np.float64)
+        self.workspace = MatrixWorkspace.create(self.comparisons.K, self.dtype_policy)
+
+    @staticmethod
+    def create_from_dataframe(df: 'pd.DataFrame', players: PlayerStats, player_names: List,
+                              draw_margin: float = 0., damping: float = 0.3) -> 'TeamEPLoop':
+        history = TeamGameHistory.create_from_dataframe(df, len(players))
+        return TeamEPLoop(players, history, player_names, draw_margin, damping)
+
+    def run(self, num_iterations, logging=True, tol=None,
+            profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        Runs up to `num_iterations` EP sweeps, stopping early once the marginal skills move less
+        than `tol`. `profiler` is as in `MatrixEPLoop.run`.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.sanitiser.num_sanitised if self.sanitiser is not None else 0
+        t0 = time.time()
+        self.player_stats = MatrixTeamUpdates.compute_member_messages(
+            self.player_stats, self.member_messages, self.history)
+        self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
+        for tau in range(num_iterations):
+            profiler.start_sweep()
+            t_sweep = time.time()
+            previous_marginals = self.player_stats[:, 0, :].copy()
+            self.sweep(profiler)
+            residual = marginal_residual(previous_marginals[:, 0], previous_marginals[:, 1],
+                                         self.player_stats[:, 0, 0], self.player_stats[:, 0, 1])
+            report.record(residual, time.time() - t_sweep)
+            profiler.end_sweep(residual)
+            if logging and (tau + 1) % max(num_iterations // 2, 1) == 0:
+                print(f'#### EP iteration #{tau + 1} completed #### time elapsed {time.time()-t0}')
+            if report.converged:
+                break
+        if self.sanitiser is not None:
+            report.num_sanitised = self.sanitiser.num_sanitised - num_sanitised
+        self.invalidate_rankings()
+        return report
+
+    def sweep(self, profiler=NULL_PROFILER):
+        with profiler.stage('update_team_priors'):
+            cavity_means, cavity_vars = MatrixTeamUpdates.update_team_priors(
+                self.team_stats, self.player_stats, self.member_messages, self.history,
+                self.sanitiser)
+            self.team_stats = MatrixSkillUpdates.update_marginal(self.team_stats)
+        with profiler.stage('insert_marginal_into_games'):
+            self.comparison_stats = MatrixSkillUpdates.insert_marginal_into_games(
+                self.comparison_stats, self.team_stats, self.comparisons)
+        self.comparison_stats = MatrixMessageUpdates().update_game_messages(
+            self.comparison_stats, self.workspace, self.draw_margin, self.comparisons.draws,
+            self.sanitiser, profiler, self.noise)
+        with profiler.stage('compute_message_games'):
+            self.team_stats = MatrixSkillUpdates.compute_message_games(
+                self.comparison_stats, self.team_stats, self.comparisons, self.workspace)
+        with profiler.stage('update_member_messages'):
+            self.member_messages = MatrixTeamUpdates.update_member_messages(
+                self.team_stats, self.member_messages, cavity_means, cavity_vars, self.history,
+                self.damping)
+        with profiler.stage('compute_member_messages'):
+            self.player_stats = MatrixTeamUpdates.compute_member_messages(
+                self.player_stats, self.member_messages, self.history)
+        with profiler.stage('update_marginal'):
+            self.player_stats = MatrixSkillUpdates.update_marginal(self.player_stats)
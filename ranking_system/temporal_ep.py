@@ -0,0 +1,241 @@
+import time
+from typing import List, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from .matrix_stats import WinLossHistory, GameStatsFactory, DtypePolicy
+from .matrix_updates import MatrixMessageUpdates, MatrixSkillUpdates, MatrixWorkspace, \
+    MessageSanitiser
+from .profiling import NULL_PROFILER
+from .ranking import Ranking
+from .utils import ConvergenceReport, marginal_residual
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class TemporalEPLoop:
+    """
+    EP over skills drifting in time (TrueSkill Through Time). Games carry a period (any numeric
+    time) and each player has one skill variable per period in which they play, a node, chained
+    to the player's previous node by the drift factor
+        skill_t ~ N(skill_t', drift * (t - t')),
+    the first node of a player taking the prior N(prior_mean, prior_variance). Only active
+    player-periods are materialised, so memory is O(nodes + games) rather than
+    O(players x periods).
+
+    Games are sorted by period and nodes by (period, player) so that every time slice is a
+    contiguous block of both. `node_stats` follows the `PlayerStats` layout per node, its prior
+    row being the product of the forward (from the previous node) and backward (from the next
+    node) drift messages. A sweep runs a forward then a backward pass over the slices: each
+    slice is updated as a batch with `MatrixMessageUpdates`/`MatrixSkillUpdates` and sends the
+    drift messages on to the neighbouring nodes. `dtype_policy`, `sanitise` and `noise` are as
+    in `MatrixEPLoop`.
+    """
+
+    def __init__(self,
+                 history: WinLossHistory,
+                 periods: np.ndarray,
+                 drift: float = 0.01,
+                 player_names: List = None,
+                 dtype_policy='mixed',
+                 draw_margin: float = 0.,
+                 sanitise: str = 'skip',
+                 noise: float = 1.,
+                 prior_mean: float = 0.,
+                 prior_variance: float = 1.):
+        N, K = history.N, history.K
+        self.N = N
+        self.drift = drift
+        self.draw_margin = draw_margin
+        self.noise = noise
+        self.prior = prior_mean, prior_variance
+        self.dtype_policy = DtypePolicy.resolve(dtype_policy)
+        self.sanitiser = MessageSanitiser(sanitise) if sanitise is not None else None
+        dtype = self.dtype_policy.storage
+        self.player_names = player_names
+        self.rankings = {}
+        order = np.argsort(periods, kind='stable')
+        self.slice_periods, game_slice = np.unique(np.asarray(periods)[order],
+                                                   return_inverse=True)
+        T = len(self.slice_periods)
+        self.history = history.subset(order)
+        self.game_order = order
+        self.game_stats = GameStatsFactory.allocate(K, dtype)
+        self.game_bounds = np.searchsorted(game_slice, np.arange(T + 1))
+
+        # Nodes: active (slice, player) pairs, sorted by slice then player
+        node_keys, inverse = np.unique(
+            np.concatenate([game_slice * N + self.history.winner_ids,
+                            game_slice * N + self.history.losser_ids]), return_inverse=True)
+        self.node_slice, self.node_player = node_keys // N, node_keys % N
+        self.node_bounds = np.searchsorted(self.node_slice, np.arange(T + 1))
+        winner_nodes, losser_nodes = inverse[:K], inverse[K:]
+        draws, counts = self.history.draws, self.history.counts
+        self.slices = [
+            (WinLossHistory(winner_nodes[gs:ge] - ns, losser_nodes[gs:ge] - ns, ne - ns,
+                            draws[gs:ge] if draws is not None else None,
+                            counts[gs:ge] if counts is not None else None),
+             MatrixWorkspace.create(ge - gs, self.dtype_policy))
+            for gs, ge, ns, ne in zip(self.game_bounds[:-1], self.game_bounds[1:],
+                                      self.node_bounds[:-1], self.node_bounds[1:])
+        ]
+
+        # Chains: previous/next node of the same player (-1 at the ends)
+        P = len(node_keys)
+        self.by_player = np.lexsort((self.node_slice, self.node_player))
+        same_player = self.node_player[self.by_player[1:]] == self.node_player[self.by_player[:-1]]
+        self.previous_node = np.full((P,), -1, dtype=np.int64)
+        self.next_node = np.full((P,), -1, dtype=np.int64)
+        self.previous_node[self.by_player[1:][same_player]] = self.by_player[:-1][same_player]
+        self.next_node[self.by_player[:-1][same_player]] = self.by_player[1:][same_player]
+        node_period = self.slice_periods[self.node_slice].astype(np.float64)
+        self.drift_to_next = np.where(self.next_node >= 0,
+                                      drift * (node_period[self.next_node] - node_period), 0.)
+        self.drift_to_previous = np.where(self.previous_node >= 0,
+                                          drift * (node_period - node_period[self.previous_node]),
+                                          0.)
+
+        self.node_stats = np.zeros((P, 3, 2), dtype=dtype)
+        # (mean, precision) of the drift messages into each node
+        self.forward = np.zeros((P, 2), dtype=np.float64)
+        self.backward = np.zeros((P, 2), dtype=np.float64)
+        # Prior into the first node of each player, set by the forward pass elsewhere
+        self.forward[:, 0] = prior_mean
+        self.forward[:, 1] = 1. / prior_variance
+        self._update_priors(0, P)
+        MatrixSkillUpdates.update_marginal(self.node_stats)
+
+    @staticmethod
+    def create_from_dataframe(game_df: 'pd.DataFrame', N: int, period_col='period',
+                              drift: float = 0.01, player_names: List = None,
+                              draw_margin: float = 0., dtype_policy='mixed'):
+        history = WinLossHistory.create_from_dataframe(game_df, N)
+        return TemporalEPLoop(history, game_df[period_col].to_numpy(), drift, player_names,
+                              dtype_policy=dtype_policy, draw_margin=draw_margin)
+
+    def run(self, num_iterations, logging=True, tol=None, inner_sweeps=1,
+            profiler=NULL_PROFILER) -> ConvergenceReport:
+        """
+        Runs up to `num_iterations` forward-backward sweeps, stopping early once the node
+        marginals move less than `tol`. Each slice runs `inner_sweeps` sweeps over its games per
+        pass. `profiler` gets one sweep per forward-backward sweep, its stages summed over the
+        slices.
+        """
+        report = ConvergenceReport(tol=tol)
+        num_sanitised = self.sanitiser.num_sanitised if self.sanitiser is not None else 0
+        t0 = time.time()
+        T = len(self.slice_periods)
+        for tau in range(num_iterations):
+            profiler.start_sweep()
+            t_sweep = time.time()
+            previous_marginals = self.node_stats[:, 0, :].copy()
+            for t in range(T):
+                self._update_slice(t, inner_sweeps, profiler)
+                with profiler.stage('send_drift_messages'):
+                    self._send_forward(t)
+            for t in reversed(range(T)):
+                self._update_slice(t, inner_sweeps, profiler)
+                with profiler.stage('send_drift_messages'):
+                    self._send_backward(t)
+            residual = marginal_residual(previous_marginals[:, 0], previous_marginals[:, 1],
+                                         self.node_stats[:, 0, 0], self.node_stats[:, 0, 1])
+            report.record(residual, time.time() - t_sweep)
+            profiler.end_sweep(residual)
+            if logging and (tau + 1) % max(num_iterations // 4, 1) == 0:
+                print(f'#### EP iteration #{tau + 1} completed #### time elapsed {time.time()-t0}')
+            if report.converged:
+                break
+        if self.sanitiser is not None:
+            report.num_sanitised = self.sanitiser.num_sanitised - num_sanitised
+        for ranking in self.rankings.values():
+            ranking.invalidate()
+        return report
+
+    def skills_at(self, period) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Marginal skills (means, precisions) of every player at `period`: the latest node of the
+        player up to `period`, or its first node if it only plays later, widened by the drift
+        in between. Players without games keep the prior.
+        """
+        T = len(self.slice_periods)
+        players = np.arange(self.N)
+        t = np.searchsorted(self.slice_periods, period, side='right') - 1
+        keys = self.node_player[self.by_player] * T + self.node_slice[self.by_player]
+        position = np.searchsorted(keys, players * T + t, side='right') - 1
+        earlier = (position >= 0) & (self.node_player[self.by_player[position.clip(0)]] ==
+                                     players)
+        # no earlier node: first node of the player, if any
+        position = np.where(earlier, position, position + 1).clip(max=len(keys) - 1)
+        nodes = self.by_player[position]
+        known = self.node_player[nodes] == players
+        elapsed = np.abs(period - self.slice_periods[self.node_slice[nodes]]).astype(np.float64)
+        prior_mean, prior_variance = self.prior
+        means = np.where(known, self.node_stats[nodes, 0, 0], prior_mean)
+        variances = np.where(known, 1. / self.node_stats[nodes, 0, 1] + self.drift * elapsed,
+                             prior_variance)
+        return means, 1. / variances
+
+    def trajectory(self, player: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Periods of the games of `player` with its marginal skill (means, precisions) at each.
+        """
+        nodes = self.by_player[self.node_player[self.by_player] == player]
+        return self.slice_periods[self.node_slice[nodes]], self.node_stats[nodes, 0, 0], \
+            self.node_stats[nodes, 0, 1]
+
+    def ranking(self, period=None, conservative: float = 0.) -> Ranking:
+        """
+        Cached ranking of the players by skill at `period` (default: the last period), see
+        `skills_at`, invalidated by `run`.
+        """
+        period = self.slice_periods[-1] if period is None else period
+        if (period, conservative) not in self.rankings:
+            self.rankings[period, conservative] = Ranking(lambda: self.skills_at(period),
+                                                          conservative)
+        return self.rankings[period, conservative]
+
+    def _update_slice(self, t: int, inner_sweeps: int, profiler=NULL_PROFILER):
+        history, workspace = self.slices[t]
+        ns, ne = self.node_bounds[t], self.node_bounds[t + 1]
+        gs, ge = self.game_bounds[t], self.game_bounds[t + 1]
+        nodes, games = self.node_stats[ns:ne], self.game_stats[gs:ge]
+        with profiler.stage('update_priors'):
+            self._update_priors(ns, ne)
+        with profiler.stage('update_marginal'):
+            MatrixSkillUpdates.update_marginal(nodes)
+        for _ in range(inner_sweeps):
+            with profiler.stage('insert_marginal_into_games'):
+                MatrixSkillUpdates.insert_marginal_into_games(games, nodes, history)
+            MatrixMessageUpdates().update_game_messages(games, workspace, self.draw_margin,
+                                                        history.draws, self.sanitiser, profiler,
+                                                        self.noise)
+            with profiler.stage('compute_message_games'):
+                MatrixSkillUpdates.compute_message_games(games, nodes, history, workspace)
+            with profiler.stage('update_marginal'):
+                MatrixSkillUpdates.update_marginal(nodes)
+
+    def _update_priors(self, ns: int, ne: int):
+        forward, backward = self.forward[ns:ne], self.backward[ns:ne]
+        precision = forward[:, 1] + backward[:, 1]
+        self.node_stats[ns:ne, 1, 1] = precision
+        self.node_stats[ns:ne, 1, 0] = (forward[:, 1] * forward[:, 0] +
+                                        backward[:, 1] * backward[:, 0]) / precision
+
+    def _send_forward(self, t: int):
+        self._send(t, self.forward, self.next_node, self.drift_to_next)
+
+    def _send_backward(self, t: int):
+        self._send(t, self.backward, self.previous_node, self.drift_to_previous)
+
+    def _send(self, t: int, messages: np.ndarray, targets: np.ndarray, drift: np.ndarray):
+        """
+        Drift message from each node of slice `t` to its `targets` node: the node's incoming
+        message of the same direction times its game messages, widened by the drift variance.
+        """
+        ns, ne = self.node_bounds[t], self.node_bounds[t + 1]
+        nodes = ns + np.flatnonzero(targets[ns:ne] >= 0)
+        precision = messages[nodes, 1] + self.node_stats[nodes, 2, 1]
+        natural_mean = messages[nodes, 1] * messages[nodes, 0] + self.node_stats[nodes, 2, 0]
+        messages[targets[nodes], 0] = natural_mean / precision
+        messages[targets[nodes], 1] = 1. / (1. / precision + drift[nodes])
@@ -1,11 +1,15 @@
-from dataclasses import dataclass
-from typing import TypeVar
+from dataclasses import dataclass, field
+from typing import List, Tuple, TypeVar
 
 import numpy as np
-import scipy.stats
 
 Parameter = TypeVar('Parameter', np.ndarray, float)
 
+_SQRT_2_OVER_PI = np.sqrt(2. / np.pi)
+_MINUS_INV_SQRT_2 = -1. / np.sqrt(2.)
+_INV_SQRT_2 = 1. / np.sqrt(2.)
+_INV_SQRT_2_PI = 1. / np.sqrt(2. * np.pi)
+
 
 @dataclass
 class GaussianDistribution:
@@ -38,10 +42,21 @@ class GaussianDistribution:
             self.precision = 1. / updated_var
         self.mean = updated_nat_mean / self.precision if updated_mean is None else updated_mean
 
+    def damp(self, previous: 'GaussianDistribution', damping: float):
+        """
+        Convex combination in natural parameters keeping a `damping` fraction of `previous`.
+        """
+        update_precision = (1. - damping) * self.precision + damping * previous.precision
+        update_natural_mean = (1. - damping) * self.natural_mean + damping * previous.natural_mean
+        self.update_mean_and_precision(updated_pre=update_precision,
+                                       updated_nat_mean=update_natural_mean)
+
     def pdf(self, x: np.ndarray) -> np.ndarray:
+        import scipy.stats
         return scipy.stats.norm.pdf(x, loc=self.mean, scale=self.std)
 
     def cdf(self, x: np.ndarray) -> np.ndarray:
+        import scipy.stats
         return scipy.stats.norm.cdf(x, loc=self.mean, scale=self.std)
 
 
@@ -51,11 +66,121 @@ class StandardGaussian(GaussianDistribution):
     precision: Parameter = 1.
 
     def psi(self, x: np.ndarray) -> np.ndarray:
-        return self.pdf(x) / self.cdf(x)
+        return psi_lambda(x)[0]
 
     def lambda_(self, x: np.ndarray) -> np.ndarray:
-        return self.psi(x) * (self.psi(x) + x)
+        return psi_lambda(x)[1]
+
+
+def psi_lambda(x: Parameter,
+               out: Tuple[np.ndarray, np.ndarray] = None) -> Tuple[Parameter, Parameter]:
+    """
+    Moments of a standard Gaussian truncated to (-x, inf), fused in a single pass:
+        psi(x) = pdf(x) / cdf(x)
+        lambda(x) = psi(x) * (psi(x) + x)
+    Uses cdf(x) / pdf(x) = sqrt(pi / 2) * erfcx(-x / sqrt(2)), which stays finite where
+    pdf and cdf underflow (x << 0, i.e. a big upset).
+
+    `out` optionally holds preallocated (psi, lambda) buffers, distinct from `x`, in which case
+    no temporaries are allocated and the computation runs in their dtype. Otherwise results are
+    computed in float64.
+    """
+    import scipy.special
+    scalar_input = np.ndim(x) == 0
+    if out is None:
+        x = np.asarray(x, dtype=np.result_type(x, np.float64))
+        out = (np.empty_like(x), np.empty_like(x))
+    psi, lambda_ = out
+    np.multiply(x, _MINUS_INV_SQRT_2, out=psi)
+    scipy.special.erfcx(psi, out=psi)
+    np.divide(_SQRT_2_OVER_PI, psi, out=psi)
+    np.add(psi, x, out=lambda_)
+    np.multiply(lambda_, psi, out=lambda_)
+    if scalar_input:
+        return psi[()], lambda_[()]
+    return psi, lambda_
+
+
+def psi_lambda_draw(a: Parameter, b: Parameter) -> Tuple[Parameter, Parameter]:
+    """
+    Moments of a standard Gaussian truncated to [a, b] (a < b), computed in float64:
+        psi(a, b) = (pdf(a) - pdf(b)) / Z
+        lambda(a, b) = psi(a, b) ** 2 + (b pdf(b) - a pdf(a)) / Z,  Z = cdf(b) - cdf(a)
+    so that the truncated Gaussian has mean psi and variance 1 - lambda. Intervals in a tail are
+    mirrored to the right one and rescaled by exp(a ** 2 / 2) through erfcx, so that Z and the
+    pdfs do not underflow.
+    """
+    import scipy.special
+    scalar_input = np.ndim(a) == 0 and np.ndim(b) == 0
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    mirrored = b < 0.
+    lo, hi = np.where(mirrored, -b, a), np.where(mirrored, -a, b)
+    tail = lo > 0.
+    # Tail intervals (0 < lo < hi), every term scaled by exp(lo ** 2 / 2)
+    ratio = np.exp(-0.5 * (hi - lo) * (hi + lo), where=tail, out=np.zeros_like(lo))
+    z = np.where(tail,
+                 0.5 * (scipy.special.erfcx(lo * _INV_SQRT_2) -
+                        scipy.special.erfcx(hi * _INV_SQRT_2) * ratio),
+                 scipy.special.ndtr(hi) - scipy.special.ndtr(lo))
+    pdf_lo = np.where(tail, _INV_SQRT_2_PI, _INV_SQRT_2_PI * np.exp(-0.5 * lo * lo))
+    pdf_hi = np.where(tail, _INV_SQRT_2_PI * ratio, _INV_SQRT_2_PI * np.exp(-0.5 * hi * hi))
+    psi = (pdf_lo - pdf_hi) / z
+    lambda_ = psi * psi + (hi * pdf_hi - lo * pdf_lo) / z
+    psi = np.where(mirrored, -psi, psi)
+    if scalar_input:
+        return psi[()], lambda_[()]
+    return psi, lambda_
+
+
+def log_normaliser_draw(a: Parameter, b: Parameter) -> Parameter:
+    """
+    log(cdf(b) - cdf(a)) (a < b), the log mass of a standard Gaussian on [a, b] normalising
+    `psi_lambda_draw`, computed in float64 with the same mirroring and erfcx rescaling of the
+    intervals in a tail.
+    """
+    import scipy.special
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    mirrored = b < 0.
+    lo, hi = np.where(mirrored, -b, a), np.where(mirrored, -a, b)
+    tail = lo > 0.
+    # Tail intervals (0 < lo < hi): Z * exp(lo ** 2 / 2)
+    ratio = np.exp(-0.5 * (hi - lo) * (hi + lo), where=tail, out=np.zeros_like(lo))
+    scaled = 0.5 * (scipy.special.erfcx(lo * _INV_SQRT_2) -
+                    scipy.special.erfcx(hi * _INV_SQRT_2) * ratio)
+    z = np.where(tail, scaled, scipy.special.ndtr(hi) - scipy.special.ndtr(lo))
+    return (np.log(z) - np.where(tail, 0.5 * lo * lo, 0.))[()]
 
 
+@dataclass
+class ConvergenceReport:
+    """
+    Trace of an EP run: the residual of a sweep is the max absolute change of the marginal skill
+    means and standard deviations it produced. `num_sanitised` counts the invalid messages
+    handled by the loop's `MessageSanitiser` during the run.
+    """
+    tol: float = None
+    residuals: List[float] = field(default_factory=list)
+    sweep_times: List[float] = field(default_factory=list)
+    num_sanitised: int = 0
+
+    def record(self, residual: float, sweep_time: float):
+        self.residuals.append(residual)
+        self.sweep_times.append(sweep_time)
 
+    @property
+    def iterations(self) -> int:
+        return len(self.residuals)
 
+    @property
+    def converged(self) -> bool:
+        return self.tol is not None and self.iterations > 0 and self.residuals[-1] < self.tol
+
+
+def marginal_residual(previous_mean: np.ndarray,
+                      previous_precision: np.ndarray,
+                      mean: np.ndarray,
+                      precision: np.ndarray) -> float:
+    mean_change = np.max(np.abs(mean - previous_mean), initial=0.)
+    std_change = np.max(np.abs(1. / np.sqrt(precision) - 1. / np.sqrt(previous_precision)),
+                        initial=0.)
+    return float(max(mean_change, std_change))
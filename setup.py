@@ -2,14 +2,22 @@ from setuptools import setup
 
 
 install_requirements = [
-    'numpy>=1.10.0',
-    'scipy>=0.18.0',
-    'pandas>=0.18.1',
+    # numpy.random.Generator, standard_normal(dtype=)
+    'numpy>=1.17.0',
+    'scipy>=1.5.0',
+    # Series.to_numpy(dtype=), read_csv(usecols=callable)
+    'pandas>=1.0.0',
     'matplotlib>=2.2.2',
 ]
 
 setup(
     name='Expectation-propagation',
     author='Sergio Pascual',
-    install_requires=install_requirements
-)
\ No newline at end of file
+    packages=['ranking_system'],
+    # multiprocessing.shared_memory
+    python_requires='>=3.8',
+    install_requires=install_requirements,
+    entry_points={
+        'console_scripts': ['ranking-ep=ranking_system.cli:main'],
+    },
+)
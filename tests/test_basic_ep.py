@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.common import synthetic_games
+from benchmarks.engines import object_ep_reference
+from ranking_system.basic_ep import BasicEPLoop
+from ranking_system.games_players import Player, PlayerList, Game, GameList
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def _league(N: int, K: int):
+    winner_ids, losser_ids = synthetic_games(N, K, seed=1)
+    players = PlayerList([Player(idx, f'player-{idx}') for idx in range(N)])
+    games = GameList([Game(int(w), int(l)) for w, l in zip(winner_ids, losser_ids)])
+    return winner_ids, losser_ids, players, games
+
+
+def test_array_backend_matches_object_loop():
+    N, K, num_iterations = 30, 300, 10
+    winner_ids, losser_ids, players, games = _league(N, K)
+    BasicEPLoop(players, games).run(num_iterations, logging=False)
+    means, precisions = object_ep_reference(winner_ids, losser_ids, N, num_iterations)
+    np.testing.assert_allclose(players.skills, means, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(players.precisions, precisions, rtol=1e-5)
+
+
+def test_object_views_share_the_arrays():
+    _, _, players, games = _league(10, 50)
+    BasicEPLoop(players, games).run(3, logging=False)
+    np.testing.assert_array_equal([player.marginal_skill.mean for player in players],
+                                  players.skills)
+    assert games[0].downwards_winner.precision == games.game_stats[0, 6, 1]
+
+
+def test_fits_the_bundled_csvs():
+    players = PlayerList.create_from_csv(os.path.join(DATA, 'players.csv'))
+    games = GameList.create_from_csv(os.path.join(DATA, 'games.csv'))
+    BasicEPLoop(players, games).run(5, logging=False)
+    assert np.all(np.isfinite(players.skills)) and np.all(players.precisions > 1.)
+    # built once, then reused by every sweep
+    assert games.history(len(players)) is games.history(len(players))
+
+
+def test_rejects_ids_out_of_the_players():
+    players = PlayerList([Player(idx, idx) for idx in range(3)])
+    with pytest.raises(ValueError, match=r'out of \[0, 3\)'):
+        BasicEPLoop(players, GameList([Game(0, 1), Game(3, 2)]))
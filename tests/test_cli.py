@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from ranking_system.cli import main
+from ranking_system.matrix_ep import MatrixEPLoop
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+CSVS = ['--players', os.path.join(DATA, 'players.csv'), '--games', os.path.join(DATA, 'games.csv')]
+
+
+def test_fit_rank_and_predict(tmp_path, capsys):
+    model = str(tmp_path / 'model.ep')
+    assert main(['fit', '--iterations', '20', '-o', model] + CSVS) == 0
+    assert main(['rank', model, '--top', '3']) == 0
+    assert capsys.readouterr().out.count('Position #') == 3
+    assert main(['predict', model, 'Rafael-Nadal', 'Juan-Monaco']) == 0
+    assert 'P(Rafael-Nadal beats Juan-Monaco)' in capsys.readouterr().out
+
+
+def test_fit_resumes_a_snapshot_in_place(tmp_path, capsys):
+    model = str(tmp_path / 'model.ep')
+    assert main(['fit', '--iterations', '2', '-o', model] + CSVS) == 0
+    before = MatrixEPLoop.load(model, mmap=False).player_stats.copy()
+    assert main(['fit', model, '--iterations', '5', '-o', model]) == 0
+    resumed = MatrixEPLoop.load(model)
+    assert not np.array_equal(resumed.player_stats, before)
+    assert main(['rank', model, '--top', '3']) == 0
+    assert os.listdir(tmp_path) == ['model.ep']
+
+
+def test_fit_applies_noise_and_draw_margin_to_a_snapshot_and_rejects_its_fixed_options(tmp_path):
+    model = str(tmp_path / 'model.ep')
+    assert main(['fit', '--iterations', '2', '--noise', '0.5', '-o', model] + CSVS) == 0
+    assert MatrixEPLoop.load(model).noise == 0.5
+    assert main(['fit', model, '--iterations', '2', '-o', model]) == 0
+    assert MatrixEPLoop.load(model).noise == 0.5
+    assert main(['fit', model, '--iterations', '2', '--noise', '2', '--draw-margin', '0.1',
+                 '-o', model]) == 0
+    resumed = MatrixEPLoop.load(model)
+    assert (resumed.noise, resumed.draw_margin) == (2., 0.1)
+    with pytest.raises(SystemExit, match='--prior-variance, --compress only apply to fitting'):
+        main(['fit', model, '--prior-variance', '2', '--compress', '-o', model])
+
+
+def _outside_a_checkout(path: str) -> bool:
+    return not os.path.isdir(os.path.join(path or '.', 'benchmarks'))
+
+
+def test_bench_outside_a_checkout_explains_where_to_run_it(monkeypatch):
+    # as if installed: the checkout is not on the path and the benchmarks were never imported
+    monkeypatch.setattr(sys, 'path', list(filter(_outside_a_checkout, sys.path)))
+    for module in [module for module in sys.modules if module.split('.')[0] == 'benchmarks']:
+        monkeypatch.delitem(sys.modules, module)
+    with pytest.raises(SystemExit, match='root of a checkout'):
+        main(['bench', 'layout'])
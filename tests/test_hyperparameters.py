@@ -0,0 +1,30 @@
+import numpy as np
+
+from ranking_system.hyperparameters import hyperparameter_search
+from ranking_system.matrix_stats import WinLossHistory
+from ranking_system.simulation import simulate_games
+
+NOISES = (0.0625, 0.125, 0.25, 0.5, 1.)
+
+
+def _league(N: int, K: int, noise: float, seed: int = 0) -> WinLossHistory:
+    """
+    Games between random pairs of players with known N(0, 1) skills and performance `noise`.
+    """
+    rng = np.random.default_rng(seed)
+    skills = rng.standard_normal(N)
+    pairs = rng.integers(0, N - 1, size=(K, 2))
+    pairs[:, 1] += pairs[:, 1] >= pairs[:, 0]
+    return WinLossHistory(*simulate_games(skills, np.full(N, np.inf), pairs, rng, noise), N)
+
+
+def test_search_recovers_the_noise_of_a_synthetic_league():
+    history = _league(100, 5000, noise=0.25)
+    results = hyperparameter_search(history, NOISES, num_iterations=300, num_workers=1)
+    assert all(result.converged for result in results)
+    assert results[0].noise == 0.25
+    # chains over a pool of workers fit the same candidates
+    pooled = hyperparameter_search(history, NOISES, num_iterations=300, num_workers=2)
+    assert [result.noise for result in pooled] == [result.noise for result in results]
+    np.testing.assert_allclose([result.log_evidence for result in pooled],
+                               [result.log_evidence for result in results], rtol=1e-6)
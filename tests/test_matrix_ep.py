@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.common import synthetic_games, repeated_pair_games
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory, \
+    DtypePolicy
+from ranking_system.parallel_ep import ShardedMatrixEPLoop
+
+
+def _fit(history: WinLossHistory, num_iterations: int = 50, player_names=None,
+         loop=MatrixEPLoop, **kwargs) -> MatrixEPLoop:
+    ep = loop(PlayerStatsFactory.allocate(history.N), GameStatsFactory.allocate(history.K),
+              history, player_names, **kwargs)
+    ep.run(num_iterations, logging=False, tol=1e-6)
+    return ep
+
+
+def test_run_stops_once_converged_and_damping_keeps_the_fixed_point():
+    N, K = 200, 2000
+    history = WinLossHistory(*synthetic_games(N, K), N)
+    reports = []
+    for damping in (0., 0.5):
+        ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                          None)
+        reports.append((ep.run(500, logging=False, tol=1e-5, damping=damping), ep.player_stats))
+    (report, player_stats), (damped_report, damped_player_stats) = reports
+    assert report.converged and report.iterations < 500
+    assert report.residuals[-1] < 1e-5 <= min(report.residuals[:-1])
+    assert damped_report.converged and damped_report.iterations > report.iterations
+    np.testing.assert_allclose(damped_player_stats[:, 0], player_stats[:, 0], atol=1e-3)
+
+
+def test_refine_after_add_games_tracks_full_fit():
+    N, K, new_games = 100, 2000, 50
+    winner_ids, losser_ids = synthetic_games(N, K + new_games)
+    ep = _fit(WinLossHistory(winner_ids[:K], losser_ids[:K], N))
+    ep.add_games(pd.DataFrame(dict(winner=winner_ids[K:] + 1, losser=losser_ids[K:] + 1)))
+    assert len(ep.pending_games) == new_games
+    ep.refine(20, scope='neighbourhood')
+    full = _fit(WinLossHistory(winner_ids, losser_ids, N))
+    np.testing.assert_allclose(ep.player_stats[:, 0, 0], full.player_stats[:, 0, 0], atol=0.02)
+
+
+def test_sharded_matches_serial():
+    N, K = 400, 4000
+    history = WinLossHistory(*synthetic_games(N, K, communities=4), N)
+    serial = _fit(history, 10)
+    sharded = _fit(history, 10, loop=ShardedMatrixEPLoop, num_workers=2)
+    np.testing.assert_allclose(sharded.player_stats[:, 0, 0], serial.player_stats[:, 0, 0],
+                               atol=1e-4)
+
+
+def test_snapshot_round_trip(tmp_path):
+    N, K = 50, 500
+    names = [f'player-{idx}' for idx in range(N)]
+    ep = _fit(WinLossHistory(*synthetic_games(N, K), N), 5, names, noise=0.5)
+    path = str(tmp_path / 'model.ep')
+    ep.save(path)
+    for mmap in (True, False):
+        loaded = MatrixEPLoop.load(path, mmap=mmap)
+        np.testing.assert_array_equal(loaded.player_stats, ep.player_stats)
+        np.testing.assert_array_equal(loaded.game_stats, ep.game_stats)
+        np.testing.assert_array_equal(loaded.history.winner_ids, ep.history.winner_ids)
+        assert [str(name) for name in loaded.player_names] == names
+        assert loaded.noise == 0.5
+
+
+def test_compressed_games_fit_as_the_original_ones():
+    N = 100
+    history = WinLossHistory(*repeated_pair_games(N, 20000, 500), N)
+    compressed = history.compress()
+    assert compressed.K < history.K
+    np.testing.assert_allclose(_fit(compressed).player_stats[:, 0, 0],
+                               _fit(history).player_stats[:, 0, 0], atol=1e-4)
+
+
+def _fit_policy(history: WinLossHistory, policy: str, tol: float, corrupt: bool = False,
+                sanitise: str = 'skip') -> MatrixEPLoop:
+    storage = DtypePolicy.resolve(policy).storage
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(history.N, storage),
+                      GameStatsFactory.allocate(history.K, storage), history, None,
+                      dtype_policy=policy, sanitise=sanitise)
+    if corrupt:
+        # a hugely negative message leaves the other games of the player a negative cavity
+        ep.game_stats[0, 5, :] = 0., -50.
+    with np.errstate(invalid='ignore'):
+        assert ep.run(300, logging=False, tol=tol).converged
+    return ep
+
+
+def test_dtype_policies_track_float64():
+    N, K = 100, 2000
+    history = WinLossHistory(*synthetic_games(N, K), N)
+    reference = _fit_policy(history, 'float64', 1e-7).player_stats[:, 0]
+    for policy in ('float32', 'mixed'):
+        ep = _fit_policy(history, policy, 1e-5)
+        assert ep.player_stats.dtype == np.float32
+        np.testing.assert_allclose(ep.player_stats[:, 0], reference, atol=1e-3)
+
+
+def test_sanitiser_recovers_from_invalid_messages():
+    N, K = 100, 2000
+    history = WinLossHistory(*synthetic_games(N, K), N)
+    reference = _fit_policy(history, 'float64', 1e-7).player_stats[:, 0]
+    for mode in ('skip', 'clip'):
+        ep = _fit_policy(history, 'float64', 1e-7, corrupt=True, sanitise=mode)
+        assert ep.num_sanitised > 0
+        np.testing.assert_allclose(ep.player_stats[:, 0], reference, atol=1e-6)
+    with pytest.raises(ValueError, match='games with invalid messages'):
+        _fit_policy(history, 'float64', 1e-7, corrupt=True, sanitise='raise')
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ranking_system.matrix_stats import WinLossHistory, GameStatsFactory
+
+
+def test_history_rejects_out_of_range_player_ids():
+    with pytest.raises(ValueError, match='losser ids'):
+        WinLossHistory(np.array([0, 1]), np.array([1, 3]), 3)
+    with pytest.raises(ValueError, match='winner ids'):
+        WinLossHistory.create_from_dataframe(pd.DataFrame(dict(winner=[0], losser=[1])), 3)
+    with pytest.raises(ValueError):
+        GameStatsFactory.create_from_records([dict(winner=4, losser=1)], 3)
+
+
+def test_compress_counts_repeated_games():
+    history = WinLossHistory(np.array([0, 0, 1, 0]), np.array([1, 1, 0, 2]), 3)
+    compressed = history.compress()
+    assert compressed.K == 3
+    assert compressed.num_games == history.K
+    np.testing.assert_array_equal(compressed.sum_over_wins(None), history.sum_over_wins(None))
+    np.testing.assert_array_equal(compressed.sum_over_losses(None),
+                                  history.sum_over_losses(None))
+
+
+def test_chunked_csv_and_records_match_read_csv(tmp_path):
+    N, K = 50, 70000  # more games than the builder's initial capacity
+    rng = np.random.default_rng(0)
+    game_df = pd.DataFrame(dict(winner=rng.integers(1, N + 1, K), losser=rng.integers(1, N + 1, K),
+                                draw=(rng.random(K) < 0.1).astype(int)))
+    path = tmp_path / 'games.csv'
+    game_df.to_csv(path, index=False)
+    expected = WinLossHistory.create_from_dataframe(pd.read_csv(path), N)
+    for history in (WinLossHistory.create_from_csv(path, N, chunksize=1000),
+                    WinLossHistory.create_from_records(game_df.to_dict('records'), N,
+                                                       batch_size=1000)):
+        np.testing.assert_array_equal(history.winner_ids, expected.winner_ids)
+        np.testing.assert_array_equal(history.losser_ids, expected.losser_ids)
+        np.testing.assert_array_equal(history.draws, expected.draws)
+    # draw flags written as booleans read the same
+    game_df.astype(dict(draw=bool)).to_csv(path, index=False)
+    np.testing.assert_array_equal(WinLossHistory.create_from_csv(path, N).draws, expected.draws)
@@ -0,0 +1,19 @@
+import numpy as np
+
+from benchmarks.common import synthetic_league
+from benchmarks.kernels import loop_update_skill_marginals
+from ranking_system.matrix_updates import MatrixSkillUpdates
+
+
+def test_incidence_aggregation_matches_player_loop():
+    N, K = 200, 2000
+    player_stats, game_stats, history = synthetic_league(N, K)
+    rng = np.random.default_rng(0)
+    game_stats[:, :7, 1] = rng.uniform(0.5, 1.5, size=(K, 7))
+    game_stats[:, :7, 0] = rng.standard_normal((K, 7))
+    loop_games, loop_players = loop_update_skill_marginals(
+        game_stats.copy(), player_stats.copy(), history, history.wins, history.losses)
+    game_stats, player_stats = MatrixSkillUpdates().update_skill_marginals(
+        game_stats, player_stats, history)
+    np.testing.assert_allclose(player_stats, loop_players, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(game_stats, loop_games, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,26 @@
+import tracemalloc
+
+import pytest
+
+from benchmarks.common import synthetic_league
+from ranking_system import profiling
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.profiling import SweepProfiler
+
+
+@pytest.mark.parametrize('reset_peak', [profiling._reset_peak, tracemalloc.clear_traces],
+                         ids=['reset_peak', 'python-3.8'])
+def test_traces_stage_memory(monkeypatch, reset_peak):
+    monkeypatch.setattr(profiling, '_reset_peak', reset_peak)
+    N, K = 100, 1000
+    ep = MatrixEPLoop(*synthetic_league(N, K), None)
+    profiler = SweepProfiler(trace_memory=True)
+    try:
+        ep.run(2, logging=False, profiler=profiler)
+    finally:
+        profiler.close()
+    assert len(profiler.sweeps) == 2
+    metrics = profiler.sweeps[-1]
+    assert set(metrics.stage_peak_bytes) == set(metrics.stage_seconds)
+    assert all(peak >= 0 for peak in metrics.stage_peak_bytes.values())
+    assert max(metrics.stage_peak_bytes.values()) > 0
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import scipy.stats
+
+from ranking_system.rank_uncertainty import RankUncertainty
+
+
+def test_rank_probabilities_sum_to_one():
+    N = 500
+    rng = np.random.default_rng(0)
+    means, precisions = rng.normal(0., 2., N), rng.uniform(0.5, 4., N)
+    players = np.array([0, 7, int(np.argmax(means)), N - 1])
+    # a small budget spreads the samples over several chunks
+    uncertainty = RankUncertainty(means, precisions, (1, 10, N + 5), players,
+                                  memory_budget=12 * N * 64, rng=rng).sample(1000)
+    np.testing.assert_allclose(uncertainty.rank_counts.sum(axis=1) / uncertainty.num_samples, 1.)
+    for k in (1, 10, N):
+        np.testing.assert_allclose(uncertainty.top_k_probability(k).sum(), k)
+    np.testing.assert_allclose(uncertainty.top_k_probability(N), 1.)
+    lower, upper = uncertainty.rank_interval(0.9)
+    assert np.all((0 <= lower) & (lower <= upper) & (upper < N))
+
+
+def test_top_1_probability_of_two_players():
+    means, precisions = np.array([0.5, 0.]), np.array([1., 4.])
+    uncertainty = RankUncertainty(means, precisions, (1,), rng=np.random.default_rng(0))
+    first = uncertainty.sample(20000).top_k_probability(1)
+    expected = scipy.stats.norm.cdf(0.5 / np.sqrt(1. + 1. / 4.))
+    np.testing.assert_allclose(first, [expected, 1. - expected], atol=0.01)
+
+
+def test_top_ks_must_be_positive():
+    with pytest.raises(ValueError, match='top_ks must be at least 1'):
+        RankUncertainty(np.zeros(3), np.ones(3), (0, 1))
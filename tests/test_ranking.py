@@ -0,0 +1,36 @@
+import numpy as np
+
+from ranking_system.ranking import Ranking
+
+
+def _ranking(means: np.ndarray, conservative: float = 0.) -> Ranking:
+    precisions = np.ones_like(means)
+    return Ranking(lambda: (means, precisions), conservative)
+
+
+def test_top_k_breaks_ties_by_player_index():
+    means = np.zeros(100)
+    means[50] = 1.
+    ranking = _ranking(means)
+    np.testing.assert_array_equal(ranking.top_k(3), [50, 0, 1])
+    np.testing.assert_array_equal(ranking.top_k(3), ranking.order()[:3])
+
+
+def test_top_k_with_ties_at_the_boundary():
+    means = np.random.default_rng(0).integers(0, 20, size=1000).astype(np.float64)
+    expected = np.argsort(-means, kind='stable')
+    for k in (1, 5, 10, 40):
+        np.testing.assert_array_equal(_ranking(means).top_k(k), expected[:k])
+    ranking = _ranking(means)
+    np.testing.assert_array_equal(ranking.page(10, 20), expected[10:30])
+    assert ranking.rank_of(int(expected[7])) == 7
+
+
+def test_conservative_scores_and_invalidate():
+    means, precisions = np.array([1., 0.9, 0.]), np.array([1., 100., 1.])
+    ranking = Ranking(lambda: (means, precisions), conservative=3.)
+    np.testing.assert_array_equal(ranking.order(), [1, 0, 2])
+    means[2] = 10.
+    assert ranking.top_k(1)[0] == 1
+    ranking.invalidate()
+    assert ranking.top_k(1)[0] == 2
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from flask_app.sampling import MatchGenerator
+
+# groups given out of order, with 1 to 4 images each
+IMAGES = pd.DataFrame({'id': np.arange(10), 'group_id': [3, 1, 3, 2, 4, 4, 3, 4, 4, 2]})
+GROUP_OF_IMAGE = dict(zip(IMAGES['id'].astype(str), IMAGES['group_id']))
+
+
+def _share_of_matches_with(matches, group) -> float:
+    return np.mean((matches['left'][1] == group) | (matches['right'][1] == group))
+
+
+def test_single_and_batched_matches_show_images_of_their_group():
+    generator = MatchGenerator(IMAGES)
+    for _ in range(100):
+        match = generator.generate_random_match()
+        (left_image, left_group), (right_image, right_group) = match['left'], match['right']
+        assert left_group != right_group
+        assert GROUP_OF_IMAGE[left_image] == left_group
+        assert GROUP_OF_IMAGE[right_image] == right_group
+    matches = generator.generate_random_matches(1000, rng=np.random.default_rng(0))
+    (left_images, left_groups), (right_images, right_groups) = matches['left'], matches['right']
+    assert np.all(left_groups != right_groups)
+    for images, groups in ((left_images, left_groups), (right_images, right_groups)):
+        np.testing.assert_array_equal([GROUP_OF_IMAGE[image] for image in images], groups)
+    # every image of group 4 is shown
+    assert set(left_images[left_groups == 4]) == {'4', '5', '7', '8'}
+
+
+def test_active_sampling_favours_close_uncertain_matches():
+    generator = MatchGenerator(IMAGES)
+    # group 4 is far ahead and certain, the others are close and uncertain
+    means, precisions = generator.posterior_by_group([4, 1, 2, 3, 5], [5., 0., 0.1, -0.1, 9.],
+                                                     [100., 1., 1., 1., 1.])
+    np.testing.assert_array_equal(means, [0., 0.1, -0.1, 5.])
+    matches = generator.generate_random_matches(2000, means, precisions,
+                                                rng=np.random.default_rng(0))
+    uniform = generator.generate_random_matches(2000, rng=np.random.default_rng(0))
+    assert _share_of_matches_with(matches, 4) < 0.1 < 0.4 < _share_of_matches_with(uniform, 4)
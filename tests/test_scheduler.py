@@ -0,0 +1,33 @@
+import numpy as np
+
+from ranking_system.matrix_stats import PlayerStatsFactory
+from ranking_system.scheduler import expected_information_gain, schedule_matches
+
+
+def _players(N: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    player_stats = PlayerStatsFactory.allocate(N, np.float64)
+    player_stats[:, 0, 0] = rng.standard_normal(N)
+    player_stats[:, 0, 1] = rng.uniform(0.5, 4., N)
+    return player_stats
+
+
+def test_information_gain_follows_the_noise():
+    player_stats = _players(20)
+    p1, p2 = np.arange(10), np.arange(10, 20)
+    noise = 0.25
+    # skills in units of the performance noise: the same model as unit noise
+    scaled = player_stats.copy()
+    scaled[:, 0, 0] /= np.sqrt(noise)
+    scaled[:, 0, 1] *= noise
+    np.testing.assert_allclose(expected_information_gain(player_stats, p1, p2, noise),
+                               expected_information_gain(scaled, p1, p2), rtol=1e-6)
+    assert not np.allclose(expected_information_gain(player_stats, p1, p2, noise),
+                           expected_information_gain(player_stats, p1, p2))
+
+
+def test_scheduled_pairs_are_distinct_players():
+    pairs = schedule_matches(_players(50), 10, num_random=50, rng=np.random.default_rng(0),
+                             noise=0.5)
+    assert pairs.shape == (10, 2)
+    assert len(np.unique(pairs)) == 20
@@ -0,0 +1,45 @@
+import functools
+
+import numpy as np
+
+from ranking_system.simulation import win_probability, simulate_games, simulate_tournament
+from ranking_system.utils import StandardGaussian
+
+NOISE = 0.5
+
+
+def _skills(N: int = 20):
+    rng = np.random.default_rng(0)
+    return rng.standard_normal(N), rng.uniform(0.5, 20., N)
+
+
+def _scalar_win_probability(means, precisions, player_1: int, player_2: int) -> float:
+    return StandardGaussian().cdf((means[player_1] - means[player_2]) / np.sqrt(
+        NOISE + 1. / precisions[player_1] + 1. / precisions[player_2]))
+
+
+def test_win_probability_matches_scalar_formula():
+    means, precisions = _skills()
+    pairs = np.random.default_rng(1).integers(0, len(means), size=(500, 2))
+    expected = [_scalar_win_probability(means, precisions, p1, p2) for p1, p2 in pairs]
+    np.testing.assert_allclose(win_probability(means, precisions, pairs[:, 0], pairs[:, 1],
+                                               NOISE), expected, rtol=1e-12)
+
+
+def test_simulate_games_matches_scalar_draws():
+    means, precisions = _skills()
+    pairs = np.random.default_rng(1).integers(0, len(means), size=(500, 2))
+    winners, lossers = simulate_games(means, precisions, pairs, np.random.default_rng(2), NOISE)
+    uniforms = np.random.default_rng(2).random(len(pairs))
+    for (p1, p2), u, winner, losser in zip(pairs, uniforms, winners, lossers):
+        p1_wins = u < _scalar_win_probability(means, precisions, p1, p2)
+        assert (winner, losser) == ((p1, p2) if p1_wins else (p2, p1))
+
+
+def test_simulate_tournament_with_a_bye():
+    means, precisions = _skills(3)
+    champions = simulate_tournament(means, precisions, [0, 1, 2, -1], 20000,
+                                    np.random.default_rng(3), NOISE)
+    p = functools.partial(_scalar_win_probability, means, precisions)
+    expected = p(0, 1) * p(2, 0) + p(1, 0) * p(2, 1)
+    assert abs(np.mean(champions == 2) - expected) < 0.02
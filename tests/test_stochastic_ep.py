@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import synthetic_games
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory
+from ranking_system.stochastic_ep import StochasticEPLoop
+
+N, K = 100, 3000
+
+
+def _history(draw_rate: float) -> WinLossHistory:
+    # draw_rate 0 still passes an (all False) draws mask through the draw code path
+    draws = np.random.default_rng(1).random(K) < draw_rate
+    return WinLossHistory(*synthetic_games(N, K), N, draws)
+
+
+@pytest.mark.parametrize('draw_margin, draw_rate', [(0., 0.), (0.5, 0.2)])
+def test_draws_converge_to_full_ep(draw_margin, draw_rate):
+    history = _history(draw_rate)
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                      None, draw_margin=draw_margin)
+    report = ep.run(500, logging=False, tol=1e-5)
+    assert report.converged and report.num_sanitised == 0
+    full_batch = StochasticEPLoop(PlayerStatsFactory.allocate(N), history, batch_size=K,
+                                  step_size=1., draw_margin=draw_margin)
+    assert full_batch.run(500, logging=False, tol=1e-4).converged
+    minibatches = StochasticEPLoop(PlayerStatsFactory.allocate(N), history, batch_size=500,
+                                   draw_margin=draw_margin)
+    minibatches.run(50, logging=False)
+    for stochastic in (full_batch, minibatches):
+        assert np.isfinite(stochastic.player_stats).all()
+        # averaged sites only approximate the per-game messages
+        np.testing.assert_allclose(stochastic.player_stats[:, 0, 0], ep.player_stats[:, 0, 0],
+                                   atol=0.1)
+        assert np.corrcoef(stochastic.player_stats[:, 0, 0], ep.player_stats[:, 0, 0])[0, 1] > 0.999
+
+
+def test_draws_need_a_positive_draw_margin():
+    # a draw has probability zero without a margin
+    history = _history(0.2)
+    for ep in (MatrixEPLoop(PlayerStatsFactory.allocate(N), GameStatsFactory.allocate(K), history,
+                            None),
+               StochasticEPLoop(PlayerStatsFactory.allocate(N), history)):
+        with pytest.raises(ValueError, match='positive draw margin'):
+            ep.run(1, logging=False)
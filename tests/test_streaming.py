@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from benchmarks.common import synthetic_games
+from ranking_system.matrix_stats import PlayerStatsFactory
+from ranking_system.streaming import StreamingRanker
+
+
+def test_update_games_matches_game_by_game_updates():
+    N = 50
+    winner_ids, losser_ids = synthetic_games(N, 500)
+    single = StreamingRanker(PlayerStatsFactory.allocate(N))
+    for winner, losser in zip(winner_ids.tolist(), losser_ids.tolist()):
+        single.update(winner, losser)
+    batched = StreamingRanker(PlayerStatsFactory.allocate(N), batch_size=64)
+    batched.update_games(winner_ids, losser_ids)
+    np.testing.assert_allclose(batched.player_stats[:, 0, :], single.player_stats[:, 0, :],
+                               rtol=1e-5, atol=1e-6)
+    assert batched.num_games == single.num_games == len(winner_ids)
+
+
+def test_empty_batch_is_a_no_op():
+    ranker = StreamingRanker(PlayerStatsFactory.allocate(5), record_messages=True)
+    empty = np.zeros((0,), dtype=np.int64)
+    ranker.update_games(empty, empty)
+    ranker.update_games(np.array([1]), np.array([0]))
+    ranker.update_games(empty, empty)
+    assert ranker.num_games == 1
+    assert ranker.to_matrix_ep().history.K == 1
+
+
+def test_rejects_out_of_range_player_ids():
+    ranker = StreamingRanker(PlayerStatsFactory.allocate(5))
+    with pytest.raises(ValueError, match=r'1 losser ids out of \[0, 5\)'):
+        ranker.update(0, -1)
+    with pytest.raises(ValueError, match=r'1 winner ids out of \[0, 5\)'):
+        ranker.update_games(np.array([0, 5]), np.array([1, 2]))
+    assert ranker.num_games == 0
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats
+
+from benchmarks.common import synthetic_games
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, TeamGameHistory, PlayerStatsFactory, \
+    GameStatsFactory
+from ranking_system.team_ep import TeamEPLoop
+
+
+def _team_games(teams, ranks) -> pd.DataFrame:
+    """
+    One row per player of each game, from the (1-based) players of each team of each game.
+    """
+    rows = [dict(game=game, team=team, player=player, rank=rank)
+            for game, (game_teams, game_ranks) in enumerate(zip(teams, ranks))
+            for team, (members, rank) in enumerate(zip(game_teams, game_ranks))
+            for player in members]
+    return pd.DataFrame(rows)
+
+
+def test_one_player_teams_match_the_two_player_engine():
+    N, K, num_iterations = 40, 400, 10
+    winner_ids, losser_ids = synthetic_games(N, K)
+    df = _team_games([[[w + 1], [l + 1]] for w, l in zip(winner_ids, losser_ids)], [[0, 1]] * K)
+    teams = TeamEPLoop.create_from_dataframe(df, PlayerStatsFactory.allocate(N, np.float64),
+                                             None, damping=0.)
+    teams.run(num_iterations, logging=False)
+    ep = MatrixEPLoop(PlayerStatsFactory.allocate(N, np.float64),
+                      GameStatsFactory.allocate(K, np.float64),
+                      WinLossHistory(winner_ids, losser_ids, N), None, dtype_policy='float64')
+    ep.run(num_iterations, logging=False)
+    np.testing.assert_allclose(teams.player_stats[:, 0], ep.player_stats[:, 0], atol=1e-12)
+
+
+def test_team_performance_is_the_sum_of_its_players():
+    # a single game is a single factor, on which EP is exact: each player's posterior is the
+    # moment match of the truncated team performance difference
+    means, variances, noise = np.array([0.5, -0.2, 0.1, 0.3]), np.array([1., 0.5, 2., 1.]), 0.7
+    player_stats = PlayerStatsFactory.allocate(4, np.float64)
+    player_stats[:, 1, 0], player_stats[:, 1, 1] = means, 1. / variances
+    history = TeamGameHistory.create_from_dataframe(_team_games([[[1, 2], [3, 4]]], [[0, 1]]), 4)
+    ep = TeamEPLoop(player_stats, history, None, damping=0., noise=noise)
+    assert ep.run(50, logging=False, tol=1e-12).converged
+    c = np.sqrt(noise + variances.sum())
+    t = (means[:2].sum() - means[2:].sum()) / c
+    psi = scipy.stats.norm.pdf(t) / scipy.stats.norm.cdf(t)
+    sign = np.array([1., 1., -1., -1.])
+    np.testing.assert_allclose(ep.player_stats[:, 0, 0], means + sign * variances / c * psi)
+    np.testing.assert_allclose(ep.player_stats[:, 0, 1],
+                               1. / (variances * (1. - variances / c ** 2 * psi * (psi + t))))
+
+
+def test_team_history_rejects_out_of_range_player_ids():
+    with pytest.raises(ValueError, match=r'1 member ids out of \[0, 3\)'):
+        TeamGameHistory.create_from_dataframe(_team_games([[[1, 2], [4]]], [[0, 1]]), 3)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from benchmarks.common import synthetic_games
+from ranking_system.matrix_ep import MatrixEPLoop
+from ranking_system.matrix_stats import WinLossHistory, PlayerStatsFactory, GameStatsFactory
+from ranking_system.temporal_ep import TemporalEPLoop
+
+
+def test_single_period_matches_the_static_engine():
+    N, K = 50, 1000
+    history = WinLossHistory(*synthetic_games(N, K), N)
+    temporal = TemporalEPLoop(history, np.zeros(K), dtype_policy='float64')
+    assert temporal.run(1000, logging=False, tol=1e-10).converged
+    static = MatrixEPLoop(PlayerStatsFactory.allocate(N, np.float64),
+                          GameStatsFactory.allocate(K, np.float64), history, None,
+                          dtype_policy='float64')
+    assert static.run(1000, logging=False, tol=1e-10).converged
+    means, precisions = temporal.skills_at(0)
+    np.testing.assert_allclose(means, static.player_stats[:, 0, 0], atol=1e-8)
+    np.testing.assert_allclose(precisions, static.player_stats[:, 0, 1], atol=1e-8)
@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from flask_app.training import TrainingWorker, InMemoryCollection
+
+PLAYERS = pd.DataFrame({'group_id': ['a', 'b', 'c']})
+
+
+def _wait_for(condition, timeout: float = 10.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def worker():
+    worker = TrainingWorker(InMemoryCollection(), PLAYERS, retrain_every=1, interval=60.)
+    yield worker
+    worker.stop()
+
+
+def test_first_round_on_an_empty_collection_publishes_a_snapshot(worker):
+    snapshot = worker.train()
+    assert worker.snapshot is snapshot
+    assert snapshot.version == 0
+    assert snapshot.num_games == 0
+    assert snapshot.player_names == ('a', 'b', 'c')
+
+
+def test_vote_triggers_a_retrain(worker):
+    worker.start()
+    _wait_for(lambda: worker.snapshot is not None)
+    first = worker.snapshot
+    worker.record_vote(3, 1)
+    _wait_for(lambda: worker.snapshot.version > first.version)
+    assert worker.snapshot.num_games == 1
+    assert worker.snapshot.top_players[0] == 'c'
+
+
+def test_players_are_the_groups_in_sorted_order_whatever_the_file_order():
+    worker = TrainingWorker(InMemoryCollection(), pd.DataFrame({'group_id': [30, 10, 30, 20]}))
+    assert [worker.player_id(group) for group in (10, 20, 30)] == [1, 2, 3]
+    assert worker.player_id(np.int64(30)) == 3
+    for group in (0, 15, 40):
+        with pytest.raises(ValueError, match='Unknown group'):
+            worker.player_id(group)
+    worker.record_vote(worker.player_id(30), worker.player_id(10))
+    snapshot = worker.train()
+    assert snapshot.player_names == (10, 20, 30)
+    assert snapshot.top_players[0] == 30
+
+
+def test_invalid_vote_is_rejected(worker):
+    for winner, losser in ((7, 1), (1, 0), (2.5, 1), ('2', 1)):
+        with pytest.raises(ValueError):
+            worker.record_vote(winner, losser)
+    assert worker.games_collection.count_documents({}) == 0
+    assert worker.num_matches == 0
+
+
+def test_unknown_players_in_the_collection_are_skipped(worker):
+    worker.games_collection.insert_one({'winner': 7, 'losser': 1})
+    worker.games_collection.insert_one({'winner': 2, 'losser': 1})
+    assert worker.train().num_games == 1
+    worker.games_collection.insert_one({'winner': 1, 'losser': 9})
+    worker.games_collection.insert_one({'winner': 3, 'losser': 2})
+    assert worker.train().num_games == 2
+
+
+def test_failed_round_keeps_the_worker_running():
+    failures = []
+
+    def describe(player):
+        if not failures:
+            failures.append(player)
+            raise RuntimeError('describe failed')
+        return player
+
+    worker = TrainingWorker(InMemoryCollection(), PLAYERS, describe=describe, retrain_every=1)
+    worker.start()
+    try:
+        worker.record_vote(2, 1)
+        _wait_for(lambda: worker.snapshot is not None)
+        assert failures and worker.is_alive()
+    finally:
+        worker.stop()
@@ -0,0 +1,47 @@
+import numpy as np
+import scipy.special
+import scipy.stats
+
+from ranking_system.utils import psi_lambda, psi_lambda_draw
+
+# Down to a 50 sigma upset, where pdf and cdf underflow in float64
+X = np.linspace(-50., 10., 6001)
+
+
+def _reference_psi(x: np.ndarray) -> np.ndarray:
+    return np.exp(scipy.stats.norm.logpdf(x) - scipy.special.log_ndtr(x))
+
+
+def test_psi_lambda_is_finite_in_the_tails():
+    psi, lambda_ = psi_lambda(X)
+    assert np.all(np.isfinite(psi))
+    assert np.all(np.isfinite(lambda_))
+
+
+def test_psi_matches_log_space_reference():
+    psi, _ = psi_lambda(X)
+    np.testing.assert_allclose(psi, _reference_psi(X), rtol=1e-10)
+
+
+def test_lambda_is_a_variance_reduction():
+    _, lambda_ = psi_lambda(X)
+    assert np.all(lambda_ >= 0.)
+    assert np.all(lambda_ < 1.)
+
+
+def test_psi_lambda_out_buffers_and_scalars():
+    out = (np.empty_like(X), np.empty_like(X))
+    psi, lambda_ = psi_lambda(X, out=out)
+    assert psi is out[0] and lambda_ is out[1]
+    np.testing.assert_array_equal(psi, psi_lambda(X)[0])
+    scalar_psi, scalar_lambda = psi_lambda(-30.)
+    assert np.ndim(scalar_psi) == 0 and np.isfinite(scalar_lambda)
+
+
+def test_psi_lambda_draw_matches_truncated_normal():
+    a = np.array([-40., -3., -0.5, 2., 30.])
+    b = a + np.array([0.5, 1., 1., 0.25, 2.])
+    psi, lambda_ = psi_lambda_draw(a, b)
+    truncated = scipy.stats.truncnorm(a, b)
+    np.testing.assert_allclose(psi, truncated.mean(), rtol=1e-6)
+    np.testing.assert_allclose(1. - lambda_, truncated.var(), rtol=1e-5)